@@ -1,16 +1,16 @@
 #!/usr/bin/env python
 
-import asyncio
-from pathlib import Path
-import websockets
-import json
-import yaml
-from yaml import SafeLoader
 import argparse
+import json
 import logging
+import sys
 import urllib.parse as urlparse
-import concurrent
-import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common import streaming
+from common.metrics import Metrics
+from common.retry import ServiceError
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s", datefmt='%Y-%m-%d %H:%M:%S')
@@ -18,126 +18,45 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(mess
 
 MAX_WORKER = 10
 URL = urlparse.urlparse("wss://asr.dui.ai/runtime/v2/recognize")
+METRICS = Metrics('casr_')  # stage timings of the sessions of this process
 
 
-def parse_config(conf):
-    with open(conf, encoding='utf8') as f:
-        data = yaml.load(f, Loader=SafeLoader)
-    try:
-        query = data['query']
-        msg = data['msg']
-    except KeyError:
-        logger.error(f"Parsing config failed, please check the yaml file.")
-        raise
-    return query, msg
-
-
-class ASRTask:
-    def __init__(self, name, url, params, audio: Path, chunk_size=1280, stride=0.04):
-        self.name = name
-        self.url = url
-        self.params = params
-        self.audio = audio
-        self.stride = stride
-        self.chunk_size = chunk_size
+class ASRTask(streaming.StreamTask):
+    audio_key = 'request'
+    metrics = METRICS
 
     async def _start(self, websocket):
         """Start a new ASR task."""
+        self._mark('connected')
         params = json.dumps(self.params, ensure_ascii=False)
         await websocket.send(params)
         logger.info(f"Requset params:{params}")
 
-
-    async def _feed(self, websocket):
-        """Read and Send audio data streamly.
-
-        Args:
-            audio (str): audio file path.
-            websocket ([type]): webSocket client connection.
-            stride (float, optional): interval for sending data. Defaults to 0.04.
-            size (int, optional): bytes of data to send every time. Defaults to 1280.
-        """
-        with open(self.audio, 'rb') as f:
-            while True:
-                data = f.read(self.chunk_size)
-                if data: 
-                    await websocket.send(data)
-                    await asyncio.sleep(self.stride)
-                else:
-                    await websocket.send(b'')   
-                    return
-    
-    async def _get(self, websocket):
-        """Fetch and display ASR transciption."""
-        data = []
+    async def _get(self, websocket, feeder):
+        """Yield partial and final hypotheses until the end of the session."""
         while True:
-            response = await websocket.recv()
-            response= json.loads(response)
+            response = json.loads(await self._recv(websocket, feeder))
+            self._mark('first_result')
             errno = response.get('eof')
+            result = response.get('result') or {}
             if errno == 0:
-                logger.info(f"{response.get('result')}")
-                if response.get('result').get('rec', None) is not None:
-                    data.append(response.get('result').get('rec'))
+                logger.debug(f"{result}")  # partial result
+                if result.get('var') is not None:
+                    yield self._hypothesis(result['var'], False, response)
+                if result.get('rec') is not None:
+                    yield self._hypothesis(result['rec'], True, response)
             elif errno == 1:
-                logger.info(f"{response.get('result')}")
-                data.append(response.get('result').get('rec'))
-                return data
+                logger.info(f"{result}")
+                self._mark('final')
+                yield self._hypothesis(result.get('rec') or '', True, response)
+                return
             else:
                 logger.error(f"{response}\nService exception.")
-                raise RuntimeError
-
-    async def naive_task(self):
-        """Run a naive task.
-        """
-        async with websockets.connect(self.url) as websocket:
-            await self._start(websocket)
-            task1 = asyncio.create_task(self._feed(websocket))
-            task2 = asyncio.create_task(self._get(websocket))
-
-            await task1   
-            data = await task2
-            return "".join(data)
-    
-    def run(self, task: str="naive"):
-        if task == "naive":
-            self.result = asyncio.run(self.naive_task())
-        else:
-            raise NotImplementedError(f'task type {task} is not supported yet.')
-        return self
+                raise ServiceError(f"service exception: {response}")
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("in_scp", type=str, help="Input scp file which consisit of key and value.")
-    parser.add_argument("out_trans", type=str, help="Output asr transcription.")
-    parser.add_argument("-c", dest="conf", required=True, type=str, help="Yaml file of configuration.")
-    args = parser.parse_args()
-
-    query, params = parse_config(args.conf)
-    url = URL._replace(query=urlparse.urlencode(query)).geturl()
-    in_scp = args.in_scp
-    out_trans = args.out_trans
-    logger.info(f'URL:{url}')
-
-    audio_list_fd = open(in_scp, 'r', encoding='utf8')
-    trans_file_fd = open(out_trans, 'w', encoding='utf8')   
-    try:
-
-        executor = concurrent.futures.ProcessPoolExecutor(max_workers=MAX_WORKER)
-        tasks = []
-        for record in audio_list_fd:
-            try:
-                key, audio = record.rstrip().split(maxsplit=1)
-            except ValueError:
-                audio = record.rstrip()
-                key=uuid.uuid1()
-            asr_task = ASRTask(key, url, params, audio)
-            tasks.append(executor.submit(asr_task.run, "naive"))
-
-        for future in concurrent.futures.as_completed(tasks):
-            asr_task = future.result()
-            trans_file_fd.write(f'{asr_task.name}\t{asr_task.result}\n')
-    finally:
-        audio_list_fd.close()
-        trans_file_fd.close()
+    streaming.add_arguments(parser, URL.geturl(), MAX_WORKER)
+    sys.exit(streaming.main(ASRTask, parser.parse_args()))
@@ -1,16 +1,32 @@
 #!/usr/bin/env python3
 
+import asyncio
 import uuid
-import os
 import sys
-import requests
 import json
 import argparse
 import logging
 import time
 import concurrent.futures
+from contextlib import ExitStack, nullcontext
+from functools import partial, wraps
 from os import path
 
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from common.adaptive import AdaptiveLimiter
+from common.aiotransport import AsyncTransport
+from common.cache import ResultCache, content_key, endpoint
+from common.journal import Journal
+from common.ledger import run_ledger
+from common.metrics import Metrics
+from common.pipeline import bounded_as_completed, bounded_map
+from common.poller import Poller, wait_done
+from common.ratelimit import RateLimits, parse_limits
+from common.resample import audio_view
+from common.retry import Retry, ServiceError, http_retryable
+from common.source import parse_source
+from common.transport import Transport
+
 
 PRODUCT_ID  = ''
 API_KEY     = ''
@@ -18,6 +34,7 @@ LASR_TASK_URL = 'http://lasr.duiopen.com/lasr-file-api/v2'
 LOGIN = "secret"  # file to save pid & apikey
 
 SAMPLE_RATE = 16000  # 采样率
+RESAMPLE = False  # 是否将其他格式的wav降为单声道16bit、SAMPLE_RATE采样率后上传
 USE_TXT_SMOOTH = 0  # 顺滑开关
 USE_INVERSE_TXT = 0  # 逆文本开关 
 SPEAK_NUMBER = 0  # 说话人，-1代表盲分
@@ -27,7 +44,14 @@ LANG= 'cn'
 LM_ID=''
 
 SLICE_LEN   = 2 * 1024 * 1024
-TMP_FOLDER  = ".slices"
+SLICE_PARALLEL = 4  # 单个文件并发上传的分片数
+
+HTTP = Transport()  # 复用连接的HTTP会话，所有接口共用
+AHTTP = None  # asyncio引擎的HTTP会话，在事件循环中按HTTP的配置创建
+RETRY = Retry()  # 单次接口调用的重试策略，熔断器所有接口共用
+CACHE = None  # 按音频内容和识别配置缓存结果，命令行--cache启用
+UPLOADS = None  # 分片上传的自适应并发数（AIMD），命令行--adaptive启用
+METRICS = Metrics('lasr_offline_')  # 各阶段耗时统计
 
 
 def get_login():
@@ -49,98 +73,66 @@ def get_login():
     return pid, key
 
 
-def abort(step, reason):
+def abort(step, reason, retryable=False):
     logging.error("[ %s ] %s", step ,reason)
-    raise RuntimeError
+    raise ServiceError('[ {} ] {}'.format(step, reason), retryable)
 
 
-def empty_tmp_folder():
-    if not os.path.exists(TMP_FOLDER):
-        os.mkdir(TMP_FOLDER)
-    else:
-        for f in os.listdir(TMP_FOLDER):
-            os.remove(os.path.join(TMP_FOLDER, f))
+def retried(fn):
+    """Retry a single API call with the module retry policy."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return RETRY.call(fn, *args, **kwargs)
+    return wrapper
 
 
-def upload_audio(audio, audio_type, path):
-    AUDIO_API_URL = '{}/audio'.format(LASR_TASK_URL)
+def retried_async(fn):
+    """Retry a single API coroutine with the module retry policy."""
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await RETRY.call_async(fn, *args, **kwargs)
+    return wrapper
 
-    audio_file = open(path, 'rb')
-    x_session_id = ''.join(str(uuid.uuid4()).split('-'))[0]
-    audio_file.seek(0, 2)
-    size = audio_file.tell()
-    slice_num, other = divmod(size, SLICE_LEN)
-    if other > 0: slice_num += 1
-    params  = dict(audio_type = audio_type, slice_num = slice_num)
-    headers = {
-            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "Connection": "close",
-            "x-sessionId": x_session_id
-        }
 
-    resp = requests.post(
-            str.format("{}?productId={}&apiKey={}", AUDIO_API_URL, PRODUCT_ID, API_KEY),
-            data = params,
-            headers = headers)
+# Each API is a request builder returning (url, kwargs of the transport) and
+# a check of the response, shared by the blocking and the asyncio engines.
 
-    audio_id = None
+def slice_request(audio, audio_id, x_session_id, slice_index, slice_data):
+    url = str.format('{}/audio/{}/slice/{}?productId={}&apiKey={}', LASR_TASK_URL, audio_id, slice_index, PRODUCT_ID, API_KEY)
+    headers = {
+        "x-sessionId": x_session_id,
+    }
+    files = { 'file': (audio + "." + str(slice_index), slice_data) }
+    return url, dict(endpoint = 'upload', files = files, headers = headers)
 
-    if resp.status_code == 200:
-        json = resp.json()
 
-        if json:
-            errno = json["errno"]
-            if errno:
-                abort('upload', 'failed create audio. res: {}'.format(resp.text))
-            else:
-                audio_id = json['data']["audio_id"]
-        else:
-            abort('upload', 'failed create audio. res: {}'.format(resp.text))
-    else:
-        abort('upload', 'failed create audio. code: {}, res: {}'.format(resp.status_code, resp.text))
+def check_upload(resp, what):
+    """Decoded response of the upload api, aborting on errors."""
+    if resp.status_code != 200:
+        abort('upload', 'failed {}. code: {}, res: {}'.format(what, resp.status_code, resp.text),
+              http_retryable(resp.status_code))
+    json = resp.json()
+    if not json or json["errno"]:
+        abort('upload', 'failed {}. res: {}'.format(what, resp.text))
+    return json
 
-    if audio_id:
-        slice_index = 0
-
-        while slice_index < slice_num:
-            audio_file.seek(slice_index * SLICE_LEN)
-
-            slice_file_path = os.path.join(TMP_FOLDER, audio + "." + str(slice_index))
-            slice_f = open(slice_file_path, 'wb')
-            slice_data = audio_file.read(SLICE_LEN)
-            slice_f.write(slice_data)
-            slice_f.close()
-
-            url = str.format('{}/{}/slice/{}?productId={}&apiKey={}', AUDIO_API_URL, audio_id, slice_index, PRODUCT_ID, API_KEY)
-            files = { 'file': open(slice_file_path, 'rb') }
-
-            headers = {
-                "x-sessionId": x_session_id,
-            }
-            resp = requests.post(url, files = files, headers = headers)
-
-            if resp.status_code == 200:
-                json = resp.json()
-
-                if json:
-                    errno = json["errno"]
-                    if errno:
-                        abort('upload', 'failed upload audio slice. res: {}'.format(resp.text))
-                    else:
-                        logging.info('audio: %s, id: %s, slice %d uploaded.', audio, audio_id, slice_index)
-                        slice_index += 1
-                else:
-                    abort('upload', 'failed upload audio slice. res: {}'.format(resp.text))
-            else:
-                abort('upload', 'failed upload audio slice. code: {}, res: {}'.format(resp.status_code, resp.text))
 
-    return audio_id
+def audio_request(audio_type, slice_num, x_session_id):
+    AUDIO_API_URL = '{}/audio'.format(LASR_TASK_URL)
 
+    params  = dict(audio_type = audio_type, slice_num = slice_num)
+    headers = {
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "x-sessionId": x_session_id
+        }
+    url = str.format("{}?productId={}&apiKey={}", AUDIO_API_URL, PRODUCT_ID, API_KEY)
+    return url, dict(endpoint = 'upload', data = params, headers = headers)
 
-def create_task(audio, audio_type, audio_id):
+
+def task_request(audio_type, audio_id):
     data = dict(
         #debug = 1,
-		lang = LANG,
+        lang = LANG,
         audio_type = audio_type,
         audio_id = audio_id,
         sample_rate = SAMPLE_RATE,
@@ -150,78 +142,460 @@ def create_task(audio, audio_type, audio_id):
         use_segment = USE_SEGMENT,
         use_aux = USE_AUX,
         enableConfidence = True,
-		lmid = LM_ID
+        lmid = LM_ID
         )
+    return LASR_TASK_URL + "/task?productId={0}&apiKey={1}".format(PRODUCT_ID, API_KEY), dict(endpoint='task', data=data)
 
-    resp = requests.post(LASR_TASK_URL + "/task?productId={0}&apiKey={1}".format(PRODUCT_ID, API_KEY), data=data)
-    if resp.status_code == 200:
-        jsonr = resp.json()
-        errno = jsonr.get('errno', 1)
-        if errno == 0:
-            data = jsonr['data']
-            return data['task_id']
-        else:
-            abort('task', 'failed create task. audio: {}, errno: {}, error: {}'.format(audio, errno, jsonr['error']))
-    else:
-        abort('task', 'failed create task. audio: {}, status code: {}, error: {}'.format(audio, resp.status_code, resp.text))
+
+def progress_request(task_id):
+    return "{0}/task/{1}/progress?productId={2}&apiKey={3}".format(LASR_TASK_URL, task_id, PRODUCT_ID, API_KEY), \
+        dict(endpoint='progress')
+
+
+def result_request(task_id):
+    return "{0}/task/{1}/result?productId={2}&apiKey={3}".format(LASR_TASK_URL, task_id, PRODUCT_ID, API_KEY), \
+        dict(endpoint='result')
+
+
+def check_task(resp, what, audio, task_id=None):
+    """Data of a response of the task api, aborting on errors."""
+    subject = 'audio: {}'.format(audio) if task_id is None else 'audio: {}, task: {}'.format(audio, task_id)
+    if resp.status_code != 200:
+        abort('task', 'failed {}. {}, status code: {}, error: {}'.format(what, subject, resp.status_code, resp.text),
+              http_retryable(resp.status_code))
+    jsonr = resp.json()
+    errno = jsonr.get('errno', 1)
+    if errno != 0:
+        abort('task', 'failed {}. {}, errno: {}, error: {}'.format(what, subject, errno, jsonr.get('error')))
+    return jsonr['data']
+
+
+def onebest(data):
+    return "".join(rec['onebest'] for rec in data['result'])
+
+
+@retried
+def upload_slice(audio, audio_id, x_session_id, view, slice_index):
+    """Upload one slice straight from a memoryview of the source file."""
+    # with --adaptive the slice holds a slot of UPLOADS, whose size follows errors and upload latency
+    with view[slice_index * SLICE_LEN:(slice_index + 1) * SLICE_LEN] as slice_data, \
+            (UPLOADS.slot() if UPLOADS is not None else nullcontext()):
+        url, kwargs = slice_request(audio, audio_id, x_session_id, slice_index, slice_data)
+        check_upload(HTTP.post(url, **kwargs), 'upload audio slice')
+    logging.info('audio: %s, id: %s, slice %d uploaded.', audio, audio_id, slice_index)
 
 
+@retried
+def create_audio(audio_type, slice_num, x_session_id):
+    url, kwargs = audio_request(audio_type, slice_num, x_session_id)
+    return check_upload(HTTP.post(url, **kwargs), 'create audio')['data']["audio_id"]
+
+
+def upload_audio(audio, audio_type, path):
+    x_session_id = ''.join(str(uuid.uuid4()).split('-'))[0]
+    start = time.perf_counter()
+    # slices are sent from a read-only mapping of the file or archive, without temp copies;
+    # wav in another format is converted to 16 bit mono SAMPLE_RATE, and pipes are read, into an anonymous temp file
+    with audio_view(path, SAMPLE_RATE if RESAMPLE else None) as view:
+        size = len(view)
+        slice_num, other = divmod(size, SLICE_LEN)
+        if other > 0: slice_num += 1
+
+        audio_id = create_audio(audio_type, slice_num, x_session_id)
+
+        if audio_id and slice_num:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=SLICE_PARALLEL) as executor:
+                futures = [executor.submit(upload_slice, audio, audio_id, x_session_id, view, slice_index)
+                           for slice_index in range(slice_num)]
+                for future in futures:
+                    future.result()
+
+    observe_upload(size, time.perf_counter() - start)
+    return audio_id
+
+
+def observe_upload(size, elapsed):
+    METRICS.observe('upload_seconds', elapsed)
+    if size and elapsed > 0:
+        METRICS.observe('upload_mbytes_per_second', size / elapsed / 1e6)
+
+
+@retried
+def create_task(audio, audio_type, audio_id):
+    url, kwargs = task_request(audio_type, audio_id)
+    return check_task(HTTP.post(url, **kwargs), 'create task', audio)['task_id']
+
+
+@retried
 def query_progress(audio, task_id):
-    resp = requests.get("{0}/task/{1}/progress?productId={2}&apiKey={3}".format(LASR_TASK_URL, task_id, PRODUCT_ID, API_KEY))
-
-    if resp.status_code == 200:
-        jsonr = resp.json()
-        errno = jsonr.get('errno', 1)
-        if errno == 0:
-            data = jsonr['data']
-            return data['progress']
-        else:
-            abort('task', 'failed query progress. audio: {}, task: {}, errno: {}, error: {}'.format(audio, task_id, errno, jsonr['error']))
-    else:
-        abort('task', 'failed query progress. audio: {}, task: {}, status code: {}, error: {}'.format(audio, task_id, resp.status_code, resp.text))
+    url, kwargs = progress_request(task_id)
+    return check_task(HTTP.get(url, **kwargs), 'query progress', audio, task_id)['progress']
 
 
+@retried
 def get_result(audio, task_id):
-    resp = requests.get("{0}/task/{1}/result?productId={2}&apiKey={3}".format(LASR_TASK_URL, task_id, PRODUCT_ID, API_KEY))
-
-    if resp.status_code == 200:
-        jsonr = resp.json()
-        errno = jsonr.get('errno', 1)
-        if errno == 0:
-            data = jsonr['data']['result']
-            data = [rec['onebest'] for rec in data]
-        else:
-            abort('task', 'failed save result. audio: {}, task: {}, errno: {}, error: {}'.format(audio, task_id, errno, jsonr['error']))
-    else:
-        abort('task', 'failed save result. audio: {}, task: {}, status code: {}, error: {}'.format(audio, task_id, resp.status_code, resp.text))
-    
-    return "".join(data)
+    url, kwargs = result_request(task_id)
+    return onebest(check_task(HTTP.get(url, **kwargs), 'save result', audio, task_id))
 
 
-def run(record):
-    key, audio = record.rstrip().split(maxsplit=1)
+@retried_async
+async def upload_slice_async(audio, audio_id, x_session_id, view, slice_index):
+    with view[slice_index * SLICE_LEN:(slice_index + 1) * SLICE_LEN] as slice_data:
+        async with (UPLOADS.async_slot() if UPLOADS is not None else nullcontext()):
+            url, kwargs = slice_request(audio, audio_id, x_session_id, slice_index, slice_data)
+            check_upload(await AHTTP.post(url, **kwargs), 'upload audio slice')
+    logging.info('audio: %s, id: %s, slice %d uploaded.', audio, audio_id, slice_index)
+
+
+@retried_async
+async def create_audio_async(audio_type, slice_num, x_session_id):
+    url, kwargs = audio_request(audio_type, slice_num, x_session_id)
+    return check_upload(await AHTTP.post(url, **kwargs), 'create audio')['data']["audio_id"]
+
+
+async def upload_audio_async(audio, audio_type, path):
+    """upload_audio in the event loop, with SLICE_PARALLEL slices of the file in flight."""
+    x_session_id = ''.join(str(uuid.uuid4()).split('-'))[0]
+    start = time.perf_counter()
+    # mapping, converting or spooling the audio blocks, so it runs in a thread
+    stack = ExitStack()
+    view = await asyncio.to_thread(stack.enter_context, audio_view(path, SAMPLE_RATE if RESAMPLE else None))
     try:
-        logging.info("Begin translate audio: %s, path: %s", key, audio)
-        audio_type = audio.rsplit('.')[-1]
+        size = len(view)
+        slice_num, other = divmod(size, SLICE_LEN)
+        if other > 0: slice_num += 1
+
+        audio_id = await create_audio_async(audio_type, slice_num, x_session_id)
+
+        if audio_id and slice_num:
+            parallel = asyncio.Semaphore(SLICE_PARALLEL)
+
+            async def upload(slice_index):
+                async with parallel:
+                    await upload_slice_async(audio, audio_id, x_session_id, view, slice_index)
+
+            # wait for every slice before the view is closed, then raise the first failure
+            results = await asyncio.gather(*(upload(i) for i in range(slice_num)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+    finally:
+        await asyncio.to_thread(stack.close)
+
+    observe_upload(size, time.perf_counter() - start)
+    return audio_id
+
+
+@retried_async
+async def create_task_async(audio, audio_type, audio_id):
+    url, kwargs = task_request(audio_type, audio_id)
+    return check_task(await AHTTP.post(url, **kwargs), 'create task', audio)['task_id']
+
+
+@retried_async
+async def query_progress_async(audio, task_id):
+    url, kwargs = progress_request(task_id)
+    return check_task(await AHTTP.get(url, **kwargs), 'query progress', audio, task_id)['progress']
 
-        audio_id = upload_audio(key, audio_type, audio)
+
+@retried_async
+async def get_result_async(audio, task_id):
+    url, kwargs = result_request(task_id)
+    return onebest(check_task(await AHTTP.get(url, **kwargs), 'save result', audio, task_id))
+
+
+def cache_key(audio):
+    """Content key of an audio file under the recognition options of this module."""
+    config = dict(url=endpoint(LASR_TASK_URL), product_id=PRODUCT_ID, lang=LANG, lm_id=LM_ID, sample_rate=SAMPLE_RATE,
+                  resample=RESAMPLE, use_txt_smooth=USE_TXT_SMOOTH, use_inverse_txt=USE_INVERSE_TXT, speaker_number=SPEAK_NUMBER,
+                  use_segment=USE_SEGMENT, use_aux=USE_AUX)
+    return content_key(audio, config)
+
+
+def cached(key, audio):
+    """Cache key and cached result of an audio, (None, None) without a cache."""
+    if CACHE is None:
+        return None, None
+    digest = cache_key(audio)
+    result = CACHE.get(digest)
+    if result is not None:
+        logging.info("Cached result of audio: %s", key)
+        METRICS.inc('cache_hits')
+    return digest, result
+
+
+def submit(key, audio, journal=None):
+    """Upload audio and create its task, re-attaching to the ids recorded in the journal."""
+    source = parse_source(audio)
+    audio_type = source.name.rsplit('.')[-1]
+    job = journal.job(key) if journal is not None else {}
+    task_id = job.get('task_id')
+    audio_id = job.get('audio_id')
+    if task_id:
+        logging.info("Resume task of audio: %s, task id: %s", key, task_id)
+        return task_id
+    if audio_id:
+        logging.info("Resume uploaded audio: %s, audio id: %s", key, audio_id)
+    else:
+        audio_id = upload_audio(key, audio_type, source)
         logging.info("Finished uploaded. audio: %s, path: %s, audio id: %s", key, audio, audio_id)
+        if journal is not None:
+            journal.record(key, audio_id=audio_id)
+    with METRICS.timer('create_task_seconds'):
         task_id = create_task(key, audio_type, audio_id)
+    if journal is not None:
+        journal.record(key, task_id=task_id)
+    return task_id
+
+
+async def submit_async(key, audio, journal=None):
+    """submit in the event loop."""
+    source = parse_source(audio)
+    audio_type = source.name.rsplit('.')[-1]
+    job = journal.job(key) if journal is not None else {}
+    task_id = job.get('task_id')
+    audio_id = job.get('audio_id')
+    if task_id:
+        logging.info("Resume task of audio: %s, task id: %s", key, task_id)
+        return task_id
+    if audio_id:
+        logging.info("Resume uploaded audio: %s, audio id: %s", key, audio_id)
+    else:
+        audio_id = await upload_audio_async(key, audio_type, source)
+        logging.info("Finished uploaded. audio: %s, path: %s, audio id: %s", key, audio, audio_id)
+        if journal is not None:
+            journal.record(key, audio_id=audio_id)
+    with METRICS.timer('create_task_seconds'):
+        task_id = await create_task_async(key, audio_type, audio_id)
+    if journal is not None:
+        journal.record(key, task_id=task_id)
+    return task_id
+
+
+class TaskWatch:
+    """Logs and stage timings of one created task, shared by both engines."""
+
+    def __init__(self, key, task_id, begin, digest):
+        self.key = key
+        self.task_id = task_id
+        self.begin = begin
+        self.digest = digest
+        # server queue and processing times, as precise as the polling interval
+        self.created = time.perf_counter()
+        self.started = None
+
+    def progress(self, progress):
+        logging.info("Translating audio: %s, task id: %s, progress: %d", self.key, self.task_id, progress)
+        now = time.perf_counter()
+        if progress > 0 and self.started is None:
+            self.started = now
+            METRICS.observe('queue_seconds', now - self.created)
+        if progress >= 100:
+            METRICS.observe('processing_seconds', now - self.started)
+        return progress
+
+    def finished(self, result):
+        logging.info("Finished translate audio: %s, task id: %s", self.key, self.task_id)
+        METRICS.observe('task_seconds', time.perf_counter() - self.begin)
+        METRICS.inc('tasks')
+        if self.digest is not None:
+            CACHE.put(self.digest, result)
+        return f'{self.key}\t{result}\n'
+
+
+def run(record, journal=None, poller=None):
+    """Transcribe one scp record.
+
+    With a poller the task is handed over once created and a Future of the
+    result line is returned, otherwise progress is polled in place.
+    """
+    key, audio = record.rstrip().split(maxsplit=1)
+    try:
+        digest, result = cached(key, audio)
+        if result is not None:
+            return f'{key}\t{result}\n'
+        logging.info("Begin translate audio: %s, path: %s", key, audio)
+        begin = time.perf_counter()
+        task_id = submit(key, audio, journal)
+        watch = TaskWatch(key, task_id, begin, digest)
 
-        while True:
-            progress = query_progress(key, task_id)
-            logging.info("Translating audio: %s, task id: %s, progress: %d", key, task_id, progress)
+        def poll():
+            with METRICS.timer('progress_request_seconds'):
+                return watch.progress(query_progress(key, task_id))
 
-            if progress >= 100:
+        def fetch():
+            with METRICS.timer('result_seconds'):
                 result = get_result(audio, task_id)
-                logging.info("Finished translate audio: %s, task id: %s", key, task_id)
-                return f'{key}\t{result}\n'
-            else:
-                time.sleep(1)
-    except RuntimeError:
+            return watch.finished(result)
+
+        if poller is not None:
+            return poller.watch(poll, fetch, name=key)
+
+        while poll() < 100:
+            time.sleep(1)
+        return fetch()
+    except (RuntimeError, OSError) as e:
+        logging.error("Failed audio: %s, %r", key, e)
+        METRICS.inc('failures')
         return 0
 
 
+async def run_async(record, journal=None, uploads=None, on_submit=None):
+    """Transcribe one scp record in the event loop, holding the uploads semaphore while uploading.
+
+    on_submit, if given, is called once the task is created on the server.
+    """
+    key, audio = record.rstrip().split(maxsplit=1)
+    try:
+        # hashing the audio for the cache reads the whole file
+        digest, result = await asyncio.to_thread(cached, key, audio)
+        if result is not None:
+            return f'{key}\t{result}\n'
+        async with (uploads or nullcontext()):
+            logging.info("Begin translate audio: %s, path: %s", key, audio)
+            begin = time.perf_counter()
+            task_id = await submit_async(key, audio, journal)
+        if on_submit is not None:
+            on_submit()
+        watch = TaskWatch(key, task_id, begin, digest)
+
+        async def poll():
+            with METRICS.timer('progress_request_seconds'):
+                return watch.progress(await query_progress_async(key, task_id))
+
+        await wait_done(poll, name=key)
+        with METRICS.timer('result_seconds'):
+            result = await get_result_async(audio, task_id)
+        return watch.finished(result)
+    except (RuntimeError, OSError) as e:
+        logging.error("Failed audio: %s, %r", key, e)
+        METRICS.inc('failures')
+        return 0
+
+
+def submit_only(record, journal):
+    """Upload one scp record and record its task id, without waiting for the result."""
+    key, audio = record.rstrip().split(maxsplit=1)
+    try:
+        if cached(key, audio)[1] is not None:
+            return 0  # collected from the cache without a task
+        task_id = submit(key, audio, journal)
+    except (RuntimeError, OSError) as e:
+        logging.error("Failed audio: %s, %r", key, e)
+        METRICS.inc('failures')
+        return 0
+    logging.info("Submitted audio: %s, task id: %s", key, task_id)
+    return 0
+
+
+def collect_only(record, journal):
+    """Fetch the result of a submitted record if its task is finished, else return 0."""
+    key, audio = record.rstrip().split(maxsplit=1)
+    try:
+        digest, result = cached(key, audio)
+    except OSError as e:
+        logging.error("Failed audio: %s, %r", key, e)
+        METRICS.inc('failures')
+        return 0
+    if result is not None:
+        return f'{key}\t{result}\n'
+    task_id = journal.job(key).get('task_id')
+    if not task_id:
+        logging.warning("No task submitted for audio: %s", key)
+        return 0
+    try:
+        progress = query_progress(key, task_id)
+        if progress < 100:
+            logging.info("Unfinished audio: %s, task id: %s, progress: %d", key, task_id, progress)
+            return 0
+        result = get_result(audio, task_id)
+    except (RuntimeError, OSError) as e:
+        logging.error("Failed audio: %s, %r", key, e)
+        METRICS.inc('failures')
+        return 0
+    logging.info("Collected audio: %s, task id: %s", key, task_id)
+    if digest is not None:
+        CACHE.put(digest, result)
+    return f'{key}\t{result}\n'
+
+
+async def main_async(in_scp, out_trans, nproc=1, resume=False, max_jobs=1000):
+    """Transcribe a scp list into out_trans in one event loop, uploading nproc files at a time.
+
+    All requests share one connection pool, configured like HTTP, and up to
+    max_jobs files are in flight without a thread each.
+    """
+    global AHTTP
+    AHTTP = AsyncTransport(HTTP.pool_size, HTTP.timeout, HTTP.limits)
+    audio_list_fd = open(in_scp, 'r', encoding='utf8')
+    trans_file_fd = open(out_trans, 'a' if resume else 'w', encoding='utf8')
+    journal = Journal(out_trans + '.journal', resume=resume)
+    try:
+        records = (record for record in audio_list_fd
+                   if record.strip() and not journal.is_done(record.split(maxsplit=1)[0]))
+        fn = partial(run_async, journal=journal, uploads=asyncio.Semaphore(nproc))
+        async for task in bounded_as_completed(fn, records, max_jobs):
+            try:
+                data = task.result()
+            except (RuntimeError, OSError) as e:
+                logging.error("Failed task: %r", e)
+                METRICS.inc('failures')
+                continue
+            if not data:
+                continue
+            trans_file_fd.write(data)
+            trans_file_fd.flush()
+            journal.record_done(data.split('\t', 1)[0])
+    finally:
+        audio_list_fd.close()
+        trans_file_fd.close()
+        journal.close()
+        await AHTTP.close()
+        AHTTP = None
+
+
+def main(in_scp, out_trans, nproc=1, resume=False, mode='run', max_jobs=1000, engine='threads'):
+    """Transcribe a scp list into out_trans with nproc threads and a poller of the created tasks.
+
+    The asyncio engine runs the same flow in an event loop, in run mode only.
+    """
+    if engine == 'asyncio':
+        return asyncio.run(main_async(in_scp, out_trans, nproc, resume, max_jobs))
+    audio_list_fd = open(in_scp, 'r', encoding='utf8')
+    # the journal is the manifest of submitted tasks, never truncate it in submit and collect modes
+    resume = resume or mode != 'run'
+    trans_file_fd = open(out_trans, 'a' if resume else 'w', encoding='utf8')
+    journal = Journal(out_trans + '.journal', resume=resume)
+    poller = Poller()
+    try:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=nproc)
+        records = (record for record in audio_list_fd
+                   if record.strip() and not journal.is_done(record.split(maxsplit=1)[0]))
+        if mode == 'submit':
+            fn, window = partial(submit_only, journal=journal), 2 * nproc
+        elif mode == 'collect':
+            fn, window = partial(collect_only, journal=journal), 2 * nproc
+        else:
+            fn, window = partial(run, journal=journal, poller=poller), max_jobs
+        for future in bounded_map(executor, fn, records, window):
+            try:
+                data = future.result()
+            except (RuntimeError, OSError) as e:
+                logging.error("Failed task: %r", e)  # retried as far as the policy allows
+                METRICS.inc('failures')
+                continue
+            if not data:
+                continue
+            trans_file_fd.write(data)
+            trans_file_fd.flush()
+            journal.record_done(data.split('\t', 1)[0])
+    finally:
+        audio_list_fd.close()
+        trans_file_fd.close()
+        journal.close()
+        poller.close()
+
+
 if __name__ == '__main__':
     logging.basicConfig(
         level=logging.INFO,
@@ -229,7 +603,44 @@ if __name__ == '__main__':
     )
 
     parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=LASR_TASK_URL,
+                        help='base url of the file api, e.g. of a local mock server')
     parser.add_argument('-nproc', '--nproc', dest='nproc', type=int, default=1, help='number of parallel jobs')
+    parser.add_argument('--slice-parallel', dest='slice_parallel', type=int, default=SLICE_PARALLEL,
+                        help='number of slices of one file uploaded concurrently')
+    parser.add_argument('--pool-size', dest='pool_size', type=int, default=None,
+                        help='max kept-alive connections per host, defaults to nproc * slice_parallel + 4')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='read timeout of every HTTP request in seconds')
+    parser.add_argument('--limit', action='append', default=[], metavar='ENDPOINT=QPS[:CONCURRENCY]',
+                        help='quota of an endpoint (upload, task, progress, result), can be repeated')
+    parser.add_argument('--resample', action='store_true',
+                        help='downmix and resample wav audio to 16 bit mono SAMPLE_RATE before upload')
+    parser.add_argument('--cache', default=None,
+                        help='SQLite file caching results by audio content and options, unchanged audio is not uploaded')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1024,
+                        help='max MB of cached results, least recently used are evicted')
+    parser.add_argument('--metrics', action='store_true',
+                        help='write stage timing histograms to out_trans.metrics.json and out_trans.metrics.prom')
+    parser.add_argument('--adaptive', type=int, default=None, metavar='MAX',
+                        help='adapt the concurrent slice uploads between 1 and MAX, starting at nproc * slice_parallel')
+    parser.add_argument('--retries', type=int, default=4,
+                        help='retries of a single API call on network errors, throttling and 5xx')
+    parser.add_argument('--max-jobs', dest='max_jobs', type=int, default=1000,
+                        help='max files submitted and not yet finished on the server')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip keys finished by a previous run, re-attach to their server jobs and append to out_trans.')
+    parser.add_argument('--mode', choices=['run', 'submit', 'collect'], default='run',
+                        help='run: submit and wait for results; submit: upload and record task ids in out_trans.journal; '
+                             'collect: append results of finished tasks to out_trans, can be repeated')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='asyncio: run mode in one event loop, -nproc files uploading and --max-jobs files in flight')
+    parser.add_argument('--ledger', default=None,
+                        help='ledger file on shared storage, all workers running this command share its units')
+    parser.add_argument('--unit-size', dest='unit_size', type=int, default=100,
+                        help='lines of the scp list in a unit of the ledger')
+    parser.add_argument('--lease', type=float, default=300.0,
+                        help='seconds after the last heartbeat of a worker its unit is given to another one')
     parser.add_argument('in_scp', help='Input scp file which consisit of key and value.')
     parser.add_argument('out_trans', help='Output asr transcription.')
 
@@ -241,17 +652,36 @@ if __name__ == '__main__':
     pid, key = get_login()
     PRODUCT_ID = pid
     API_KEY = key
+    LASR_TASK_URL = args.url
+    SLICE_PARALLEL = args.slice_parallel
+    RETRY = Retry(attempts=args.retries + 1)
+    RESAMPLE = RESAMPLE or args.resample
+    if args.adaptive:
+        UPLOADS = AdaptiveLimiter(nproc * SLICE_PARALLEL, args.adaptive)
+        # enough files in upload for the limit to grow up to its max
+        nproc = max(nproc, -(-args.adaptive // SLICE_PARALLEL))
+    HTTP = Transport(pool_size=args.pool_size or nproc * SLICE_PARALLEL + 4, timeout=(10, args.timeout),
+                     limits=RateLimits(parse_limits(args.limit)))
+    if args.cache:
+        CACHE = ResultCache(args.cache, args.cache_size << 20)
     
-    audio_list_fd = open(in_scp, 'r', encoding='utf8')
-    trans_file_fd = open(out_trans, 'w', encoding='utf8')
+    if args.ledger and args.mode != 'run':
+        parser.error('--ledger only works in run mode')
+    if args.engine == 'asyncio' and args.mode != 'run':
+        parser.error('--engine asyncio only works in run mode')
     try:
-        empty_tmp_folder()
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=nproc)
-        tasks = [executor.submit(run, record) for record in audio_list_fd]
-        for future in concurrent.futures.as_completed(tasks):
-            data = future.result()
-            trans_file_fd.write(data)
-            trans_file_fd.flush()
+        if args.ledger:
+            run_unit = partial(main, nproc=nproc, resume=True, max_jobs=args.max_jobs, engine=args.engine)
+            # files failed in a unit are retried with the unit, only failed units fail the run
+            failed = run_ledger(args.ledger, in_scp, out_trans, run_unit, args.unit_size, args.lease)
+        else:
+            main(in_scp, out_trans, nproc, args.resume, args.mode, args.max_jobs, args.engine)
+            failed = METRICS.count('failures')
     finally:
-        audio_list_fd.close()
-        trans_file_fd.close()
+        METRICS.log(logging.info)
+        if args.metrics:
+            METRICS.export(out_trans + '.metrics')
+        HTTP.close()
+        if CACHE is not None:
+            CACHE.close()
+    sys.exit(1 if failed else 0)
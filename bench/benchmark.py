@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Drive the runners against the local mock servers and report throughput.
+
+A set of synthetic utterances is transcribed by every selected runner,
+each in its own process, and the wall time, utterances per second, p50/p99
+latency of a task (from the runner's --metrics export) and the peak memory
+of the runner process are reported.
+"""
+
+import argparse
+import json
+import math
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import mock_servers
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# script, flag of the service url, flag of the concurrency, metric of the task latency
+RUNNERS = {
+    'casr': ('aispeech/aispeech_casr.py', '--url', '-j', 'session_seconds'),
+    'lasr_stream': ('aispeech/aispeech_lasr_stream.py', '--url', '-j', 'session_seconds'),
+    'lasr_offline': ('aispeech/aispeech_lasr_offline.py', '--url', '-nproc', 'task_seconds'),
+    'lfasr': ('iflyteck/iflyteck_lfasr.py', '--api-host', None, 'task_seconds'),
+}
+AUDIO_CONF = dict(audioType='wav', sampleRate=16000, channel=1, sampleBytes=2)
+
+
+def write_tone(path, seconds, sample_rate=16000):
+    """A 16 bit mono sine sweep, enough for the mocks which only count bytes."""
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        frames = int(seconds * sample_rate)
+        w.writeframes(struct.pack(f'<{frames}h', *(int(8000 * math.sin(2 * math.pi * (200 + i % 800) * i / sample_rate))
+                                                     for i in range(frames))))
+
+
+def prepare(workdir, utterances, seconds):
+    """Audio, scp list, configs and credential files of the runners in workdir."""
+    audio = workdir / 'utt.wav'
+    write_tone(audio, seconds)
+    with open(workdir / 'wav.scp', 'w', encoding='utf8') as f:
+        for i in range(utterances):
+            f.write(f'utt{i:06d} {audio}\n')
+    # yaml configs, written as json which yaml reads as well
+    query = dict(productId='mock', apikey='mock', res='aiuniversal', lang='zh-CN')
+    (workdir / 'casr.yaml').write_text(json.dumps(dict(query=query, msg=dict(request=dict(audio=AUDIO_CONF)))))
+    (workdir / 'lasr_stream.yaml').write_text(json.dumps(dict(query=query, msg=dict(params=dict(audio=AUDIO_CONF)))))
+    (workdir / 'secret').write_text('mock\nmock\n')
+    (workdir / 'APP_ID').write_text('mock\n')
+    (workdir / 'SECRET_KEY').write_text('mock\n')
+
+
+def wait_port(port, host='127.0.0.1', timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run_runner(name, workdir, url, concurrency, speed, extra=()):
+    """Run one runner to completion and return its report."""
+    script, url_flag, concurrency_flag, latency_metric = RUNNERS[name]
+    out_trans = workdir / f'{name}.txt'
+    cmd = [sys.executable, str(ROOT / script)]
+    if name in ('casr', 'lasr_stream'):
+        cmd += ['-c', str(workdir / f'{name}.yaml'), '--speed', str(speed)]
+    if concurrency_flag is not None:
+        cmd += [concurrency_flag, str(concurrency)]
+    cmd += [url_flag, url, '--metrics', *extra, str(workdir / 'wav.scp'), str(out_trans)]
+
+    start = time.perf_counter()
+    with open(workdir / f'{name}.log', 'w') as log:
+        proc = subprocess.Popen(cmd, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        # rusage of this child only, processes it forks are not included
+        _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+
+    with open(out_trans, encoding='utf8') as f:
+        done = sum(1 for line in f if line.strip())
+    latency = {}
+    metrics = Path(f'{out_trans}.metrics.json')
+    if metrics.exists():
+        latency = json.loads(metrics.read_text())['histograms'].get(latency_metric, {})
+    return dict(runner=name, returncode=os.waitstatus_to_exitcode(status), done=done, wall_seconds=wall,
+                utterances_per_second=done / wall if wall else 0.0,
+                p50_seconds=latency.get('p50'), p99_seconds=latency.get('p99'),
+                max_rss_mb=rusage.ru_maxrss / 1024)
+
+
+def print_report(reports, utterances):
+    print(f"{'runner':<14}{'done':>10}{'wall s':>10}{'utt/s':>10}{'p50 s':>10}{'p99 s':>10}{'rss MB':>10}")
+    for r in reports:
+        p50 = '-' if r['p50_seconds'] is None else f"{r['p50_seconds']:.3f}"
+        p99 = '-' if r['p99_seconds'] is None else f"{r['p99_seconds']:.3f}"
+        print(f"{r['runner']:<14}{r['done']:>5}/{utterances:<4}{r['wall_seconds']:>10.2f}"
+              f"{r['utterances_per_second']:>10.2f}{p50:>10}{p99:>10}{r['max_rss_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runners', nargs='+', choices=list(RUNNERS), default=list(RUNNERS))
+    parser.add_argument('-n', '--utterances', type=int, default=100, help='number of utterances')
+    parser.add_argument('--seconds', type=float, default=3.0, help='duration of every utterance')
+    parser.add_argument('-j', '--concurrency', type=int, default=10,
+                        help='-j of the stream runners and -nproc of lasr_offline')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='--speed of the stream runners, 0 sends as fast as the mock accepts')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the mocks add to every response')
+    parser.add_argument('--decode-speed', type=float, default=50.0,
+                        help='multiple of real time the offline mocks decode at')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests and sessions the mocks fail with a retryable error')
+    parser.add_argument('--base-port', type=int, default=18765, help='port of the first mock server')
+    parser.add_argument('--workdir', default=None, help='keep audio, outputs and logs here instead of a temp dir')
+    parser.add_argument('--json', default=None, help='also write the reports to this file')
+    parser.add_argument('extra', nargs=argparse.REMAINDER,
+                        help='arguments after -- are passed to every runner, e.g. -- --retries 8')
+    args = parser.parse_args()
+    extra = args.extra[1:] if args.extra[:1] == ['--'] else args.extra
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='asr_bench_')).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    prepare(workdir, args.utterances, args.seconds)
+    ports = {name: args.base_port + i for i, name in enumerate(mock_servers.PORTS)}
+    urls = mock_servers.urls(ports=ports)
+
+    mock = subprocess.Popen([sys.executable, str(Path(__file__).with_name('mock_servers.py')),
+                             '--base-port', str(args.base_port), '--latency', str(args.latency),
+                             '--decode-speed', str(args.decode_speed), '--error-rate', str(args.error_rate)],
+                            stdout=subprocess.DEVNULL, stderr=open(workdir / 'mock_servers.log', 'w'))
+    reports = []
+    try:
+        for port in ports.values():
+            wait_port(port)
+        for name in args.runners:
+            reports.append(run_runner(name, workdir, urls[name], args.concurrency, args.speed, extra))
+            print(f"{name} finished in {reports[-1]['wall_seconds']:.2f}s, exit code {reports[-1]['returncode']}")
+    finally:
+        mock.terminate()
+        mock.wait()
+    print(f'\nworkdir: {workdir}')
+    print_report(reports, args.utterances)
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump(reports, f, indent=2)
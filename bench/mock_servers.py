@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""Local stand-ins of the four ASR services, for load tests without quota.
+
+    casr          websocket, eof 0/1 results
+    lasr_stream   websocket, errno 7 greeting, 8/0 partial and sentence results, 9 final
+    lasr_offline  HTTP, audio/slice/task/progress/result of lasr-file-api v2
+    lfasr         HTTP, prepare/upload/merge/getProgress/getResult of iFlytek raasr
+
+Audio is assumed to be 16 kHz 16 bit mono to turn bytes into seconds.
+Every response is delayed by the latency, offline jobs take their audio
+duration divided by the decode speed, and a share of requests fails with a
+retryable error: close code 1011 for websockets, status 500 for HTTP.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.parse as urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_SECOND = 16000 * 2
+PORTS = dict(casr=8765, lasr_stream=8766, lasr_offline=8767, lfasr=8768)
+
+
+class Behaviour:
+    """Latency, decode speed and error injection shared by all mock servers.
+
+    Args:
+        latency (float, optional): seconds added to every response. Defaults to 0.
+        decode_speed (float, optional): multiple of real time offline jobs are decoded at. Defaults to 50.
+        error_rate (float, optional): share of requests and sessions failed. Defaults to 0.
+        partial_interval (float, optional): seconds of audio between partial results of streams. Defaults to 1.
+        sentence_interval (float, optional): seconds of audio in a sentence result of lasr_stream. Defaults to 5.
+        seed (int, optional): seed of the error injection.
+    """
+
+    def __init__(self, latency=0.0, decode_speed=50.0, error_rate=0.0, partial_interval=1.0, sentence_interval=5.0,
+                 seed=None):
+        self.latency = latency
+        self.decode_speed = decode_speed
+        self.error_rate = error_rate
+        self.partial_interval = partial_interval
+        self.sentence_interval = sentence_interval
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def processing_seconds(self, nbytes):
+        return nbytes / BYTES_PER_SECOND / self.decode_speed
+
+
+def transcript(nbytes):
+    return f'mock{nbytes / BYTES_PER_SECOND:.2f}s'
+
+
+async def casr_handler(websocket, behaviour):
+    await websocket.recv()  # request params
+    if behaviour.fail():
+        await websocket.close(1011, 'injected error')
+        return
+    received, partials = 0, 0
+    async for message in websocket:
+        if not message:
+            break
+        received += len(message)
+        if received / BYTES_PER_SECOND >= (partials + 1) * behaviour.partial_interval:
+            partials += 1
+            await websocket.send(json.dumps({'eof': 0, 'result': {'var': transcript(received)}}))
+    await asyncio.sleep(behaviour.latency)
+    await websocket.send(json.dumps({'eof': 1, 'result': {'rec': transcript(received)}}))
+
+
+async def lasr_stream_handler(websocket, behaviour):
+    await websocket.recv()  # request params
+    await asyncio.sleep(behaviour.latency)
+    if behaviour.fail():
+        await websocket.close(1011, 'injected error')
+        return
+    await websocket.send(json.dumps({'errno': 7, 'data': {}}))
+    # results cover the audio since the last sentence, the final one only the last sentence
+    received, partials, sentence = 0, 0, 0
+    async for message in websocket:
+        if not message:
+            break
+        received += len(message)
+        if received - sentence >= behaviour.sentence_interval * BYTES_PER_SECOND:
+            await websocket.send(json.dumps({'errno': 0, 'data': {'onebest': transcript(received - sentence)}}))
+            sentence = received
+        elif received / BYTES_PER_SECOND >= (partials + 1) * behaviour.partial_interval:
+            partials += 1
+            await websocket.send(json.dumps({'errno': 8, 'data': {'var': transcript(received - sentence)}}))
+    await asyncio.sleep(behaviour.latency)
+    await websocket.send(json.dumps({'errno': 9, 'data': {'onebest': transcript(received - sentence)}}))
+
+
+class JobStore:
+    """Uploaded bytes and decode deadlines of offline jobs."""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.sizes = {}
+        self.jobs = {}  # job id: (created, seconds to decode, bytes)
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f'{prefix}{next(self.ids):08d}'
+
+    def add_bytes(self, ident, nbytes):
+        with self.lock:
+            self.sizes[ident] = self.sizes.get(ident, 0) + nbytes
+
+    def start(self, job, nbytes):
+        with self.lock:
+            self.jobs[job] = (time.monotonic(), self.behaviour.processing_seconds(nbytes), nbytes)
+
+    def progress(self, job):
+        """Decode progress in [0, 100] and the bytes of the job, None if unknown."""
+        with self.lock:
+            if job not in self.jobs:
+                return None
+            created, seconds, nbytes = self.jobs[job]
+        if seconds <= 0:
+            return 100, nbytes
+        return min(100, int(100 * (time.monotonic() - created) / seconds)), nbytes
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the runners pool connections
+    behaviour = None
+    store = None
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _form(self, body):
+        """Fields of an urlencoded or multipart body, file parts are skipped."""
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            fields = {}
+            boundary = content_type.split('boundary=', 1)[1].encode()
+            for part in body.split(b'--' + boundary):
+                head, _, value = part.partition(b'\r\n\r\n')
+                match = re.search(rb'name="([^"]*)"', head)
+                if match and b'filename=' not in head:
+                    fields[match.group(1).decode()] = value[:-2].decode('utf8', 'replace')
+            return fields
+        return dict(urlparse.parse_qsl(body.decode('utf8')))
+
+    def _send(self, payload, status=200):
+        data = json.dumps(payload).encode('utf8')
+        time.sleep(self.behaviour.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        body = self._body()
+        if self.behaviour.fail():
+            self._send({'error': 'injected error'}, status=500)
+            return
+        path = urlparse.urlparse(self.path).path
+        self._send(self.route(method, path, body))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class LasrOfflineHandler(MockHandler):
+
+    def route(self, method, path, body):
+        match = re.search(r'/audio/([^/]+)/slice/\d+$', path)
+        if match:
+            self.store.add_bytes(match.group(1), len(body))
+            return {'errno': 0, 'data': {}}
+        if path.endswith('/audio'):
+            return {'errno': 0, 'data': {'audio_id': self.store.new_id('audio')}}
+        if path.endswith('/task'):
+            audio_id = self._form(body).get('audio_id')
+            task_id = self.store.new_id('task')
+            self.store.start(task_id, self.store.sizes.get(audio_id, 0))
+            return {'errno': 0, 'data': {'task_id': task_id}}
+        match = re.search(r'/task/([^/]+)/(progress|result)$', path)
+        state = self.store.progress(match.group(1)) if match else None
+        if state is None:
+            return {'errno': 1, 'error': f'unknown request {method} {path}'}
+        progress, nbytes = state
+        if match.group(2) == 'progress':
+            return {'errno': 0, 'data': {'progress': progress}}
+        return {'errno': 0, 'data': {'result': [{'onebest': transcript(nbytes)}]}}
+
+
+class LfasrHandler(MockHandler):
+
+    def route(self, method, path, body):
+        form = self._form(body)
+        api = path.rsplit('/', 1)[-1]
+        if api == 'prepare':
+            task_id = self.store.new_id('task')
+            self.store.add_bytes(task_id, int(form.get('file_len', 0)))
+            return {'ok': 0, 'err_no': 0, 'data': task_id}
+        if api in ('upload', 'merge'):
+            if api == 'merge':
+                task_id = form.get('task_id')
+                self.store.start(task_id, self.store.sizes.get(task_id, 0))
+            return {'ok': 0, 'err_no': 0, 'data': None}
+        state = self.store.progress(form.get('task_id'))
+        if state is None or api not in ('getProgress', 'getResult'):
+            return {'ok': -1, 'err_no': 26601, 'failed': f'unknown request {path}'}
+        progress, nbytes = state
+        if api == 'getProgress':
+            if progress == 0:
+                return {'ok': -1, 'err_no': 26605, 'failed': 'task is processing'}
+            status = 9 if progress >= 100 else 3 + progress * 6 // 100
+            return {'ok': 0, 'err_no': 0, 'data': json.dumps({'status': status})}
+        if progress < 100:
+            return {'ok': -1, 'err_no': 26605, 'failed': 'task is processing'}
+        return {'ok': 0, 'err_no': 0, 'data': json.dumps([{'onebest': transcript(nbytes)}])}
+
+
+def serve_http(handler, port, behaviour, host='127.0.0.1'):
+    """Start a threaded HTTP mock in a daemon thread and return the server."""
+    handler = type(handler.__name__, (handler,), dict(behaviour=behaviour, store=JobStore(behaviour)))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def serve(behaviour, ports=PORTS, host='127.0.0.1'):
+    """Run all four mocks until cancelled."""
+    http_servers = [serve_http(LasrOfflineHandler, ports['lasr_offline'], behaviour, host),
+                    serve_http(LfasrHandler, ports['lfasr'], behaviour, host)]
+    try:
+        async with websockets.serve(lambda ws: casr_handler(ws, behaviour), host, ports['casr'], max_size=None), \
+                websockets.serve(lambda ws: lasr_stream_handler(ws, behaviour), host, ports['lasr_stream'],
+                                 max_size=None):
+            for name, port in ports.items():
+                logger.info(f'{name}: {urls(host, ports)[name]}')
+            await asyncio.Future()
+    finally:
+        for server in http_servers:
+            server.shutdown()
+
+
+def urls(host='127.0.0.1', ports=PORTS):
+    """Url of every mock, as passed to --url of the runners."""
+    return dict(casr=f"ws://{host}:{ports['casr']}/runtime/v2/recognize",
+                lasr_stream=f"ws://{host}:{ports['lasr_stream']}/live/ws2",
+                lasr_offline=f"http://{host}:{ports['lasr_offline']}/lasr-file-api/v2",
+                lfasr=f"http://{host}:{ports['lfasr']}/api")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s", datefmt='%Y-%m-%d %H:%M:%S')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=PORTS['casr'],
+                        help='port of casr, lasr_stream, lasr_offline and lfasr follow it')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--decode-speed', type=float, default=50.0,
+                        help='multiple of real time offline jobs are decoded at')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests and sessions failed with a retryable error')
+    parser.add_argument('--partial-interval', type=float, default=1.0,
+                        help='seconds of audio between partial results of streams')
+    parser.add_argument('--sentence-interval', type=float, default=5.0,
+                        help='seconds of audio in a sentence result of lasr_stream')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the error injection')
+    args = parser.parse_args()
+
+    behaviour = Behaviour(args.latency, args.decode_speed, args.error_rate, args.partial_interval,
+                          args.sentence_interval, args.seed)
+    ports = {name: args.base_port + i for i, name in enumerate(PORTS)}
+    try:
+        asyncio.run(serve(behaviour, ports, args.host))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,95 @@
+"""AIMD concurrency limit, common.adaptive."""
+
+import asyncio
+from contextlib import ExitStack
+
+import pytest
+
+from common.adaptive import AdaptiveLimiter
+from common.retry import ServiceError
+
+
+def fail(limiter, exc):
+    with pytest.raises(type(exc)):
+        with limiter.slot():
+            raise exc
+
+
+def succeed(limiter, slots=1, latency=0.01):
+    """Hold `slots` slots at once, all finishing with the given latency."""
+    with ExitStack() as stack:
+        for _ in range(slots):
+            stack.enter_context(limiter.slot()).latency = latency
+
+
+def test_grows_while_saturated():
+    limiter = AdaptiveLimiter(1, 3)
+    succeed(limiter)
+    assert limiter.limit == 2
+    succeed(limiter)  # one busy slot of two is no sign more would help
+    assert limiter.limit == 2
+    for _ in range(4):
+        succeed(limiter, slots=limiter.limit)
+    assert limiter.limit == 3  # up to the maximum
+
+
+def test_service_error_halves():
+    limiter = AdaptiveLimiter(8, 8)
+    fail(limiter, ServiceError('throttled', retryable=True))
+    assert limiter.limit == 4
+    fail(limiter, ServiceError('throttled'))
+    assert limiter.limit == 2
+    fail(limiter, ServiceError('throttled'))
+    fail(limiter, ServiceError('throttled'))
+    assert limiter.limit == 1  # down to the minimum
+
+
+def test_other_errors_only_free_the_slot():
+    limiter = AdaptiveLimiter(4, 8)
+    fail(limiter, ValueError('bad audio'))
+    assert limiter.limit == 4
+    assert limiter.in_use == 0
+
+
+def test_failures_of_slots_taken_before_a_decrease_echo_it():
+    limiter = AdaptiveLimiter(8, 8)
+    with pytest.raises(ServiceError):
+        with limiter.slot():
+            fail(limiter, ServiceError('throttled'))
+            assert limiter.limit == 4
+            raise ServiceError('throttled')
+    assert limiter.limit == 4
+    fail(limiter, ServiceError('throttled'))
+    assert limiter.limit == 2
+
+
+def test_latency_spike_shrinks():
+    limiter = AdaptiveLimiter(4, 4, warmup=3, tolerance=0.0)
+    for _ in range(3):
+        succeed(limiter, latency=1.0)
+    assert limiter.limit == 4
+    succeed(limiter, latency=1.5)
+    assert limiter.limit == 4
+    succeed(limiter, latency=3.0)
+    assert limiter.limit == 2
+
+
+def test_async_slots_bound_concurrency():
+    limiter = AdaptiveLimiter(2, 2)
+    busy = peak = 0
+
+    async def job():
+        nonlocal busy, peak
+        async with limiter.async_slot():
+            busy += 1
+            peak = max(peak, busy)
+            await asyncio.sleep(0.01)
+            busy -= 1
+
+    async def run():
+        await asyncio.gather(*(job() for _ in range(10)))
+
+    asyncio.run(run())
+    asyncio.run(run())  # a new loop gets its own condition
+    assert peak == 2
+    assert limiter.in_use == 0
@@ -0,0 +1,58 @@
+"""Result cache keyed by audio content and config, common.cache."""
+
+import time
+
+from common.cache import ResultCache, content_key, endpoint
+
+
+def test_endpoint_drops_the_query():
+    assert endpoint('wss://lasr.duiopen.com/live/ws2?productId=1&apikey=secret') == 'wss://lasr.duiopen.com/live/ws2'
+
+
+def test_key_depends_on_the_endpoint(tmp_path):
+    audio = tmp_path / 'a.wav'
+    audio.write_bytes(b'\0' * 64)
+    keys = {content_key(str(audio), dict(url=endpoint(url), lang='cn'))
+            for url in ('http://lasr.duiopen.com/lasr-file-api/v2', 'http://127.0.0.1:8767/lasr-file-api/v2',
+                        'http://lasr.duiopen.com/lasr-file-api/v3')}
+    assert len(keys) == 3
+
+
+def test_copies_share_a_key_and_changes_miss(tmp_path):
+    audio, copy, other = tmp_path / 'a.wav', tmp_path / 'b.wav', tmp_path / 'c.wav'
+    audio.write_bytes(b'\1' * 64)
+    copy.write_bytes(b'\1' * 64)
+    other.write_bytes(b'\2' * 64)
+    config = dict(lang='cn', vad=None)
+    key = content_key(str(audio), config)
+    assert content_key(str(copy), dict(vad=None, lang='cn')) == key
+    assert content_key(str(other), config) != key
+    assert content_key(str(audio), dict(config, lang='en')) != key
+
+
+def test_pipe_content_is_hashed(tmp_path):
+    audio = tmp_path / 'a.wav'
+    audio.write_bytes(b'\1' * 64)
+    assert content_key(f'cat {audio} |', {}) == content_key(str(audio), {})
+
+
+def test_get_put_and_persistence(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    with ResultCache(path) as cache:
+        assert cache.get('k') is None
+        cache.put('k', dict(result='你好', offset_map=None))
+    with ResultCache(path) as cache:
+        assert cache.get('k') == dict(result='你好', offset_map=None)
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    with ResultCache(str(tmp_path / 'cache.db'), max_size=100) as cache:
+        for key in 'abc':
+            cache.put(key, 'x' * 20)  # 23 bytes with the key and the quotes
+            time.sleep(0.01)
+        cache.get('a')
+        time.sleep(0.01)
+        cache.put('d', 'x' * 20)
+        cache.put('e', 'x' * 20)
+        assert cache.get('b') is None
+        assert [cache.get(key) is not None for key in 'acde'] == [True, True, True, True]
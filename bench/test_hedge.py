@@ -0,0 +1,93 @@
+"""Hedged jobs over two providers, common.hedge."""
+
+import asyncio
+
+import pytest
+
+from common.hedge import HedgeDelay, hedged
+
+
+def job(seconds, result='text', error=None, log=None, name=None):
+    """Coroutine function of a job taking seconds, recording whether it finished or was cancelled."""
+    async def run():
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f'{name} cancelled')
+            raise
+        if error is not None:
+            raise error
+        return result
+    return run
+
+
+def test_fast_primary_is_not_hedged():
+    hedges = []
+    result = asyncio.run(hedged(job(0.01, 'a'), job(0.01, 'b'), 0.2, on_hedge=hedges.append))
+    assert result == ('a', 0)
+    assert hedges == []
+
+
+def test_lagging_primary_is_hedged_and_cancelled():
+    hedges, log = [], []
+    result = asyncio.run(hedged(job(1.0, 'a', log=log, name='primary'), job(0.01, 'b'), 0.05,
+                                on_hedge=hedges.append))
+    assert result == ('b', 1)
+    assert hedges == [False]
+    assert log == ['primary cancelled']
+
+
+def test_failed_primary_fails_over_at_once():
+    hedges = []
+
+    async def run():
+        start = asyncio.get_running_loop().time()
+        result = await hedged(job(0.01, error=ConnectionResetError()), job(0.01, 'b'), 10.0,
+                              on_hedge=hedges.append)
+        return result, asyncio.get_running_loop().time() - start
+
+    result, seconds = asyncio.run(run())
+    assert result == ('b', 1)
+    assert hedges == [True]
+    assert seconds < 1.0
+
+
+def test_empty_result_is_a_failure():
+    assert asyncio.run(hedged(job(0.01, ''), job(0.01, 'b'), 10.0)) == ('b', 1)
+
+
+def test_primary_still_wins_after_the_hedge():
+    assert asyncio.run(hedged(job(0.1, 'a'), job(1.0, 'b'), 0.05)) == ('a', 0)
+
+
+def test_error_of_the_secondary_when_both_fail():
+    with pytest.raises(ValueError):
+        asyncio.run(hedged(job(0.01, error=ConnectionResetError()), job(0.01, error=ValueError()), 0.05))
+
+
+def test_delay_starts_when_the_primary_submits():
+    async def run():
+        started = asyncio.Event()
+
+        async def primary():
+            await asyncio.sleep(0.2)  # waiting for an upload slot
+            started.set()
+            await asyncio.sleep(0.05)
+            return 'a'
+
+        return await hedged(primary, job(0.01, 'b'), 0.1, started=started)
+
+    assert asyncio.run(run()) == ('a', 0)
+
+
+def test_delay_learns_the_turnaround_per_mbyte():
+    delay = HedgeDelay(percentile=50, initial=300, minimum=1, warmup=3)
+    assert delay.delay(5e6) == 300
+    for seconds in (10, 20, 30):
+        delay.observe(seconds, 2e6)  # 5, 10 and 15 s per MB
+    assert delay.delay(4e6) == pytest.approx(40)
+    assert delay.delay(1e3) == pytest.approx(10)  # small files count as one MB
+    short = HedgeDelay(minimum=60, warmup=1)
+    short.observe(1)
+    assert short.delay() == 60
@@ -0,0 +1,124 @@
+"""Units of a batch shared by many workers, common.ledger."""
+
+import os
+import time
+
+import pytest
+
+from common.ledger import DONE, FAILED, LEASED, Ledger, merge_parts, missing_keys, run_ledger
+
+
+def write_scp(path, lines):
+    path.write_text(''.join(f'utt{i:02d} /audio/{i}.wav\n' for i in range(lines)))
+    return str(path)
+
+
+def keys(path):
+    return [line.split('\t', 1)[0] for line in open(path, encoding='utf8')]
+
+
+class Units:
+    """run_unit transcribing only the keys `skip` does not return, counting the runs of every unit."""
+
+    def __init__(self, skip=lambda key, run: False, error=lambda run: False):
+        self.skip = skip
+        self.error = error
+        self.runs = {}
+
+    def __call__(self, scp, out):
+        run = self.runs[scp] = self.runs.get(scp, 0) + 1
+        if self.error(run):
+            raise ConnectionResetError('dropped')
+        done = set(keys(out)) if os.path.exists(out) else set()  # resumed
+        with open(out, 'a', encoding='utf8') as f:
+            for line in open(scp, encoding='utf8'):
+                key = line.split()[0]
+                if key not in done and not self.skip(key, run):
+                    f.write(f'{key}\ttext of {key}\n')
+
+
+def test_all_units_are_merged_in_scp_order(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 10)
+    out = str(tmp_path / 'trans')
+    units = Units()
+    assert run_ledger(str(tmp_path / 'ledger'), scp, out, units, unit_size=3) == 0
+    assert len(units.runs) == 4
+    assert keys(out) == [f'utt{i:02d}' for i in range(10)]
+
+
+def test_unit_missing_keys_is_released_and_resumed(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 6)
+    out = str(tmp_path / 'trans')
+    units = Units(skip=lambda key, run: key == 'utt04' and run == 1)
+    assert run_ledger(str(tmp_path / 'ledger'), scp, out, units, unit_size=3) == 0
+    assert sorted(units.runs.values()) == [1, 2]
+    assert sorted(keys(out)) == [f'utt{i:02d}' for i in range(6)]  # a unit is in the order its files finished
+
+
+def test_failed_run_is_released(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 3)
+    out = str(tmp_path / 'trans')
+    units = Units(error=lambda run: run < 3)
+    assert run_ledger(str(tmp_path / 'ledger'), scp, out, units, unit_size=3) == 0
+    assert list(units.runs.values()) == [3]
+    assert len(keys(out)) == 3
+
+
+def test_unit_fails_after_max_leases_and_its_keys_are_merged(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 6)
+    out = str(tmp_path / 'trans')
+    units = Units(skip=lambda key, run: key == 'utt04')
+    ledger = str(tmp_path / 'ledger')
+    assert run_ledger(ledger, scp, out, units, unit_size=3) == 1
+    assert sorted(units.runs.values()) == [1, 5]
+    # the finished keys of the failed unit are kept
+    assert keys(out) == ['utt00', 'utt01', 'utt02', 'utt03', 'utt05']
+    with Ledger(ledger) as shared:
+        assert shared.counts()[FAILED] == 1
+
+
+def test_missing_keys(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 3)
+    out = tmp_path / 'out'
+    assert missing_keys(scp, str(out)) == {'utt00', 'utt01', 'utt02'}
+    out.write_text('utt01\ta\nutt02\n')  # a line without a value is no result
+    assert missing_keys(scp, str(out)) == {'utt00', 'utt02'}
+
+
+def test_expired_lease_goes_to_another_worker(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 2)
+    path = str(tmp_path / 'ledger')
+    with Ledger(path, lease=0.05, worker='a') as a, Ledger(path, lease=0.05, worker='b') as b:
+        assert a.create(scp, str(tmp_path / 'parts'), unit_size=2) == 1
+        assert b.create(scp, str(tmp_path / 'parts'), unit_size=2) == 1
+        unit, _, _ = a.acquire()
+        assert b.acquire() is None
+        assert a.renew(unit)
+        time.sleep(0.1)
+        assert b.acquire()[0] == unit
+        assert not a.renew(unit)
+        assert not a.complete(unit)
+        assert b.complete(unit)
+        assert b.counts()[DONE] == 1 and b.counts()[LEASED] == 0
+        assert b.claim_merge()
+        assert not a.claim_merge()  # merged once
+
+
+def test_ledger_of_another_list(tmp_path):
+    scp = write_scp(tmp_path / 'wav.scp', 4)
+    path = str(tmp_path / 'ledger')
+    with Ledger(path) as ledger:
+        ledger.create(scp, str(tmp_path / 'parts'), unit_size=2)
+        with pytest.raises(ValueError):
+            ledger.create(scp, str(tmp_path / 'parts'), unit_size=3)
+
+
+def test_merge_keeps_the_first_line_of_a_key(tmp_path):
+    first, second = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    first.write_text('utt1\tone\nutt2\ttwo\n')
+    second.write_text('utt2\tagain\nutt3\tthree\n')
+    (tmp_path / 'b.txt.offsets').write_text('utt3\t[]\n')
+    out = str(tmp_path / 'trans')
+    merge_parts([str(first), str(second)], out)
+    assert open(out).read() == 'utt1\tone\nutt2\ttwo\nutt3\tthree\n'
+    assert open(out + '.offsets').read() == 'utt3\t[]\n'
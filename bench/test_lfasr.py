@@ -0,0 +1,68 @@
+"""Responses of the iFlytek raasr api as read by iflyteck_lfasr."""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('requests')
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'iflyteck'))
+from common.retry import ServiceError
+
+# the module reads its credentials from the working directory when imported
+_cwd = os.getcwd()
+with tempfile.TemporaryDirectory() as _creds:
+    for name in ('APP_ID', 'SECRET_KEY'):
+        Path(_creds, name).write_text('mock\n')
+    os.chdir(_creds)
+    try:
+        import iflyteck_lfasr as lfasr
+    finally:
+        os.chdir(_cwd)
+
+
+class Response:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(payload)
+
+
+PROCESSING = {'ok': -1, 'err_no': lfasr.ERR_NO_PROCESSING, 'failed': 'task is processing'}
+
+
+def api():
+    return lfasr.RequestApi.__new__(lfasr.RequestApi)
+
+
+def test_processing_progress_is_in_progress():
+    result = lfasr.check_response(lfasr.api_get_progress, Response(PROCESSING))
+    assert api().read_progress('task', result) == 0
+
+
+def test_progress_of_a_running_and_a_finished_job():
+    job = api()
+    job.started = job.merged = None
+    running = lfasr.check_response(lfasr.api_get_progress, Response({'ok': 0, 'err_no': 0, 'data': '{"status": 3}'}))
+    assert 0 < job.read_progress('task', running) < 100
+    done = lfasr.check_response(lfasr.api_get_progress, Response({'ok': 0, 'err_no': 0, 'data': '{"status": 9}'}))
+    assert job.read_progress('task', done) == 100
+
+
+def test_processing_result_is_retried():
+    with pytest.raises(ServiceError) as error:
+        lfasr.check_response(lfasr.api_get_result, Response(PROCESSING))
+    assert error.value.retryable
+
+
+def test_failed_job_is_not_retried():
+    with pytest.raises(ServiceError) as error:
+        lfasr.check_response(lfasr.api_get_progress, Response({'ok': -1, 'err_no': 26601, 'failed': 'bad task'}))
+    assert not error.value.retryable
+
+
+def test_result_joins_sentences():
+    data = json.dumps([{'onebest': '你好'}, {'onebest': '世界'}])
+    assert lfasr.check_response(lfasr.api_get_result, Response({'ok': 0, 'err_no': 0, 'data': data})) == '你好世界'
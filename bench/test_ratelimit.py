@@ -0,0 +1,77 @@
+"""Client side quotas, common.ratelimit."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.ratelimit import Limiter, RateLimits, TokenBucket, parse_limits
+
+
+def test_parse_limits():
+    assert parse_limits(['connect=20:200', 'progress=50', 'upload=:8']) == {
+        'connect': (20.0, 200), 'progress': (50.0, None), 'upload': (None, 8)}
+    assert parse_limits(None) == {}
+
+
+def test_quotas_are_divided_between_shards():
+    assert parse_limits(['connect=20:200', 'upload=:3'], shards=4) == {'connect': (5.0, 50), 'upload': (None, 1)}
+
+
+@pytest.mark.parametrize('spec', ['connect', 'connect=fast', 'connect=1:2.5', 'download=10'])
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        parse_limits([spec])
+
+
+def test_bucket_spaces_requests_after_the_burst():
+    bucket = TokenBucket(10, burst=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)  # served in reservation order
+
+
+def test_limits_by_endpoint():
+    limits = RateLimits(parse_limits(['connect=5:2']))
+    assert (limits('connect').qps, limits('connect').concurrency) == (5.0, 2)
+    assert limits('upload') is limits('result')
+    assert limits('upload').qps is None and limits('upload').concurrency is None
+
+
+def test_thread_slots():
+    limiter = Limiter(concurrency=2)
+    busy = peak = 0
+    lock = threading.Lock()
+
+    def job():
+        nonlocal busy, peak
+        with limiter:
+            with lock:
+                busy += 1
+                peak = max(peak, busy)
+            time.sleep(0.02)
+            with lock:
+                busy -= 1
+
+    threads = [threading.Thread(target=job) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == 2
+
+
+def test_async_rate():
+    limiter = Limiter(qps=50)
+
+    async def run():
+        start = time.monotonic()
+        for _ in range(60):
+            async with limiter:
+                pass
+        return time.monotonic() - start
+
+    # a burst of 50, then 10 more at 50 per second
+    assert 0.15 < asyncio.run(run()) < 0.5
@@ -0,0 +1,107 @@
+"""Retry policy and circuit breaker, common.retry."""
+
+import asyncio
+
+import pytest
+
+from common.retry import CircuitBreaker, Retry, ServiceError, http_retryable, is_retryable
+
+
+class Flaky:
+    """Raises the given errors in turn, then returns 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def no_backoff(**kwargs):
+    return Retry(base=0.0, breaker=CircuitBreaker(threshold=100), **kwargs)
+
+
+def test_classification():
+    assert is_retryable(ConnectionResetError())
+    assert is_retryable(asyncio.TimeoutError())
+    assert not is_retryable(ValueError())
+    assert is_retryable(ServiceError('throttled', retryable=True))
+    assert not is_retryable(ServiceError('bad audio'))
+    assert [http_retryable(status) for status in (200, 400, 429, 500, 503)] == [False, False, True, True, True]
+
+
+def test_retryable_errors_are_retried():
+    fn = Flaky(ConnectionResetError(), ServiceError('busy', retryable=True))
+    assert no_backoff().call(fn) == 'ok'
+    assert fn.calls == 3
+
+
+def test_other_errors_fail_at_once():
+    fn = Flaky(ServiceError('bad audio'))
+    with pytest.raises(ServiceError):
+        no_backoff().call(fn)
+    assert fn.calls == 1
+
+
+def test_last_error_is_raised_after_all_attempts():
+    fn = Flaky(*[ConnectionResetError(i) for i in range(5)])
+    with pytest.raises(ConnectionResetError) as error:
+        no_backoff(attempts=3).call(fn)
+    assert fn.calls == 3
+    assert error.value.args == (2,)
+
+
+def test_classify_overrides_the_default():
+    fn = Flaky(ValueError(), ValueError())
+    assert no_backoff(classify=lambda exc: isinstance(exc, ValueError)).call(fn) == 'ok'
+
+
+def test_call_async():
+    fn = Flaky(ConnectionResetError())
+
+    async def coro():
+        return fn()
+
+    assert asyncio.run(no_backoff().call_async(coro)) == 'ok'
+    assert fn.calls == 2
+
+
+def test_backoff_is_capped_full_jitter():
+    retry = Retry(base=1.0, cap=4.0)
+    for attempt in range(8):
+        assert 0 <= retry.backoff(attempt) <= min(4.0, 2 ** attempt)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=3, cooldown=30.0)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.remaining()
+    breaker.failure()
+    assert 29 < breaker.remaining() <= 30
+
+
+def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker(threshold=1, cooldown=30.0)
+    breaker.failure()
+    fn = Flaky()
+    with pytest.raises(ServiceError, match='circuit open'):
+        Retry(breaker=breaker, fail_fast=True).call(fn)
+    assert fn.calls == 0
+
+
+def test_open_breaker_pauses_callers(monkeypatch):
+    breaker = CircuitBreaker(threshold=1, cooldown=30.0)
+    breaker.failure()
+    slept = []
+    monkeypatch.setattr('common.retry.time.sleep', slept.append)
+    assert Retry(breaker=breaker).call(Flaky()) == 'ok'
+    assert 29 < slept[0] <= 30
+    assert breaker.failures == 0  # a success closes the count again
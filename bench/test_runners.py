@@ -0,0 +1,97 @@
+"""Smoke test: every runner transcribes a small batch against the local mock servers.
+
+The file scripts also run on their asyncio engine, and the hedge script
+with a delay short enough that jobs go to both providers.
+
+Run with `python -m pytest bench`. Needs the packages of the runners and of
+the mocks, i.e. websockets, aiohttp, requests, pyyaml and numpy.
+"""
+
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import benchmark
+import mock_servers
+
+ROOT = Path(__file__).resolve().parents[1]
+UTTERANCES = 20
+SECONDS = 2.0
+
+
+def free_base_port():
+    """First of as many consecutive free ports as there are mock servers."""
+    while True:
+        base = random.randrange(20000, 60000)
+        try:
+            for port in range(base, base + len(mock_servers.PORTS)):
+                with socket.socket() as s:
+                    s.bind(('127.0.0.1', port))
+            return base
+        except OSError:
+            continue
+
+
+@pytest.fixture(scope='module')
+def mocks(tmp_path_factory):
+    """Audio and configs in a temp dir, and the urls of running mock servers."""
+    workdir = tmp_path_factory.mktemp('bench')
+    benchmark.prepare(workdir, UTTERANCES, SECONDS)
+    base = free_base_port()
+    ports = {name: base + i for i, name in enumerate(mock_servers.PORTS)}
+    mock = subprocess.Popen([sys.executable, str(Path(benchmark.__file__).with_name('mock_servers.py')),
+                             '--base-port', str(base), '--sentence-interval', '0.5'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for port in ports.values():
+            benchmark.wait_port(port)
+        yield workdir, mock_servers.urls(ports=ports)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+def check_output(out_trans, returncode, log, sentences=1):
+    """Every utterance has a result, whose sentences add up to the whole audio."""
+    lines = out_trans.read_text().splitlines()
+    assert returncode == 0, log
+    assert len(lines) == UTTERANCES, log
+    for line in lines:
+        seconds = [float(s) for s in re.findall(r'mock([\d.]+)s', line)]
+        assert sum(seconds) == pytest.approx(SECONDS, abs=0.01), line
+        assert len(seconds) >= sentences, line
+
+
+@pytest.mark.parametrize('runner', list(benchmark.RUNNERS))
+def test_runner(mocks, runner):
+    workdir, urls = mocks
+    report = benchmark.run_runner(runner, workdir, urls[runner], concurrency=5, speed=0.0)
+    check_output(workdir / f'{runner}.txt', report['returncode'], (workdir / f'{runner}.log').read_text(),
+                 sentences=2 if runner == 'lasr_stream' else 1)
+
+
+@pytest.mark.parametrize('runner', ['lasr_offline', 'lfasr'])
+def test_asyncio_engine(mocks, runner):
+    workdir, urls = mocks
+    report = benchmark.run_runner(runner, workdir, urls[runner], concurrency=5, speed=0.0,
+                                  extra=['--engine', 'asyncio'])
+    check_output(workdir / f'{runner}.txt', report['returncode'], (workdir / f'{runner}.log').read_text())
+
+
+def test_hedge(mocks):
+    """A hedge delay shorter than the decode of the mock hedges jobs, each file still has one result."""
+    workdir, urls = mocks
+    out_trans = workdir / 'hedge.txt'
+    proc = subprocess.run([sys.executable, str(ROOT / 'hedge' / 'lasr_hedge.py'), '--url', urls['lasr_offline'],
+                           '--api-host', urls['lfasr'], '--hedge-delay', '0.01', '--hedge-min', '0', '-nproc', '5',
+                           '--metrics', str(workdir / 'wav.scp'), str(out_trans)],
+                          cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=300)
+    check_output(out_trans, proc.returncode, proc.stdout)
+    counters = json.loads((workdir / 'hedge.txt.metrics.json').read_text())['counters']
+    assert counters.get('hedges', 0) > 0, proc.stdout
@@ -0,0 +1,62 @@
+"""Cut points of common.segment, on audio whose quietest frame is at the end of every search window."""
+
+import math
+import struct
+import wave
+
+import pytest
+
+from common.segment import open_segment, plan_segments, source_info, stitch
+
+pytest.importorskip('numpy')
+
+SAMPLE_RATE = 16000
+
+
+def write_fading(path, seconds):
+    """A 16 bit mono tone fading out linearly."""
+    frames = int(seconds * SAMPLE_RATE)
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(struct.pack(f'<{frames}h', *(int(20000 * (1 - i / frames) * math.sin(0.17 * i))
+                                                     for i in range(frames))))
+    return str(path)
+
+
+def check_spans(spans, frames):
+    assert spans[0][0] == 0 and spans[-1][1] == frames
+    for start, end in spans:
+        assert 0 <= start < end <= frames
+    for (start, end), (following, _) in zip(spans, spans[1:]):
+        assert start < following <= end  # in order, overlapping or touching
+
+
+@pytest.mark.parametrize('segments,min_duration,search', [(10, 2.0, 5.0), (20, 1.0, 5.0), (4, 1.0, 0.01), (8, 2.0, 30)])
+def test_spans_increase_with_overlapping_windows(tmp_path, segments, min_duration, search):
+    path = write_fading(tmp_path / 'fading.wav', 20)
+    info = source_info(path)
+    spans = plan_segments(path, info, segments, min_duration=min_duration, search=search)
+    check_spans(spans, info.data_size // 2)
+    assert 1 < len(spans) <= segments
+
+
+def test_segments_open_as_wav(tmp_path):
+    path = write_fading(tmp_path / 'fading.wav', 20)
+    info = source_info(path)
+    for start, end in plan_segments(path, info, 10, min_duration=2.0):
+        with open_segment(path, info, start, end) as f:
+            data = f.read()
+        assert len(data) == 44 + (end - start) * 2
+
+
+def test_short_audio_is_one_segment(tmp_path):
+    path = write_fading(tmp_path / 'fading.wav', 3)
+    info = source_info(path)
+    assert plan_segments(path, info, 8, min_duration=60) == [(0, info.data_size // 2)]
+
+
+def test_stitch_drops_repeated_text():
+    assert stitch(['今天天气不错', '不错我们出去', '出去玩']) == '今天天气不错我们出去玩'
+    assert stitch(['abc', 'xyz']) == 'abcxyz'
@@ -0,0 +1,88 @@
+"""Audio sources of scp lines: files, Kaldi archives and pipes, common.source."""
+
+import io
+
+import pytest
+
+import benchmark
+from common.source import ArkSource, FileSource, PipeReader, PipeSource, open_source, parse_source
+
+
+@pytest.fixture
+def wav(tmp_path):
+    path = tmp_path / 'utt.wav'
+    benchmark.write_tone(path, 0.5)
+    return path
+
+
+def write_ark(path, entries):
+    """Kaldi archive of wav entries, returning the `ark:offset` of each as `ark,scp` writes them."""
+    offsets = []
+    with open(path, 'wb') as f:
+        for key, data in entries:
+            f.write(f'{key} '.encode())
+            offsets.append(f'{path}:{f.tell()}')
+            f.write(b'\0B' + data)
+    return offsets
+
+
+def test_parse_source(wav, tmp_path):
+    assert isinstance(parse_source(str(wav)), FileSource)
+    assert isinstance(parse_source(f' cat {wav} | '), PipeSource)
+    assert isinstance(parse_source(f'{tmp_path}/a.ark:12'), ArkSource)
+    source = FileSource(str(wav))
+    assert parse_source(source) is source
+
+
+def test_ark_entries(wav, tmp_path):
+    data = wav.read_bytes()
+    first, second = write_ark(tmp_path / 'wav.ark', [('utt1', data), ('utt2', data[:44] + data[44:1044])])
+    source = parse_source(second)
+    assert parse_source(first).size() == len(data)
+    assert source.size() == 1044  # the header claims more than the archive holds
+    with open_source(first) as f:
+        assert f.read() == data
+    assert source.probe().sample_rate == 16000
+    with source.view() as view:
+        assert bytes(view[:4]) == b'RIFF'
+
+
+def test_ark_entry_must_be_wav(tmp_path):
+    offset, = write_ark(tmp_path / 'wav.ark', [('utt1', b'not a wav file')])
+    with pytest.raises(ValueError):
+        parse_source(offset).open()
+
+
+def test_pipe_probe_hands_its_reader_to_open(wav):
+    source = parse_source(f'cat {wav} |')
+    assert source.size() is None and not source.seekable
+    assert source.probe().data_offset == 44
+    probed = source.probed
+    with source.open() as f:
+        assert f is probed
+        assert f.read() == wav.read_bytes()
+    with source.open() as f:  # the command runs again
+        assert f.read(4) == b'RIFF'
+    with source.view() as view:
+        assert bytes(view) == wav.read_bytes()
+
+
+def test_pipe_reader_seeks_within_its_head(wav):
+    data = wav.read_bytes()
+    with PipeReader(f'cat {wav}', keep=100) as f:
+        assert f.read(60) == data[:60]
+        f.seek(10)
+        assert f.read(100) == data[10:110]  # from the head, then from the pipe
+        f.seek(2000)
+        assert f.read(10) == data[2000:2010]
+        with pytest.raises(io.UnsupportedOperation):
+            f.seek(1000)
+        with pytest.raises(io.UnsupportedOperation):
+            f.seek(0, io.SEEK_END)
+
+
+def test_closing_a_pipe_stops_its_command():
+    f = PipeReader('yes')
+    assert f.read(4) == b'y\ny\n'
+    f.close()
+    assert f.proc.returncode is not None
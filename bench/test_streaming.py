@@ -0,0 +1,106 @@
+"""Batch runner of the streaming scripts, common.streaming."""
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('websockets')
+from common import streaming
+from common.metrics import Metrics
+
+
+class Task(streaming.StreamTask):
+    audio_key = 'audio'
+    metrics = Metrics()
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Limits of every batch run, which transcribes nothing."""
+    seen = []
+
+    async def batch_task(task_cls, records, *args, limits=None, **kwargs):
+        seen.append((list(records), limits))
+
+    monkeypatch.setattr(streaming, 'batch_task', batch_task)
+    return seen
+
+
+def write_scp(path, lines):
+    path.write_text(''.join(f'utt{i} /audio/{i}.wav\n' for i in range(lines)))
+    return path
+
+
+def test_shard_quota_is_divided(tmp_path, limits):
+    scp = write_scp(tmp_path / 'wav.scp', 4)
+    streaming.run_shard(Task, scp, tmp_path / 'trans', 'ws://mock', {}, 1, shard=1, num_shards=4,
+                        limits=['connect=20:8'])
+    (records, rate), = limits
+    assert len(records) == 1
+    assert (rate('connect').qps, rate('connect').concurrency) == (5, 2)
+
+
+def test_unit_quota_is_divided_between_processes(tmp_path, limits, monkeypatch):
+    scp = write_scp(tmp_path / 'wav.scp', 4)
+
+    def run_ledger(ledger, in_scp, out_trans, run_unit, unit_size, lease):
+        run_unit(in_scp, out_trans)
+        return 0
+
+    monkeypatch.setattr(streaming, 'run_ledger', run_ledger)
+    _, failed = streaming.run_units(Task, tmp_path / 'ledger', scp, tmp_path / 'trans', 'ws://mock', {}, 1,
+                                    num_shards=4, limits=['connect=20:8'])
+    (records, rate), = limits
+    assert failed == 0
+    assert len(records) == 4  # a unit is not sharded again
+    assert (rate('connect').qps, rate('connect').concurrency) == (5, 2)
+
+
+class Socket:
+    """Websocket stand-in collecting the audio sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(bytes(data))
+
+
+async def loop_stall(coro, tick=0.01):
+    """Longest the event loop went without running a ticker while coro ran, and the result of coro."""
+    stall, last = 0.0, time.perf_counter()
+
+    async def ticker():
+        nonlocal stall, last
+        while True:
+            await asyncio.sleep(tick)
+            now = time.perf_counter()
+            stall, last = max(stall, now - last), now
+
+    ticking = asyncio.create_task(ticker())
+    try:
+        result = await coro
+    finally:
+        ticking.cancel()
+    return stall, result
+
+
+def test_pipe_is_read_off_the_loop(tmp_path):
+    audio = tmp_path / 'a.pcm'
+    audio.write_bytes(b'\1\0' * 8000)
+    params = {'audio': {'audio': dict(audioType='pcm', sampleRate=16000, channel=1, sampleBytes=2)}}
+    # the command blocks on its start and between its two halves
+    cmd = f'sleep 0.3; head -c 8000 {audio}; sleep 0.3; tail -c 8000 {audio} |'
+    task = Task('utt', 'ws://mock', params, cmd, speed=0.0, resample=True)
+    assert task.source.probed is None  # nothing is started when the task is made
+    websocket = Socket()
+
+    async def session():
+        await asyncio.to_thread(task._prepare)
+        await task._feed(websocket)
+
+    stall, _ = asyncio.run(loop_stall(session()))
+    assert stall < 0.2
+    assert b''.join(websocket.sent) == audio.read_bytes()
+    assert websocket.sent[-1] == b''
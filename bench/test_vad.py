@@ -0,0 +1,70 @@
+"""Silence trimming, common.vad."""
+
+import io
+import struct
+
+import pytest
+
+pytest.importorskip('numpy')
+from common.vad import VadReader, to_source_time
+
+RATE = 16000
+
+
+def pcm(*spans):
+    """16 bit mono audio of (seconds, amplitude) spans, amplitude 0 being silence."""
+    samples = []
+    for seconds, amplitude in spans:
+        n = int(seconds * RATE)
+        samples += [amplitude if i % 2 else -amplitude for i in range(n)]
+    return struct.pack(f'<{len(samples)}h', *samples)
+
+
+def trim(data, header=b'', **kwargs):
+    reader = VadReader(io.BytesIO(header + data), len(header), RATE, 1, **kwargs)
+    out = b''
+    while True:
+        chunk = reader.read(3200)
+        if not chunk:
+            return out, reader.offset_map()
+        out += chunk
+
+
+def test_long_silence_is_cut_to_keep():
+    data = pcm((1.0, 8000), (2.0, 0), (1.0, 8000))
+    out, offset_map = trim(data, keep_silence=0.2)
+    assert len(out) == pytest.approx(2.2 * RATE * 2, abs=2 * 320)
+    (out1, src1, len1), (out2, src2, len2) = offset_map
+    assert (out1, src1) == (0, 0)
+    assert len1 == pytest.approx(1.1)  # speech and the first half of the kept silence
+    assert src2 == pytest.approx(2.9)  # last half of the silence before the speech
+    assert out2 == pytest.approx(len1)
+    assert to_source_time(offset_map, 1.5) == pytest.approx(3.3)
+    assert to_source_time(offset_map, 0.5) == pytest.approx(0.5)
+
+
+def test_short_silence_is_kept():
+    data = pcm((1.0, 8000), (0.2, 0), (1.0, 8000))
+    out, offset_map = trim(data, keep_silence=0.3)
+    assert out == data
+    assert len(offset_map) == 1
+
+
+def test_speech_is_passed_unchanged():
+    data = pcm((0.5, 8000), (3.0, 0), (0.5, 8000))
+    out, _ = trim(data, keep_silence=0.0)
+    assert out == data[:len(out) // 2] + data[-len(out) // 2:]
+    assert len(out) == 2 * len(pcm((0.5, 8000)))
+
+
+def test_trailing_silence_keeps_its_head():
+    out, offset_map = trim(pcm((1.0, 8000), (2.0, 0)), keep_silence=0.4)
+    assert len(out) == pytest.approx(1.2 * RATE * 2, abs=2 * 320)
+    assert len(offset_map) == 1
+
+
+def test_wav_header_is_marked_streaming():
+    header = b'RIFF' + struct.pack('<I', 1000) + b'WAVEfmt ' + bytes(20) + b'data' + struct.pack('<I', 992)
+    out, _ = trim(pcm((0.1, 8000)), header=header)
+    assert out[:4] == b'RIFF' and out[4:8] == b'\xff\xff\xff\xff' and out[40:44] == b'\xff\xff\xff\xff'
+    assert len(out) == 44 + len(pcm((0.1, 8000)))
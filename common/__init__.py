@@ -0,0 +1 @@
+"""Helpers shared by the ASR cloud service tools."""
@@ -0,0 +1,165 @@
+"""Concurrency that adapts to the capacity of the provider.
+
+AdaptiveLimiter hands out slots like a semaphore whose size follows
+additive increase, multiplicative decrease: it grows by one slot per
+window of successes while all slots are busy and latency stays near its
+baseline, so throughput rises with concurrency, and it shrinks by a factor
+on a service error or when latency spikes above the baseline, which is
+where more concurrency stops paying. Every slot is timed, or reports its
+own latency, e.g. the part of a streaming session that does not scale with
+the audio.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from .retry import ServiceError, is_retryable
+
+logger = logging.getLogger(__name__)
+
+
+def capacity_signal(exc):
+    """Errors that hint at an overloaded provider: service errors and retryable failures."""
+    return isinstance(exc, ServiceError) or is_retryable(exc)
+
+
+class Slot:
+    """A slot in use. Setting latency replaces the time measured from acquiring the slot."""
+
+    def __init__(self, saturated):
+        self.start = time.monotonic()
+        self.saturated = saturated  # all slots were busy when this one was taken
+        self.latency = None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit, usable from threads and from an event loop.
+
+    Args:
+        initial (int): slots to start with.
+        maximum (int): upper bound of the slots.
+        minimum (int, optional): lower bound of the slots. Defaults to 1.
+        increase (float, optional): slots added per window of successes. Defaults to 1.
+        decrease (float, optional): factor applied on an error or latency spike. Defaults to 0.5.
+        spike (float, optional): latency over this multiple of the baseline is a spike. Defaults to 2.
+        tolerance (float, optional): seconds a latency may exceed the spike level by, so the jitter
+            of very fast calls is no spike. Defaults to 0.05.
+        smoothing (float, optional): weight of a new latency in the baseline. Defaults to 0.05.
+        warmup (int, optional): latencies averaged into the baseline before spikes count. Defaults to 5.
+        classify (callable, optional): exc -> bool, whether an error shrinks the limit.
+            Defaults to capacity_signal, other errors only free their slot.
+    """
+
+    def __init__(self, initial, maximum, minimum=1, increase=1.0, decrease=0.5, spike=2.0, tolerance=0.05,
+                 smoothing=0.05, warmup=5, classify=capacity_signal):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.size = float(min(max(initial, minimum), self.maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.spike = spike
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.warmup = warmup
+        self.classify = classify
+        self.in_use = 0
+        self.baseline = None
+        self.samples = 0
+        self.echoes = 0  # slots taken before the last decrease, their failures repeat its cause
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.async_cond = None
+        self.async_loop = None
+
+    @property
+    def limit(self):
+        return max(self.minimum, int(self.size))
+
+    def _take(self):
+        self.in_use += 1
+        return Slot(saturated=self.in_use >= self.limit)
+
+    def _decrease(self, reason):
+        before = self.limit
+        self.size = max(self.minimum, self.size * self.decrease)
+        self.echoes = self.in_use
+        if self.limit != before:
+            logger.info(f"Concurrency {before} -> {self.limit}: {reason}")
+
+    def _release(self, slot, failed):
+        """Free a slot and adapt the limit, failed is None for errors that say nothing about capacity."""
+        self.in_use -= 1
+        echo = self.echoes > 0
+        self.echoes = max(0, self.echoes - 1)
+        if failed is None:
+            return
+        if failed:
+            if not echo:
+                self._decrease('service error')
+            return
+        latency = slot.latency if slot.latency is not None else time.monotonic() - slot.start
+        if self.baseline is not None and self.samples >= self.warmup \
+                and latency > self.spike * self.baseline + self.tolerance:
+            if not echo:
+                self._decrease(f"latency {latency:.2f}s over {self.spike:g} x baseline {self.baseline:.2f}s")
+            return
+        self.samples += 1
+        if self.baseline is None:
+            self.baseline = latency
+        else:
+            # plain mean while warming up, then a slow moving average
+            self.baseline += max(self.smoothing, 1 / self.samples) * (latency - self.baseline)
+        if slot.saturated and self.size < self.maximum:
+            before = self.limit
+            self.size = min(self.maximum, self.size + self.increase / self.size)
+            if self.limit != before:
+                logger.debug(f"Concurrency {before} -> {self.limit}")
+
+    def _outcome(self, exc):
+        return True if self.classify(exc) else None
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot in a thread, blocking until one is free."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.in_use < self.limit)
+            slot = self._take()
+        failed = None
+        try:
+            yield slot
+            failed = False
+        except Exception as e:
+            failed = self._outcome(e)
+            raise
+        finally:
+            with self.cond:
+                self._release(slot, failed)
+                self.cond.notify_all()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """Hold a slot in an event loop, waiting until one is free."""
+        loop = asyncio.get_running_loop()
+        if self.async_loop is not loop:
+            # asyncio primitives belong to one loop, each asyncio.run gets its own condition
+            self.async_cond, self.async_loop = asyncio.Condition(), loop
+        cond = self.async_cond
+        async with cond:
+            await cond.wait_for(lambda: self.in_use < self.limit)
+            with self.lock:
+                slot = self._take()
+        failed = None
+        try:
+            yield slot
+            failed = False
+        except Exception as e:
+            failed = self._outcome(e)
+            raise
+        finally:
+            with self.lock:
+                self._release(slot, failed)
+            async with cond:
+                cond.notify_all()
@@ -0,0 +1,83 @@
+"""Pooled HTTP transport for an event loop, the asyncio twin of common.transport.
+
+One aiohttp session and connection pool serves every request of the loop,
+so thousands of files can be in flight without a thread each. Responses
+are read completely and returned with the `status_code`, `text` and
+`json()` of a requests response, so response checks are shared between
+the blocking and the asyncio engines.
+"""
+
+import json
+
+try:
+    import aiohttp
+except ImportError:  # only needed by the asyncio engine
+    aiohttp = None
+
+from .ratelimit import RateLimits
+
+
+class Response:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncTransport:
+    """An aiohttp session whose connections are reused by all requests of one event loop.
+
+    Create it inside the loop, and close it before the loop ends.
+
+    Args:
+        pool_size (int, optional): max open connections. Defaults to 100.
+        timeout (tuple, optional): (connect, read) timeout in seconds. Defaults to (10, 120).
+        limits (RateLimits, optional): quotas applied by the endpoint argument of each request.
+    """
+
+    def __init__(self, pool_size=100, timeout=(10, 120), limits=None):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required by the asyncio engine, pip install aiohttp')
+        self.limits = limits or RateLimits()
+        connect, read = timeout
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+
+    @staticmethod
+    def _form(data, files):
+        """Multipart body of form fields and files, as requests sends them.
+
+        A file is (filename, content) or only the content, named after its field.
+        """
+        form = aiohttp.FormData()
+        for name, value in (data or {}).items():
+            form.add_field(name, str(value))
+        for name, value in files.items():
+            filename, content = value if isinstance(value, tuple) else (name, value)
+            form.add_field(name, content, filename=filename, content_type='application/octet-stream')
+        return form
+
+    async def request(self, method, url, endpoint=None, data=None, files=None, **kwargs):
+        if files:
+            data = self._form(data, files)
+        async with self.limits(endpoint):
+            async with self.session.request(method, url, data=data, **kwargs) as resp:
+                return Response(resp.status, await resp.text())
+
+    async def get(self, url, endpoint=None, **kwargs):
+        return await self.request('GET', url, endpoint, **kwargs)
+
+    async def post(self, url, endpoint=None, **kwargs):
+        return await self.request('POST', url, endpoint, **kwargs)
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
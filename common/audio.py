@@ -0,0 +1,63 @@
+"""Audio format helpers."""
+
+import struct
+from collections import namedtuple
+
+
+WavInfo = namedtuple('WavInfo', ['sample_rate', 'channels', 'sample_bytes', 'data_offset', 'data_size'])
+
+
+def read_wav_header(fd):
+    """Parse the RIFF header of a wav file.
+
+    Args:
+        fd (file): binary file object, read from its current position.
+
+    Returns:
+        WavInfo or None if the data is not a wav file.
+    """
+    riff = fd.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        return None
+    offset = 12
+    fmt = None
+    while True:
+        head = fd.read(8)
+        if len(head) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', head)
+        offset += 8
+        if chunk_id == b'fmt ':
+            body = fd.read(chunk_size + (chunk_size & 1))
+            _, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+            fmt = (sample_rate, channels, bits // 8)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            return WavInfo(*fmt, offset, chunk_size)
+        else:
+            fd.seek(chunk_size + (chunk_size & 1), 1)
+        offset += chunk_size + (chunk_size & 1)
+
+
+def probe_wav(path):
+    """Return the WavInfo of a file, or None if it is not a wav file."""
+    with open(path, 'rb') as f:
+        return read_wav_header(f)
+
+
+def stream_format(audio_conf, info=None):
+    """Sample rate, channels and sample bytes of the audio.
+
+    The wav header takes precedence over the configuration.
+
+    Args:
+        audio_conf (dict): audio section of the request, with sampleRate, channel and sampleBytes.
+        info (WavInfo, optional): parsed wav header.
+    """
+    if info is not None:
+        return info.sample_rate, info.channels, info.sample_bytes
+    audio_conf = audio_conf or {}
+    return (int(audio_conf.get('sampleRate', 16000)),
+            int(audio_conf.get('channel', 1)),
+            int(audio_conf.get('sampleBytes', 2)))
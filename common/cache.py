@@ -0,0 +1,100 @@
+"""Persistent cache of transcription results, keyed by content.
+
+A key is the hash of the audio bytes plus a canonical hash of the request
+config, so renamed or copied files hit the cache while any change of the
+audio, of the recognition options or of the service endpoint misses it. Entries are evicted least
+recently used first once the stored values exceed the size limit.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse as urlparse
+
+from .source import open_source
+
+
+def audio_digest(path, block=1 << 20):
+    """SHA-256 of the audio content, see common.source for the accepted paths."""
+    h = hashlib.sha256()
+    with open_source(path) as f:
+        for data in iter(lambda: f.read(block), b''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def config_digest(config):
+    """SHA-256 of a JSON serializable config, independent of key order."""
+    canonical = json.dumps(config, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+
+def endpoint(url):
+    """Scheme, host and path of a service url, without the query holding credentials."""
+    parts = urlparse.urlparse(url)
+    return f'{parts.scheme}://{parts.netloc}{parts.path}'
+
+
+def content_key(path, config):
+    return f'{audio_digest(path)}:{config_digest(config)}'
+
+
+class ResultCache:
+    """SQLite store of JSON values with size based LRU eviction.
+
+    Safe to share between threads, and between processes through SQLite
+    locking.
+
+    Args:
+        path (str): database file, created if missing.
+        max_size (int, optional): max bytes of stored values. Defaults to 1 GiB.
+    """
+
+    def __init__(self, path, max_size=1 << 30):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                        '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+
+    def get(self, key):
+        """Cached value of key, or None."""
+        with self.lock:
+            row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        value = json.dumps(value, ensure_ascii=False)
+        size = len(value.encode('utf8')) + len(key)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, value, size, time.time()))
+            self._evict()
+
+    def _evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_size:
+            return
+        stale = []
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY used'):
+            if total <= self.max_size:
+                break
+            stale.append((key,))
+            total -= size
+        self.db.executemany('DELETE FROM results WHERE key = ?', stale)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
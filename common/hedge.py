@@ -0,0 +1,99 @@
+"""Hedged jobs: a second provider takes over the jobs the first one lags on.
+
+A job runs on the primary provider. When it is not done after a delay, a
+percentile of the primary turnaround so far, or as soon as it fails, the
+same job is started on the secondary provider and the first result wins.
+The delay runs from the submission of the job, time spent waiting for a
+local upload slot is not slowness of the provider.
+The other attempt is cancelled; a job it left on its server runs to the end
+and its result is ignored. Turnaround grows with the audio, so the
+percentile is taken of seconds per MB, and files below one MB count as one
+MB since fixed overheads dominate their turnaround.
+"""
+
+import asyncio
+from collections import deque
+
+from .metrics import quantile
+
+
+class HedgeDelay:
+    """Seconds the primary gets before a job is hedged, learnt from its turnaround.
+
+    Args:
+        percentile (float, optional): percentile of the turnaround per MB. Defaults to 95.
+        initial (float, optional): delay until warmup jobs finished on the primary. Defaults to 300.
+        minimum (float, optional): lower bound of the delay. Defaults to 10.
+        warmup (int, optional): primary turnarounds needed before the percentile is used. Defaults to 20.
+        window (int, optional): most recent turnarounds the percentile is taken of. Defaults to 1000.
+    """
+
+    def __init__(self, percentile=95.0, initial=300.0, minimum=10.0, warmup=20, window=1000):
+        self.percentile = percentile
+        self.initial = initial
+        self.minimum = minimum
+        self.warmup = warmup
+        self.samples = deque(maxlen=window)
+
+    @staticmethod
+    def _mbytes(size):
+        return max(size / 1e6, 1.0) if size else 1.0
+
+    def observe(self, seconds, size=None):
+        """Turnaround of a job of size bytes on the primary, None if the size is unknown."""
+        self.samples.append(seconds / self._mbytes(size))
+
+    def delay(self, size=None):
+        if len(self.samples) < self.warmup:
+            return self.initial
+        per_mbyte = quantile(sorted(self.samples), self.percentile / 100)
+        return max(self.minimum, per_mbyte * self._mbytes(size))
+
+
+def _succeeded(attempt):
+    return not attempt.cancelled() and attempt.exception() is None and bool(attempt.result())
+
+
+async def hedged(primary, secondary, delay, on_hedge=None, started=None):
+    """Run primary(), and secondary() too once primary fails or is not done after delay seconds.
+
+    Returns (result, index) of the first attempt that succeeds, index 0 for
+    the primary and 1 for the secondary, and cancels the other one. A falsy
+    result is a failure; when both attempts fail, the error of the
+    secondary is raised, or its result returned.
+
+    Args:
+        primary (callable): coroutine function of the job on the primary provider.
+        secondary (callable): coroutine function of the job on the secondary provider.
+        delay (float): seconds before the job is hedged.
+        on_hedge (callable, optional): called with whether the primary failed, rather than lagged,
+            when the secondary starts.
+        started (asyncio.Event, optional): set by the primary when the delay starts, e.g. once
+            its job is submitted. Defaults to the start of the primary.
+    """
+    attempts = [asyncio.ensure_future(primary())]
+    try:
+        if started is not None:
+            waiter = asyncio.ensure_future(started.wait())
+            try:
+                await asyncio.wait([attempts[0], waiter], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if done and _succeeded(attempts[0]):
+            return attempts[0].result(), 0
+        if on_hedge is not None:
+            on_hedge(bool(done))
+        attempts.append(asyncio.ensure_future(secondary()))
+        pending = {attempt for attempt in attempts if not attempt.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if _succeeded(attempt):
+                    return attempt.result(), attempts.index(attempt)
+        return attempts[1].result(), 1
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+        # the loser releases its slots and files before the job is reported
+        await asyncio.gather(*attempts, return_exceptions=True)
@@ -0,0 +1,10 @@
+"""Hypotheses of streaming sessions, yielded as the results arrive."""
+
+from collections import namedtuple
+
+
+# A partial hypothesis (final False) is replaced by the next one, final ones
+# are the settled text of a sentence or of the whole session. `arrival` is
+# the wall clock time the result was received, `elapsed` the seconds since
+# the first audio was sent, `response` the decoded message of the service.
+Hypothesis = namedtuple('Hypothesis', ['text', 'final', 'arrival', 'elapsed', 'response'])
@@ -0,0 +1,66 @@
+"""Append-only journal of finished keys and server side jobs."""
+
+import json
+import os
+import threading
+
+
+class Journal:
+    """Record the state of every key as JSON lines, so that a killed batch can resume.
+
+    Each line is a partial state of one key, the state of a key is the merge
+    of all its lines. A key is finished once a line with `done` is written.
+
+    Args:
+        path (str): journal file.
+        resume (bool, optional): load the existing journal instead of truncating it. Defaults to False.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        self.states = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn write of a killed run
+                    self._apply(entry.pop('key'), entry)
+        self.fd = open(path, 'a' if resume else 'w', encoding='utf8')
+
+    def _apply(self, key, state):
+        if state.get('done'):
+            self.done.add(key)
+            self.states.pop(key, None)
+        else:
+            self.states.setdefault(key, {}).update(state)
+
+    def is_done(self, key):
+        return str(key) in self.done
+
+    def job(self, key):
+        """Server side ids recorded for a key, empty if none."""
+        return dict(self.states.get(str(key), {}))
+
+    def record(self, key, **state):
+        """Append a partial state of a key, e.g. audio_id or task_id."""
+        key = str(key)
+        with self.lock:
+            self._apply(key, state)
+            self.fd.write(json.dumps(dict(key=key, **state), ensure_ascii=False) + '\n')
+            self.fd.flush()
+
+    def record_done(self, key):
+        self.record(key, done=True)
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,287 @@
+"""Shared ledger of work units, for one batch run by workers on many hosts.
+
+The scp list is split into units of consecutive lines, written next to the
+output as `out_trans.parts/NNNNNN.scp`. Workers lease one unit at a time,
+renew the lease by a heartbeat while they run it, and mark it done when its
+output `out_trans.parts/NNNNNN.txt` holds every key of the unit. A unit
+with missing keys is released and leased again, resuming from its journal,
+until it is failed after `max_leases` leases. The unit of a worker that
+stops heartbeating is leased again once its lease expires, and the new
+worker resumes from the journal of the unit, so finished keys and server
+side jobs are not redone. The worker that sees the last unit finish merges
+the parts into out_trans in scp order, with the keys failed units finished.
+
+The ledger is a SQLite file on storage shared by all hosts, in rollback
+journal mode since WAL needs shared memory on a single host. Leases are
+compared against the wall clock, so the lease must be far longer than the
+clock skew between hosts.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+def worker_id():
+    """Name of this worker, unique across hosts and processes."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class Ledger:
+    """Units of one batch and their leases.
+
+    Args:
+        path (str): ledger file, on storage shared by all workers.
+        lease (float, optional): seconds a unit stays leased without a heartbeat. Defaults to 300.
+        max_leases (int, optional): a unit leased this many times without finishing is failed. Defaults to 5.
+        worker (str, optional): name of this worker. Defaults to host, pid and a random suffix.
+    """
+
+    def __init__(self, path, lease=300.0, max_leases=5, worker=None):
+        self.path = path
+        self.lease = lease
+        self.max_leases = max_leases
+        self.worker = worker or worker_id()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=DELETE')
+        with self._transaction():
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY, scp TEXT NOT NULL, '
+                            'out TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, lease_until REAL, '
+                            'leases INTEGER NOT NULL DEFAULT 0)')
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction, taking the write lock up front so concurrent leases cannot interleave."""
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def create(self, in_scp, parts, unit_size=100):
+        """Split in_scp into units under the parts directory, unless an earlier worker did.
+
+        Returns the number of units. A ledger created for another scp list
+        or unit size raises ValueError.
+        """
+        in_scp = os.path.abspath(in_scp)
+        with self._transaction():
+            meta = dict(self.db.execute('SELECT key, value FROM meta'))
+            if meta:
+                if meta['in_scp'] != in_scp or int(meta['unit_size']) != unit_size:
+                    raise ValueError(f"ledger {self.path} is of {meta['in_scp']} in units of {meta['unit_size']} lines")
+                return self.db.execute('SELECT COUNT(*) FROM units').fetchone()[0]
+            os.makedirs(parts, exist_ok=True)
+            units = []
+            with open(in_scp, 'r', encoding='utf8') as f:
+                lines = [line for line in f if line.strip()]
+            for start in range(0, len(lines), unit_size):
+                unit = len(units)
+                scp = os.path.join(parts, f'{unit:06d}.scp')
+                with open(scp, 'w', encoding='utf8') as f:
+                    f.writelines(lines[start:start + unit_size])
+                units.append((unit, scp, os.path.join(parts, f'{unit:06d}.txt'), PENDING))
+            self.db.executemany('INSERT INTO units (id, scp, out, state) VALUES (?, ?, ?, ?)', units)
+            self.db.executemany('INSERT INTO meta VALUES (?, ?)',
+                                [('in_scp', in_scp), ('unit_size', str(unit_size)), ('created', str(time.time()))])
+        logger.info(f'Ledger {self.path}: {len(units)} units of {unit_size} lines')
+        return len(units)
+
+    def acquire(self):
+        """Lease the next pending or expired unit, returning (id, scp, out), or None if there is none now."""
+        now = time.time()
+        with self._transaction():
+            while True:
+                row = self.db.execute('SELECT id, scp, out, worker, leases FROM units WHERE state = ? '
+                                      'OR (state = ? AND lease_until < ?) ORDER BY id LIMIT 1',
+                                      (PENDING, LEASED, now)).fetchone()
+                if row is None:
+                    return None
+                unit, scp, out, previous, leases = row
+                if leases >= self.max_leases:
+                    logger.error(f'Unit {unit} was leased {leases} times without finishing, giving it up')
+                    self.db.execute('UPDATE units SET state = ?, worker = NULL WHERE id = ?', (FAILED, unit))
+                    continue
+                if previous is not None:
+                    logger.warning(f'Unit {unit} of {previous} is leased again')
+                self.db.execute('UPDATE units SET state = ?, worker = ?, lease_until = ?, leases = leases + 1 '
+                                'WHERE id = ?', (LEASED, self.worker, now + self.lease, unit))
+                return unit, scp, out
+
+    def renew(self, unit):
+        """Extend the lease of a unit, False if this worker no longer holds it."""
+        with self._transaction():
+            cursor = self.db.execute('UPDATE units SET lease_until = ? WHERE id = ? AND state = ? AND worker = ?',
+                                     (time.time() + self.lease, unit, LEASED, self.worker))
+        return cursor.rowcount == 1
+
+    def complete(self, unit):
+        """Mark a unit done, False if its lease was lost to another worker."""
+        with self._transaction():
+            cursor = self.db.execute('UPDATE units SET state = ?, lease_until = NULL WHERE id = ? AND worker = ?',
+                                     (DONE, unit, self.worker))
+        return cursor.rowcount == 1
+
+    def release(self, unit):
+        """Give a unit back after a failure, so any worker can lease it again."""
+        with self._transaction():
+            self.db.execute('UPDATE units SET state = ?, worker = NULL, lease_until = NULL '
+                            'WHERE id = ? AND state = ? AND worker = ?', (PENDING, unit, LEASED, self.worker))
+
+    def counts(self):
+        """Number of units in every state."""
+        with self.lock:
+            counts = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+            counts.update(self.db.execute('SELECT state, COUNT(*) FROM units GROUP BY state'))
+        return counts
+
+    def claim_merge(self):
+        """True for the one worker that merges the parts, once every unit is finished."""
+        with self._transaction():
+            unfinished = self.db.execute('SELECT COUNT(*) FROM units WHERE state IN (?, ?)',
+                                         (PENDING, LEASED)).fetchone()[0]
+            if unfinished or self.db.execute("SELECT 1 FROM meta WHERE key = 'merged'").fetchone():
+                return False
+            self.db.execute("INSERT INTO meta VALUES ('merged', ?)", (self.worker,))
+        return True
+
+    def parts(self):
+        """Output files of the finished units, in scp order, failed ones included for the keys they did finish."""
+        with self.lock:
+            return [out for out, in self.db.execute('SELECT out FROM units WHERE state IN (?, ?) ORDER BY id',
+                                                    (DONE, FAILED))]
+
+    @contextmanager
+    def heartbeat(self, unit):
+        """Renew the lease of a unit every third of the lease while the block runs."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease / 3):
+                try:
+                    if not self.renew(unit):
+                        logger.warning(f'Lease of unit {unit} was lost, another worker may redo it')
+                        return
+                except sqlite3.Error as e:
+                    logger.warning(f'Heartbeat of unit {unit} failed: {e!r}')
+
+        thread = threading.Thread(target=beat, name=f'heartbeat-{unit}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _keys(path):
+    """Keys of the `key value` lines of a file, none if it does not exist."""
+    keys = set()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf8') as f:
+            for line in f:
+                fields = line.split(maxsplit=1)
+                if len(fields) == 2:
+                    keys.add(fields[0])
+    return keys
+
+
+def missing_keys(scp, out):
+    """Keys of a unit's scp list without a line in its output; lines without an audio have no key."""
+    return _keys(scp) - _keys(out)
+
+
+def merge_parts(parts, out_path, suffixes=('', '.offsets')):
+    """Concatenate the `key\tvalue` lines of the parts into out_path, first line of a key wins.
+
+    A unit run twice, by a worker which lost its lease and the one which
+    took it over, may hold a key twice. Every suffix is merged into
+    out_path plus that suffix, if any part has such a file.
+    """
+    for suffix in suffixes:
+        files = [part + suffix for part in parts if os.path.exists(part + suffix)]
+        if not files and suffix:
+            continue
+        seen = set()
+        tmp = f'{out_path}{suffix}.tmp'
+        with open(tmp, 'w', encoding='utf8') as out:
+            for name in files:
+                with open(name, 'r', encoding='utf8') as f:
+                    for line in f:
+                        key = line.split('\t', 1)[0]
+                        if key not in seen:
+                            seen.add(key)
+                            out.write(line)
+        os.replace(tmp, out_path + suffix)
+
+
+def run_ledger(ledger_path, in_scp, out_trans, run_unit, unit_size=100, lease=300.0, worker=None):
+    """Run units of a shared ledger until all are finished, merging the parts if this worker ends last.
+
+    Any number of workers on any hosts may run this with the same
+    arguments. run_unit(scp, out) transcribes one unit into out, resuming
+    from the journal of out; an exception, or keys of the unit missing from
+    out, releases the unit to be retried. Workers wait for units leased by
+    others, to take them over if their workers die. Returns the number of
+    failed units.
+    """
+    with Ledger(ledger_path, lease, worker=worker) as ledger:
+        ledger.create(in_scp, f'{out_trans}.parts', unit_size)
+        while True:
+            leased = ledger.acquire()
+            if leased is None:
+                counts = ledger.counts()
+                if counts[PENDING] or counts[LEASED]:
+                    time.sleep(min(lease / 3, 30))
+                    continue
+                break
+            unit, scp, out = leased
+            logger.info(f'Worker {ledger.worker} runs unit {unit}')
+            try:
+                with ledger.heartbeat(unit):
+                    run_unit(scp, out)
+            except Exception:
+                logger.exception(f'Unit {unit} failed, releasing it')
+                ledger.release(unit)
+                continue
+            missing = missing_keys(scp, out)
+            if missing:
+                logger.error(f'Unit {unit} has no result for {len(missing)} keys, e.g. {min(missing)}, releasing it')
+                ledger.release(unit)
+                continue
+            if not ledger.complete(unit):
+                logger.warning(f'Unit {unit} was finished by another worker')
+            counts = ledger.counts()
+            logger.info(f'Units done {counts[DONE]}/{sum(counts.values())}, failed {counts[FAILED]}')
+        if ledger.claim_merge():
+            parts = ledger.parts()
+            merge_parts(parts, out_trans)
+            logger.info(f'Merged {len(parts)} units into {out_trans}')
+        counts = ledger.counts()
+        if counts[FAILED]:
+            logger.error(f'{counts[FAILED]} units failed, rerun them with a new ledger')
+        return counts[FAILED]
@@ -0,0 +1,180 @@
+"""Per-stage timings of tasks, aggregated into histograms.
+
+Observations are not kept. A histogram holds the count, sum, min and max
+of its values, their counts in the exported Prometheus buckets, and their
+counts in fine buckets spaced by a factor GROWTH, from which quantiles are
+interpolated to within a few percent. Its size depends on the range of the
+values rather than on their number, so a run of millions of tasks keeps a
+few hundred counts per histogram, and registries of several processes
+merge by adding counts. At the end of a run the histograms are written as
+JSON and in the Prometheus text exposition format.
+"""
+
+import bisect
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+# upper bounds of the exported Prometheus buckets, seconds for timings
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+QUANTILES = (0.5, 0.9, 0.99)
+GROWTH = 1.04  # ratio of the bounds of a fine bucket, quantiles are off by at most as much
+ZERO = -math.inf  # fine bucket of values <= 0
+
+
+def quantile(samples, q):
+    """Linear interpolated quantile of sorted samples."""
+    pos = (len(samples) - 1) * q
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (pos - lo)
+
+
+class Histogram:
+    """Count, sum, min, max and bucket counts of observed values."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = [0] * (len(BUCKETS) + 1)  # values in (previous bound, bound], the last one above all
+        self.fine = {}  # index i of (GROWTH ** i, GROWTH ** (i + 1)] -> count
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        index = math.ceil(math.log(value, GROWTH)) - 1 if value > 0 else ZERO
+        self.fine[index] = self.fine.get(index, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        for index, n in other.fine.items():
+            self.fine[index] = self.fine.get(index, 0) + n
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, q):
+        """Quantile interpolated within the fine bucket holding it, as quantile() of the sorted values."""
+        rank = (self.count - 1) * q
+        seen = 0
+        for index, n in sorted(self.fine.items()):
+            if rank < seen + n:
+                lo, hi = (self.min, 0.0) if index == ZERO else (GROWTH ** index, GROWTH ** (index + 1))
+                value = lo + (hi - lo) * (rank - seen + 0.5) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def cumulative(self):
+        """Counts of values <= each bound of BUCKETS, and of all values."""
+        counts, total = [], 0
+        for n in self.buckets:
+            total += n
+            counts.append(total)
+        return counts
+
+
+class Metrics:
+    """Thread-safe registry of histograms and counters.
+
+    Args:
+        prefix (str, optional): prepended to every exported metric name. Defaults to ''.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count(self, name):
+        """Value of a counter, 0 if it was never incremented."""
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    @contextmanager
+    def timer(self, name):
+        """Observe the seconds spent in the block, if it does not raise."""
+        start = time.perf_counter()
+        yield
+        self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Plain copy of the registry, picklable for merging across processes."""
+        with self.lock:
+            return dict(histograms={name: histogram.copy() for name, histogram in self.histograms.items()},
+                        counters=dict(self.counters))
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, histogram in snapshot['histograms'].items():
+                self.histograms.setdefault(name, Histogram()).merge(histogram)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Count, sum, mean, min, max and quantiles of every histogram, and the counters."""
+        snapshot = self.snapshot()
+        histograms = {}
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            if not histogram.count:
+                continue
+            stats = dict(count=histogram.count, sum=histogram.sum, mean=histogram.sum / histogram.count,
+                         min=histogram.min, max=histogram.max)
+            stats.update((f'p{round(q * 100)}', histogram.quantile(q)) for q in QUANTILES)
+            histograms[name] = stats
+        return dict(histograms=histograms, counters=dict(sorted(snapshot['counters'].items())))
+
+    def to_prometheus(self):
+        lines = []
+        snapshot = self.snapshot()
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            metric = self.prefix + name
+            lines.append(f'# TYPE {metric} histogram')
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.cumulative()):
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum {histogram.sum}')
+            lines.append(f'{metric}_count {histogram.count}')
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f'{self.prefix}{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """Write the summary to `path`.json and the histograms to `path`.prom."""
+        with open(f'{path}.json', 'w', encoding='utf8') as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(f'{path}.prom', 'w', encoding='utf8') as f:
+            f.write(self.to_prometheus())
+
+    def log(self, log):
+        """Log one line per histogram through a logging function."""
+        for name, stats in self.summary()['histograms'].items():
+            log(f"{name}: count {stats['count']}, mean {stats['mean']:.3f}, "
+                f"p50 {stats['p50']:.3f}, p90 {stats['p90']:.3f}, max {stats['max']:.3f}")
@@ -0,0 +1,58 @@
+"""Pacing of streamed audio against a monotonic clock."""
+
+import asyncio
+import time
+
+
+class Pacer:
+    """Schedule audio chunks at a multiple of real time.
+
+    The deadline of every chunk is derived from the total bytes sent since
+    start, so time spent in send is compensated instead of accumulated.
+
+    Args:
+        byte_rate (int): bytes per second of the audio.
+        speed (float, optional): multiple of real time, 0 sends as fast as the server accepts. Defaults to 1.0.
+        stride (float, optional): nominal audio duration of one chunk in seconds. Defaults to 0.04.
+        block_align (int, optional): chunk sizes are multiples of it. Defaults to 2.
+        max_chunk (int, optional): upper bound of the chunk size in bytes. Defaults to 64 KiB.
+    """
+
+    def __init__(self, byte_rate, speed=1.0, stride=0.04, block_align=2, max_chunk=64 * 1024):
+        self.byte_rate = byte_rate
+        self.speed = speed
+        self.block_align = max(block_align, 1)
+        self.max_chunk = max_chunk
+        if speed > 0:
+            self.chunk_size = self._align(byte_rate * stride * speed)
+        else:
+            self.chunk_size = self._align(max_chunk)
+        self.start = None
+        self.sent = 0
+
+    def _align(self, size):
+        size = int(size) // self.block_align * self.block_align
+        return min(max(size, self.block_align), self.max_chunk)
+
+    def lag(self):
+        """Seconds the stream is behind schedule, negative when ahead."""
+        if self.start is None or self.speed <= 0:
+            return 0.0
+        return time.monotonic() - (self.start + self.sent / (self.byte_rate * self.speed))
+
+    def next_chunk_size(self):
+        """Bytes to send next, growing the chunk when behind schedule."""
+        if self.start is None:
+            self.start = time.monotonic()
+        lag = self.lag()
+        if lag <= 0:
+            return self.chunk_size
+        behind = lag * self.byte_rate * self.speed
+        return self._align(self.chunk_size + behind)
+
+    async def wait(self, nbytes):
+        """Account for nbytes just sent and sleep until the next deadline."""
+        self.sent += nbytes
+        lag = self.lag()
+        if lag < 0:
+            await asyncio.sleep(-lag)
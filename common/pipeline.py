@@ -0,0 +1,75 @@
+"""Bounded submission of work items.
+
+Only a window of items is in flight at any time, the next item is pulled
+from the iterable when a slot frees, so memory stays flat however long the
+input is and results are available as soon as they finish.
+"""
+
+import asyncio
+import concurrent.futures
+
+
+_END = object()
+
+
+def bounded_map(executor, fn, iterable, window):
+    """Submit fn(item) to an executor and yield futures as they complete.
+
+    fn may return a Future to hand its work off, e.g. to a poller, the item
+    then stays in flight until that Future completes.
+
+    Args:
+        executor (Executor): thread or process pool.
+        fn (callable): called with one item.
+        iterable (iterable): work items, consumed lazily.
+        window (int): max futures in flight.
+    """
+    items = iter(iterable)
+    pending = set()
+
+    def fill():
+        while len(pending) < window:
+            item = next(items, _END)
+            if item is _END:
+                return
+            pending.add(executor.submit(fn, item))
+
+    fill()
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        pending.difference_update(done)
+        finished = []
+        for future in done:
+            if future.exception() is None and isinstance(future.result(), concurrent.futures.Future):
+                pending.add(future.result())
+            else:
+                finished.append(future)
+        fill()
+        yield from finished
+
+
+async def bounded_as_completed(coro_fn, iterable, window):
+    """Run coro_fn(item) as tasks and yield them as they complete.
+
+    Args:
+        coro_fn (callable): coroutine function called with one item.
+        iterable (iterable): work items, consumed lazily.
+        window (int): max tasks in flight.
+    """
+    items = iter(iterable)
+    pending = set()
+
+    def fill():
+        while len(pending) < window:
+            item = next(items, _END)
+            if item is _END:
+                return
+            pending.add(asyncio.ensure_future(coro_fn(item)))
+
+    fill()
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        pending.difference_update(done)
+        fill()
+        for task in done:
+            yield task
@@ -0,0 +1,131 @@
+"""Central poller of server side jobs.
+
+Submitting threads hand a job over with `watch` and are free again, one
+scheduler thread wakes up jobs when they are due and a small pool runs the
+progress queries, so the number of jobs waiting on the server is not bound
+to the number of threads. In an event loop, `wait_done` spaces the
+queries of one job the same way.
+"""
+
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+
+class _Job:
+    def __init__(self, poll, fetch, name):
+        self.poll = poll
+        self.fetch = fetch
+        self.name = name
+        self.future = concurrent.futures.Future()
+        self.interval = None
+        self.changed = None  # (time, progress) of the last progress change
+
+    def next_interval(self, progress, min_interval, max_interval):
+        """Half the estimated time to completion, backing off while progress stalls."""
+        now = time.monotonic()
+        if self.changed is None:
+            interval = min_interval
+            self.changed = (now, progress)
+        elif progress > self.changed[1]:
+            rate = (progress - self.changed[1]) / max(now - self.changed[0], 1e-3)
+            interval = (100 - progress) / rate / 2
+            self.changed = (now, progress)
+        else:
+            interval = self.interval * 1.5
+        self.interval = min(max(interval, min_interval), max_interval)
+        return self.interval
+
+
+class Poller:
+    """Track outstanding jobs until they finish.
+
+    Args:
+        workers (int, optional): threads running progress queries and result fetches. Defaults to 4.
+        min_interval (float, optional): min seconds between two queries of a job. Defaults to 1.0.
+        max_interval (float, optional): max seconds between two queries of a job. Defaults to 30.0.
+    """
+
+    def __init__(self, workers=4, min_interval=1.0, max_interval=30.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._loop, name='poller', daemon=True)
+        self.thread.start()
+
+    def watch(self, poll, fetch, name=None):
+        """Poll a job until done and fetch its result.
+
+        Args:
+            poll (callable): returns the progress of the job in [0, 100], raises if the job failed.
+            fetch (callable): returns the result of a finished job.
+            name (str, optional): job name for debugging.
+
+        Returns:
+            Future: resolved with the return value of fetch.
+        """
+        job = _Job(poll, fetch, name)
+        self._schedule(job, 0)
+        return job.future
+
+    def _schedule(self, job, delay):
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), job))
+            self.cond.notify()
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.closed:
+                    if self.heap:
+                        delay = self.heap[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self.cond.wait(delay)
+                    else:
+                        self.cond.wait()
+                if self.closed:
+                    return
+                _, _, job = heapq.heappop(self.heap)
+            self.executor.submit(self._check, job)
+
+    def _check(self, job):
+        try:
+            progress = job.poll()
+            if progress >= 100:
+                job.future.set_result(job.fetch())
+            else:
+                self._schedule(job, job.next_interval(progress, self.min_interval, self.max_interval))
+        except BaseException as e:
+            job.future.set_exception(e)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.executor.shutdown()
+
+
+async def wait_done(poll, min_interval=1.0, max_interval=30.0, name=None):
+    """Await poll() until it reports 100, spacing the queries like Poller.
+
+    Args:
+        poll (callable): coroutine function returning the progress in [0, 100], raises if the job failed.
+        min_interval (float, optional): min seconds between two queries. Defaults to 1.0.
+        max_interval (float, optional): max seconds between two queries. Defaults to 30.0.
+        name (str, optional): job name for debugging.
+    """
+    job = _Job(poll, None, name)
+    while True:
+        progress = await poll()
+        if progress >= 100:
+            return
+        await asyncio.sleep(job.next_interval(progress, min_interval, max_interval))
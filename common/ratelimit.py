@@ -0,0 +1,125 @@
+"""Client side rate limiting against provider quotas.
+
+Every endpoint (connect, upload, task, progress, result) has its own
+token bucket for requests per second and its own concurrency slots. The
+limiters work both as context managers in threads and as async context
+managers in an event loop.
+"""
+
+import asyncio
+import threading
+import time
+
+
+ENDPOINTS = ('connect', 'upload', 'task', 'progress', 'result')
+
+
+class TokenBucket:
+    """Thread-safe token bucket.
+
+    Args:
+        rate (float): tokens added per second.
+        burst (float, optional): bucket capacity. Defaults to max(rate, 1).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it.
+
+        Tokens may go negative, so callers are served in reservation order.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class Limiter:
+    """Requests per second and concurrency limit of one endpoint, unlimited if both are None.
+
+    The concurrency slot is held for the whole `with` block, the token is
+    taken once when entering it.
+    """
+
+    def __init__(self, qps=None, concurrency=None):
+        self.qps = qps
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(qps) if qps else None
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.async_slots = None
+        self.async_loop = None
+
+    def __enter__(self):
+        if self.slots is not None:
+            self.slots.acquire()
+        if self.bucket is not None:
+            time.sleep(self.bucket.reserve())
+        return self
+
+    def __exit__(self, *exc):
+        if self.slots is not None:
+            self.slots.release()
+
+    async def __aenter__(self):
+        if self.concurrency:
+            loop = asyncio.get_running_loop()
+            if self.async_loop is not loop:
+                # asyncio primitives belong to one loop, each asyncio.run gets its own slots
+                self.async_slots, self.async_loop = asyncio.Semaphore(self.concurrency), loop
+            await self.async_slots.acquire()
+        if self.bucket is not None:
+            await asyncio.sleep(self.bucket.reserve())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.async_slots is not None:
+            self.async_slots.release()
+
+
+def parse_limits(specs, shards=1):
+    """Parse quota specs of the form endpoint=qps[:concurrency].
+
+    Args:
+        specs (list): e.g. ['connect=20:200', 'progress=50', 'upload=:8'].
+        shards (int, optional): quotas are divided between this many processes. Defaults to 1.
+
+    Returns:
+        dict: endpoint -> (qps, concurrency), None meaning unlimited.
+    """
+    quotas = {}
+    for spec in specs or []:
+        try:
+            endpoint, value = spec.split('=', 1)
+            qps, _, concurrency = value.partition(':')
+            qps = float(qps) / shards if qps else None
+            concurrency = max(int(concurrency) // shards, 1) if concurrency else None
+        except ValueError:
+            raise ValueError(f'invalid limit {spec!r}, expect endpoint=qps[:concurrency]')
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f'unknown endpoint {endpoint!r} in limit {spec!r}, expect one of {ENDPOINTS}')
+        quotas[endpoint] = (qps, concurrency)
+    return quotas
+
+
+class RateLimits:
+    """Limiters by endpoint, calling it with an endpoint name returns its Limiter.
+
+    Args:
+        quotas (dict, optional): endpoint -> (qps, concurrency), as returned by parse_limits.
+    """
+
+    def __init__(self, quotas=None):
+        self.limiters = {endpoint: Limiter(qps, concurrency)
+                         for endpoint, (qps, concurrency) in (quotas or {}).items()}
+        self.unlimited = Limiter()
+
+    def __call__(self, endpoint):
+        return self.limiters.get(endpoint, self.unlimited)
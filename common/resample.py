@@ -0,0 +1,218 @@
+"""Streaming downmix and resampling of wav audio with NumPy.
+
+Audio is converted in blocks of frames with a windowed-sinc interpolator
+that carries its history between blocks, so memory is bounded by the block
+size whatever the length of the recording.
+"""
+
+import io
+import math
+import struct
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import numpy as np
+except ImportError:  # only needed when resampling
+    np = None
+
+from .audio import read_wav_header
+from .source import map_file, open_source, parse_source
+
+
+BLOCK_FRAMES = 64 * 1024
+
+
+class Resampler:
+    """Windowed-sinc resampler of a mono float signal, fed block by block.
+
+    Args:
+        in_rate (int): input sample rate.
+        out_rate (int): output sample rate.
+        half_width (int, optional): taps on each side of an output sample. Defaults to 16.
+    """
+
+    def __init__(self, in_rate, out_rate, half_width=16):
+        self.ratio = in_rate / out_rate
+        self.cutoff = min(1.0, out_rate / in_rate)  # low-pass below the new Nyquist when decimating
+        self.half_width = half_width
+        self.taps = np.arange(-half_width + 1, half_width + 1)
+        self.buf = np.zeros(0, dtype=np.float32)
+        self.offset = 0  # input index of buf[0]
+        self.consumed = 0  # input samples fed so far
+        self.produced = 0  # output samples returned so far
+
+    def process(self, x, final=False):
+        """Feed input samples and return the output samples that can be computed.
+
+        With final=True the signal is considered finished and the remaining
+        outputs, ceil(len(input) / ratio) in total, are returned.
+        """
+        buf = np.concatenate([self.buf, x.astype(np.float32, copy=False)])
+        self.consumed += len(x)
+        if final:
+            stop = math.ceil(self.consumed / self.ratio)
+        else:
+            # outputs whose right-most tap is already available
+            stop = max(math.ceil((self.consumed - self.half_width) / self.ratio), self.produced)
+        n = np.arange(self.produced, stop)
+        pos = n * self.ratio
+        base = np.floor(pos).astype(np.int64)
+        t = (pos - base)[:, None] - self.taps[None, :]
+        weights = self.cutoff * np.sinc(self.cutoff * t) * (0.5 + 0.5 * np.cos(np.pi * t / self.half_width))
+        idx = base[:, None] + self.taps[None, :] - self.offset
+        # taps before the start or past the end of the signal are zero
+        src = buf if len(buf) else np.zeros(1, dtype=np.float32)
+        valid = (idx >= 0) & (idx < len(buf))
+        values = np.where(valid, src[np.clip(idx, 0, len(src) - 1)], 0)
+        y = (values * weights).sum(axis=1).astype(np.float32)
+        self.produced = stop
+        # keep the history needed by the next output
+        keep = math.floor(stop * self.ratio) - self.half_width + 1
+        drop = min(max(keep - self.offset, 0), len(buf))
+        self.buf = buf[drop:]
+        self.offset += drop
+        return y
+
+
+def _to_float(data, sample_bytes, channels):
+    """Decode little-endian PCM frames into a (frames, channels) float32 array."""
+    if sample_bytes == 1:
+        x = np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128
+        x *= 256
+    elif sample_bytes == 2:
+        x = np.frombuffer(data, dtype='<i2').astype(np.float32)
+    elif sample_bytes == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        x = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 16).astype(np.float32)
+    elif sample_bytes == 4:
+        x = (np.frombuffer(data, dtype='<i4') >> 16).astype(np.float32)
+    else:
+        raise ValueError(f'unsupported sample width {sample_bytes}')
+    return x.reshape(-1, channels)
+
+
+def wav_header(sample_rate, channels, sample_bytes, data_size):
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels,
+                       sample_rate, sample_rate * channels * sample_bytes, channels * sample_bytes,
+                       sample_bytes * 8, b'data', data_size)
+
+
+def needs_conversion(info, sample_rate, channels=1):
+    """Whether a wav must be downmixed or resampled to match the target format."""
+    return info is not None and (info.sample_rate != sample_rate or info.channels != channels
+                                 or info.sample_bytes != 2)
+
+
+def convert_wav(fd, info, sample_rate, channels=1, block_frames=BLOCK_FRAMES):
+    """Yield a 16 bit wav with the target rate and channels, header first.
+
+    Args:
+        fd (file): binary file positioned anywhere, the data chunk is located by info.
+        info (WavInfo): header of the source.
+        sample_rate (int): target sample rate.
+        channels (int, optional): target channels, 1 downmixes by averaging. Defaults to 1.
+        block_frames (int, optional): source frames converted at a time. Defaults to BLOCK_FRAMES.
+    """
+    if np is None:
+        raise ImportError('numpy is required to resample audio, pip install numpy')
+    frame_bytes = info.sample_bytes * info.channels
+    frames = info.data_size // frame_bytes
+    out_frames = math.ceil(frames * sample_rate / info.sample_rate)
+    yield wav_header(sample_rate, channels, 2, out_frames * channels * 2)
+
+    resamplers = None
+    if info.sample_rate != sample_rate:
+        resamplers = [Resampler(info.sample_rate, sample_rate) for _ in range(channels)]
+    fd.seek(info.data_offset)
+    left = frames
+    while True:
+        n = min(block_frames, left)
+        x = _to_float(fd.read(n * frame_bytes), info.sample_bytes, info.channels)
+        left -= len(x)
+        if channels == 1 and info.channels > 1:
+            x = x.mean(axis=1, keepdims=True)
+        elif channels != info.channels:
+            x = np.repeat(x[:, :1], channels, axis=1)
+        final = left <= 0 or n == 0 or len(x) < n
+        if resamplers is not None:
+            x = np.stack([r.process(x[:, c], final) for c, r in enumerate(resamplers)], axis=1)
+        yield np.clip(np.rint(x), -32768, 32767).astype('<i2').tobytes()
+        if final:
+            return
+
+
+class ConvertedReader(io.RawIOBase):
+    """File-like reader over convert_wav, for streaming the converted audio."""
+
+    def __init__(self, chunks, source=None):
+        self.chunks = chunks
+        self.source = source
+        self.pending = bytearray()
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.pending += chunk
+        if size < 0:
+            size = len(self.pending)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+
+def open_audio(path, sample_rate=None, channels=1, spool=False):
+    """Open an audio, converted to 16 bit sample_rate/channels if it is a wav in another format.
+
+    Args:
+        path (str): audio column of a scp line, or its source, see common.source.
+        sample_rate (int, optional): target sample rate, None to never convert.
+        channels (int, optional): target channels. Defaults to 1.
+        spool (bool, optional): write the conversion to an anonymous temp file, so that
+            the result supports seek, fileno and mmap. Defaults to False.
+
+    Returns:
+        (file, converted): a binary file object and whether it was converted.
+    """
+    f = open_source(path)
+    info = read_wav_header(f)
+    f.seek(0)
+    if sample_rate is None or not needs_conversion(info, sample_rate, channels):
+        return f, False
+    chunks = convert_wav(f, info, sample_rate, channels)
+    if not spool:
+        return ConvertedReader(chunks, source=f), True
+    with f:
+        tmp = tempfile.TemporaryFile()
+        for chunk in chunks:
+            tmp.write(chunk)
+    tmp.flush()
+    tmp.seek(0)
+    return tmp, True
+
+
+@contextmanager
+def audio_view(path, sample_rate=None, channels=1):
+    """Memoryview of a whole audio for upload, converted as by open_audio.
+
+    Files and archive entries are mapped without copies, converted audio
+    and pipes are spooled to an anonymous temp file first.
+    """
+    source = parse_source(path)
+    if sample_rate is not None and needs_conversion(source.probe(), sample_rate, channels):
+        f, _ = open_audio(source, sample_rate, channels, spool=True)
+        with f, map_file(f) as view:
+            yield view
+    else:
+        with source.view() as view:
+            yield view
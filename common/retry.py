@@ -0,0 +1,135 @@
+"""Retries with jittered exponential backoff and a shared circuit breaker.
+
+Errors are classified by the caller: an exception with a `retryable`
+attribute is trusted, otherwise network errors (OSError, timeouts) are
+retried and anything else fails at once.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceError(RuntimeError):
+    """Error reported by a provider.
+
+    Args:
+        message (str): description of the failure.
+        retryable (bool, optional): whether the same request may succeed later. Defaults to False.
+    """
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def http_retryable(status_code):
+    """Throttling and server side errors are worth retrying."""
+    return status_code == 429 or status_code >= 500
+
+
+def is_retryable(exc):
+    retryable = getattr(exc, 'retryable', None)
+    if retryable is not None:
+        return retryable
+    return isinstance(exc, (OSError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """Pause every caller for a cooldown after consecutive retryable failures.
+
+    Args:
+        threshold (int, optional): consecutive failures that open the circuit. Defaults to 10.
+        cooldown (float, optional): seconds the circuit stays open. Defaults to 30.
+    """
+
+    def __init__(self, threshold=10, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds until the circuit closes again, 0 if closed."""
+        return max(self.open_until - time.monotonic(), 0.0)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold and not self.remaining():
+                self.open_until = time.monotonic() + self.cooldown
+                logger.warning(f"{self.failures} consecutive failures, pausing requests for {self.cooldown}s")
+
+
+class Retry:
+    """Retry policy.
+
+    Args:
+        attempts (int, optional): max calls including the first one. Defaults to 5.
+        base (float, optional): backoff of the first retry in seconds. Defaults to 1.0.
+        cap (float, optional): max backoff in seconds. Defaults to 60.
+        breaker (CircuitBreaker, optional): shared by all calls of one provider.
+        classify (callable, optional): exc -> bool, whether to retry. Defaults to is_retryable.
+        fail_fast (bool, optional): raise ServiceError while the circuit is open instead of pausing,
+            for callers that have another provider to turn to. Defaults to False.
+    """
+
+    def __init__(self, attempts=5, base=1.0, cap=60.0, breaker=None, classify=is_retryable, fail_fast=False):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.breaker = breaker or CircuitBreaker()
+        self.classify = classify
+        self.fail_fast = fail_fast
+
+    def _pause(self, name):
+        """Seconds to wait for the circuit to close before a call."""
+        remaining = self.breaker.remaining()
+        if remaining and self.fail_fast:
+            raise ServiceError(f"{name} not called, circuit open for {remaining:.1f}s")
+        return remaining
+
+    def backoff(self, attempt):
+        """Full jitter: uniform in [0, min(cap, base * 2 ** attempt)]."""
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def _failed(self, exc, attempt, name):
+        """Return the seconds to wait before the next attempt, or re-raise."""
+        if not self.classify(exc) or attempt + 1 >= self.attempts:
+            raise exc
+        self.breaker.failure()
+        delay = self.backoff(attempt)
+        logger.warning(f"{name} failed ({exc!r}), retry {attempt + 1}/{self.attempts - 1} in {delay:.1f}s")
+        return delay
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.attempts):
+            time.sleep(self._pause(getattr(fn, '__name__', 'call')))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._failed(e, attempt, getattr(fn, '__name__', 'call')))
+            else:
+                self.breaker.success()
+                return result
+
+    async def call_async(self, coro_fn, *args, **kwargs):
+        for attempt in range(self.attempts):
+            await asyncio.sleep(self._pause(getattr(coro_fn, '__name__', 'call')))
+            try:
+                result = await coro_fn(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._failed(e, attempt, getattr(coro_fn, '__name__', 'call')))
+            else:
+                self.breaker.success()
+                return result
@@ -0,0 +1,135 @@
+"""Edit distance scoring of transcripts against references.
+
+Every utterance is aligned by a dynamic program whose cells encode the
+errors and the indels of the best path in one int, errors * weight +
+indels, so among the alignments with the fewest errors the one with the
+most substitutions wins, as in sclite and Kaldi. Since deletions minus
+insertions equals the length difference at every cell, the substitution,
+insertion and deletion counts follow from that int alone.
+
+The common prefix and suffix are cut off first, they are most of the text
+of a fair transcript, and the rest is aligned in a band around the
+diagonal that is doubled until it holds the best path (Ukkonen), so an
+utterance costs about its length times its errors.
+"""
+
+import re
+
+UNITS = ('char', 'word', 'mixed')
+
+_PUNCT_RE = re.compile(r'[^\w\s]|_')
+# CJK ideographs count one by one, other runs of letters and digits as words
+_MIXED_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[^\s\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+
+def normalize(text, punct=False, case=False):
+    """Text lowercased and with punctuation and symbols replaced by spaces, unless kept."""
+    if not case:
+        text = text.lower()
+    if not punct:
+        text = _PUNCT_RE.sub(' ', text)
+    return text
+
+
+def tokenize(text, unit='char'):
+    """Tokens of a text: characters without spaces, whitespace separated words, or CJK characters and words."""
+    if unit == 'char':
+        return ''.join(text.split())
+    if unit == 'word':
+        return text.split()
+    if unit == 'mixed':
+        return _MIXED_RE.findall(text)
+    raise ValueError(f'unknown unit {unit!r}, expect one of {UNITS}')
+
+
+def _banded(ref, hyp, band, weight):
+    """Cost errors * weight + indels of the best path within band cells of the diagonal."""
+    n, m = len(ref), len(hyp)
+    indel = weight + 1
+    inf = indel * (n + m + 1)
+    prev = [inf] * (m + 1)
+    for j in range(min(m, band) + 1):
+        prev[j] = j * indel
+    for i in range(1, n + 1):
+        cur = [inf] * (m + 1)
+        lo, hi = max(0, i - band), min(m, i + band)
+        if lo == 0:
+            cur[0] = i * indel
+            lo = 1
+        token = ref[i - 1]
+        left = cur[lo - 1]
+        for j in range(lo, hi + 1):
+            best = prev[j - 1] if hyp[j - 1] == token else prev[j - 1] + weight
+            up = prev[j] + indel
+            if up < best:
+                best = up
+            left += indel
+            if left < best:
+                best = left
+            cur[j] = left = best
+        prev = cur
+    return prev[m]
+
+
+def align(ref, hyp):
+    """Substitutions, insertions and deletions of the best alignment of two token sequences."""
+    start, shorter = 0, min(len(ref), len(hyp))
+    while start < shorter and ref[start] == hyp[start]:
+        start += 1
+    n, m = len(ref), len(hyp)
+    while n > start and m > start and ref[n - 1] == hyp[m - 1]:
+        n -= 1
+        m -= 1
+    ref, hyp = ref[start:n], hyp[start:m]
+    n, m = len(ref), len(hyp)
+    if not n or not m:
+        return 0, m, n
+    weight = n + m + 1  # more than any number of indels
+    band = abs(n - m) + 2
+    while True:
+        cost = _banded(ref, hyp, band, weight)
+        errors, indels = divmod(cost, weight)
+        # a path leaving the band has more errors than the band is wide
+        if errors <= band or band >= max(n, m):
+            deletions = (indels + n - m) // 2
+            return errors - indels, indels - deletions, deletions
+        band *= 2
+
+
+class Score:
+    """Edit counts summed over utterances."""
+
+    def __init__(self):
+        self.utterances = 0
+        self.wrong = 0  # utterances with any error
+        self.ref = 0
+        self.sub = 0
+        self.ins = 0
+        self.dels = 0
+
+    def add(self, ref, sub, ins, dels):
+        self.utterances += 1
+        self.wrong += bool(sub or ins or dels)
+        self.ref += ref
+        self.sub += sub
+        self.ins += ins
+        self.dels += dels
+
+    @property
+    def errors(self):
+        return self.sub + self.ins + self.dels
+
+    @property
+    def rate(self):
+        """Errors per reference token, in percent."""
+        return 100.0 * self.errors / self.ref if self.ref else 0.0
+
+    def report(self, name):
+        """Kaldi style summary lines, e.g. `%WER 5.23 [ 523 / 10000, 100 ins, 200 del, 223 sub ]`."""
+        ser = 100.0 * self.wrong / self.utterances if self.utterances else 0.0
+        return (f'%{name} {self.rate:.2f} [ {self.errors} / {self.ref}, {self.ins} ins, {self.dels} del, '
+                f'{self.sub} sub ]\n%SER {ser:.2f} [ {self.wrong} / {self.utterances} ]')
+
+    def to_dict(self):
+        return dict(rate=self.rate, errors=self.errors, ref=self.ref, sub=self.sub, ins=self.ins, dels=self.dels,
+                    utterances=self.utterances, wrong=self.wrong)
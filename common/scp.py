@@ -0,0 +1,27 @@
+"""Lazy readers of scp lists."""
+
+import uuid
+
+
+def parse_record(record):
+    """Split a scp line into key and audio path, generating a key if absent."""
+    try:
+        key, audio = record.rstrip().split(maxsplit=1)
+    except ValueError:
+        audio = record.rstrip()
+        key = uuid.uuid1()
+    return key, audio
+
+
+def iter_scp(in_scp, shard=0, num_shards=1):
+    """Yield (key, audio) pairs of a scp file one line at a time.
+
+    Args:
+        in_scp (str): scp file which consists of key and value.
+        shard (int, optional): index of the shard to read. Defaults to 0.
+        num_shards (int, optional): lines are assigned to shards by line number. Defaults to 1.
+    """
+    with open(in_scp, 'r', encoding='utf8') as f:
+        for i, record in enumerate(f):
+            if i % num_shards == shard and record.strip():
+                yield parse_record(record)
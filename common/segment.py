@@ -0,0 +1,154 @@
+"""Splitting long recordings at pauses, and stitching the transcripts back.
+
+A recording is cut near every 1/N of its duration, at the quietest frame
+within a search window, so that words are rarely split. Segments overlap
+slightly past each cut, and text repeated across a join is removed when
+the transcripts are stitched in order.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # only needed when segmenting
+    np = None
+
+from .audio import WavInfo, stream_format
+from .resample import BLOCK_FRAMES, ConvertedReader, _to_float, convert_wav, needs_conversion, wav_header
+from .source import parse_source
+
+
+def source_info(path, audio_conf=None):
+    """WavInfo of a wav file, or of raw PCM described by the audio config.
+
+    The data size is clamped to the file, so streaming wavs with a
+    placeholder size are handled as well. Pipes have no known size and
+    cannot be segmented.
+    """
+    source = parse_source(path)
+    size = source.size()
+    if size is None:
+        raise ValueError(f'cannot segment a pipe: {path}')
+    info = source.probe()
+    if info is None:
+        return WavInfo(*stream_format(audio_conf), 0, size)
+    data_size = size - info.data_offset
+    if 0 < info.data_size < data_size:
+        data_size = info.data_size
+    return info._replace(data_size=data_size)
+
+
+def plan_segments(path, info, segments, overlap=0.5, min_duration=60.0, search=5.0, frame=0.02):
+    """Cut points of a recording as frame ranges.
+
+    Args:
+        path (str): audio file or archive entry, see common.source.
+        info (WavInfo): format and data location, see source_info.
+        segments (int): max number of segments.
+        overlap (float, optional): seconds each segment runs past its cut. Defaults to 0.5.
+        min_duration (float, optional): segments are not made shorter than this. Defaults to 60.
+        search (float, optional): seconds searched on both sides of an even cut for a pause. Defaults to 5.
+        frame (float, optional): frame length in seconds of the energy analysis. Defaults to 0.02.
+
+    Returns:
+        list of non-empty (start, end) sample frames, end exclusive, with strictly increasing
+        starts, fewer than `segments` when the search windows of the cuts overlap.
+    """
+    frame_bytes = info.sample_bytes * info.channels
+    frames = info.data_size // frame_bytes
+    duration = frames / info.sample_rate
+    n = max(1, min(segments, int(duration // min_duration)))
+    if n == 1:
+        return [(0, frames)]
+    if np is None:
+        raise ImportError('numpy is required to segment audio, pip install numpy')
+
+    hop = max(1, int(info.sample_rate * frame))
+    radius = int(info.sample_rate * search)
+    cuts = [0]
+    with parse_source(path).open() as f:
+        for i in range(1, n):
+            even = frames * i // n
+            # every cut is past the previous one and before the end, so the spans strictly increase
+            lo = max(cuts[-1] + hop, even - radius)
+            hi = min(frames - hop, even + radius)
+            if hi <= lo:
+                continue  # the previous cut took this window, one segment fewer
+            f.seek(info.data_offset + lo * frame_bytes)
+            x = _to_float(f.read((hi - lo) * frame_bytes), info.sample_bytes, info.channels)
+            m = len(x) // hop
+            if m == 0:
+                cuts.append((lo + hi) // 2)
+                continue
+            energy = (x[:m * hop] ** 2).reshape(m, -1).mean(axis=1)
+            cuts.append(lo + int(np.argmin(energy)) * hop + hop // 2)
+    cuts.append(frames)
+    pad = int(info.sample_rate * overlap)
+    return [(start, min(frames, end + pad)) for start, end in zip(cuts, cuts[1:])]
+
+
+def _read_range(f, offset, size, block=BLOCK_FRAMES):
+    f.seek(offset)
+    while size > 0:
+        data = f.read(min(block, size))
+        if not data:
+            return
+        size -= len(data)
+        yield data
+
+
+def open_segment(path, info, start, end, sample_rate=None, channels=1, wav=True):
+    """Open frames [start, end) of a recording as a standalone stream.
+
+    Args:
+        path (str): audio file or archive entry, see common.source.
+        info (WavInfo): format and data location, see source_info.
+        start (int): first sample frame.
+        end (int): sample frame after the last one.
+        sample_rate (int, optional): convert to 16 bit sample_rate/channels when the format differs.
+        channels (int, optional): target channels. Defaults to 1.
+        wav (bool, optional): prefix a wav header, False for raw PCM. Defaults to True.
+    """
+    frame_bytes = info.sample_bytes * info.channels
+    part = info._replace(data_offset=info.data_offset + start * frame_bytes,
+                         data_size=(end - start) * frame_bytes)
+    f = parse_source(path).open()
+    if sample_rate is not None and needs_conversion(part, sample_rate, channels):
+        return ConvertedReader(convert_wav(f, part, sample_rate, channels), source=f)
+
+    def chunks():
+        if wav:
+            yield wav_header(part.sample_rate, part.channels, part.sample_bytes, part.data_size)
+        yield from _read_range(f, part.data_offset, part.data_size)
+    return ConvertedReader(chunks(), source=f)
+
+
+def stitch(texts, max_overlap=20, min_match=2):
+    """Concatenate transcripts in order, dropping text repeated across joins.
+
+    The longest suffix of the text so far that is also a prefix of the next
+    transcript, between min_match and max_overlap characters, is kept once.
+    """
+    out = ''
+    for text in texts:
+        for k in range(min(max_overlap, len(out), len(text)), min_match - 1, -1):
+            if out.endswith(text[:k]):
+                text = text[k:]
+                break
+        out += text
+    return out
+
+
+def join_offset_maps(maps, starts):
+    """Offset maps of segments as one map over the concatenated trimmed segments.
+
+    Args:
+        maps (list): offset map of every segment, see VadReader.offset_map.
+        starts (list): source start of every segment in seconds.
+    """
+    joined, elapsed = [], 0.0
+    for offset_map, start in zip(maps, starts):
+        for out, src, duration in offset_map or ():
+            joined.append((elapsed + out, start + src, duration))
+        if offset_map:
+            out, _, duration = offset_map[-1]
+            elapsed += out + duration
+    return joined
@@ -0,0 +1,262 @@
+"""Audio sources named by the second column of a scp list.
+
+    /data/utt1.wav                 a file
+    /data/wav.1.ark:1234           a wav stored in a Kaldi archive at a byte offset
+    sox utt1.flac -t wav - |       stdout of a shell command, Kaldi pipe syntax
+
+Files and archive entries are read through read-only memory maps, and
+their readers return memoryview slices of the map, so audio goes to the
+socket or into slice uploads without copies. An archive is mapped once
+per process and shared by all its entries. Pipes are read as a stream,
+and spooled to an anonymous temp file only when the whole audio is needed
+at once.
+"""
+
+import io
+import mmap
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from .audio import read_wav_header
+
+
+ARK_RE = re.compile(r'^(.+\.ark):(\d+)$')
+# bytes kept at the start of a pipe, so the wav header can be probed and read again
+PIPE_HEAD = 64 * 1024
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def _archive(path):
+    """Shared read-only map of a Kaldi archive, kept for the life of the process."""
+    with _archives_lock:
+        if path not in _archives:
+            with open(path, 'rb') as f:
+                _archives[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _archives[path]
+
+
+@contextmanager
+def map_file(f):
+    """Memoryview of a whole binary file through a read-only map."""
+    if os.fstat(f.fileno()).st_size == 0:
+        yield memoryview(b'')
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        yield view
+
+
+class MemoryReader(io.RawIOBase):
+    """Seekable reader of a memoryview, returning slices of it instead of copies."""
+
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(len(self.view), self.pos + size)
+        data = self.view[self.pos:end]
+        self.pos = max(self.pos, end)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: len(self.view)}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class PipeReader(io.RawIOBase):
+    """Reader of the stdout of a shell command.
+
+    The first `keep` bytes are kept, so seeking back into them works, and
+    seeking forward reads and drops the data in between. Closing the reader
+    stops the command.
+    """
+
+    def __init__(self, cmd, keep=PIPE_HEAD):
+        self.proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
+        self.keep = keep
+        self.head = bytearray()
+        self.pos = 0
+        self.piped = 0  # bytes read from the pipe
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        out = b''
+        if self.pos < len(self.head):
+            end = len(self.head) if size is None or size < 0 else min(len(self.head), self.pos + size)
+            out = bytes(self.head[self.pos:end])
+            self.pos = end
+            if size is not None and size >= 0:
+                size -= len(out)
+        if size == 0:
+            return out
+        if self.pos < self.piped:
+            raise io.UnsupportedOperation(f'cannot read a pipe from {self.pos} after {self.piped}')
+        data = self.proc.stdout.read(size)
+        if self.piped == len(self.head) < self.keep:
+            self.head += data[:self.keep - len(self.head)]
+        self.piped += len(data)
+        self.pos += len(data)
+        return out + data if out else data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('cannot seek from the end of a pipe')
+        if offset < len(self.head) or offset == self.piped:
+            self.pos = offset
+            return self.pos
+        if offset < self.piped:
+            raise io.UnsupportedOperation(f'cannot seek a pipe back to {offset}')
+        self.pos = self.piped
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, 1 << 20)):
+                break
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if not self.closed:
+            self.proc.stdout.close()
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+        super().close()
+
+
+class FileSource:
+    seekable = True
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def probe(self):
+        with self.open() as f:
+            return read_wav_header(f)
+
+    @contextmanager
+    def view(self):
+        with self.open() as f, map_file(f) as view:
+            yield view
+
+
+class ArkSource(FileSource):
+    """A wav entry of a Kaldi archive, the offset is the one written in the scp by `ark,scp`."""
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.offset = offset
+        self.name = f'{os.path.basename(path)}.{offset}.wav'
+
+    def _entry(self):
+        archive = _archive(self.path)
+        start = self.offset
+        if archive[start:start + 2] == b'\0B':  # binary mode marker of Kaldi objects
+            start += 2
+        if archive[start:start + 4] != b'RIFF':
+            raise ValueError(f'{self.path}:{self.offset} is not a wav entry')
+        riff_size, = struct.unpack('<I', archive[start + 4:start + 8])
+        return archive, start, min(len(archive), start + 8 + riff_size)
+
+    def open(self):
+        archive, start, end = self._entry()
+        return MemoryReader(memoryview(archive)[start:end])
+
+    def size(self):
+        _, start, end = self._entry()
+        return end - start
+
+    @contextmanager
+    def view(self):
+        archive, start, end = self._entry()
+        with memoryview(archive) as view, view[start:end] as entry:
+            yield entry
+
+
+class PipeSource:
+    """stdout of a shell command, run again by every open()."""
+    seekable = False
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.info = None
+        self.probed = None  # reader left open by probe(), handed to the next open()
+
+    @property
+    def name(self):
+        return 'pipe.wav' if self.probe() is not None else 'pipe.pcm'
+
+    def open(self):
+        if self.probed is not None:
+            reader, self.probed = self.probed, None
+            return reader
+        return PipeReader(self.cmd)
+
+    def size(self):
+        return None
+
+    def probe(self):
+        if self.probed is None and self.info is None:
+            reader = PipeReader(self.cmd)
+            self.info = read_wav_header(reader)
+            reader.seek(0)
+            self.probed = reader
+        return self.info
+
+    @contextmanager
+    def view(self):
+        with self.open() as reader, tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(reader, spool, 1 << 20)
+            spool.flush()
+            with map_file(spool) as view:
+                yield view
+
+
+def parse_source(audio):
+    """Source of the audio column of a scp line, sources are passed through."""
+    if not isinstance(audio, str):
+        return audio
+    audio = audio.strip()
+    if audio.endswith('|'):
+        return PipeSource(audio[:-1].strip())
+    match = ARK_RE.match(audio)
+    if match and not os.path.exists(audio):
+        return ArkSource(match.group(1), int(match.group(2)))
+    return FileSource(audio)
+
+
+def open_source(audio):
+    """Binary reader of the audio column of a scp line."""
+    return parse_source(audio).open()
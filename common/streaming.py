@@ -0,0 +1,502 @@
+"""Websocket streaming sessions and their batch runner, shared by the streaming scripts.
+
+The services differ only in the start handshake and the result messages.
+A script subclasses StreamTask with `_start` and `_get`, names the key of
+the request params holding the audio config and the metrics registry of
+its sessions, and runs its command line through add_arguments and main.
+Everything else, pacing, resampling, VAD, segments, retries, caching,
+adaptive concurrency, sharding and the ledger, lives here.
+"""
+
+import asyncio
+import concurrent.futures
+import copy
+import json
+import logging
+import time
+import urllib.parse as urlparse
+from contextlib import nullcontext
+from functools import partial
+
+import websockets
+import yaml
+from yaml import SafeLoader
+
+from .adaptive import AdaptiveLimiter
+from .audio import stream_format
+from .cache import ResultCache, content_key, endpoint
+from .hypothesis import Hypothesis
+from .journal import Journal
+from .ledger import run_ledger
+from .pacing import Pacer
+from .pipeline import bounded_as_completed
+from .ratelimit import RateLimits, parse_limits
+from .resample import needs_conversion, open_audio
+from .retry import Retry, ServiceError, http_retryable, is_retryable
+from .scp import iter_scp
+from .segment import join_offset_maps, open_segment, plan_segments, source_info, stitch
+from .source import parse_source
+from .vad import VadReader
+
+logger = logging.getLogger(__name__)
+
+# going away, abnormal closure, internal error, service restart, try again later, bad gateway
+RETRYABLE_CLOSE_CODES = {1001, 1006, 1011, 1012, 1013, 1014}
+
+
+def parse_config(conf):
+    with open(conf, encoding='utf8') as f:
+        data = yaml.load(f, Loader=SafeLoader)
+    try:
+        query = data['query']
+        msg = data['msg']
+    except KeyError:
+        logger.error(f"Parsing config failed, please check the yaml file.")
+        raise
+    return query, msg
+
+
+class StreamTask:
+    """One audio streamed over a websocket session, subclassed per service.
+
+    Subclasses set `audio_key`, the key of the request params whose
+    `audio` entry is the audio config, and `metrics`, the registry of the
+    stage timings. They implement `_start(websocket)`, which marks
+    'connected' and sends the request params, and the async generator
+    `_get(websocket, feeder)`, which yields the hypotheses of the session
+    and marks 'final' before its last one.
+    """
+
+    audio_key = None
+    metrics = None
+
+    def __init__(self, name, url, params, audio, stride=0.04, speed=1.0, limits=None, resample=False,
+                 vad=None, span=None):
+        self.name = name
+        self.url = url
+        self.params = params
+        self.audio = audio
+        self.source = parse_source(audio)
+        self.stride = stride
+        self.speed = speed
+        self.limits = limits or RateLimits()
+        self.audio_conf = params.get(self.audio_key, {}).get('audio')
+        self.vad = vad
+        self.span = span
+        self.offset_map = None
+        self.marks = {}  # perf_counter of the stages of the last session
+        self.audio_seconds = 0.0
+        self.resample = resample
+        self.prepared = False
+        self.target = None
+
+    def _prepare(self):
+        """Probe the source once before the first session, run in a thread as a pipe starts its command."""
+        self.prepared = True
+        if self.resample:
+            sample_rate, channels, _ = stream_format(self.audio_conf)
+            if needs_conversion(self.source.probe(), sample_rate, channels):
+                # send 16 bit wav in the configured rate and channels, and say so in the request
+                self.target = (sample_rate, channels)
+                self.params = copy.deepcopy(self.params)
+                self.audio_conf = self.params[self.audio_key]['audio']
+                self.audio_conf.update(audioType='wav', sampleRate=sample_rate, channel=channels, sampleBytes=2)
+
+    def _mark(self, stage):
+        self.marks.setdefault(stage, time.perf_counter())
+
+    def _report(self):
+        """Record the stage timings of a finished session.
+
+        Connect time includes the wait for the connect quota, and the real
+        time factor is the time from the first audio to the final result
+        over the duration of the audio sent.
+        """
+        marks = self.marks
+        for name, start, end in (('connect_seconds', 'begin', 'connected'),
+                                 ('first_result_seconds', 'first_audio', 'first_result'),
+                                 ('first_partial_seconds', 'first_audio', 'first_partial'),
+                                 ('final_latency_seconds', 'last_audio', 'final'),
+                                 ('session_seconds', 'begin', 'final')):
+            if start in marks and end in marks:
+                self.metrics.observe(name, marks[end] - marks[start])
+        if self.audio_seconds and 'first_audio' in marks and 'final' in marks:
+            self.metrics.observe('audio_seconds', self.audio_seconds)
+            self.metrics.observe('rtf', (marks['final'] - marks['first_audio']) / self.audio_seconds)
+
+    def _open(self):
+        """Reader of the audio to send and its byte rate.
+
+        The byte rate comes from the wav header, or from the audio config
+        for raw data. Wav in another format than the config is downmixed
+        and resampled on the fly when resampling is enabled. With vad, long
+        silences of 16 bit audio are cut. With a span, only those sample
+        frames of the source are read, as a standalone stream.
+        """
+        if self.target is not None:
+            info = None
+            sample_rate, channels, sample_bytes = stream_format(self.audio_conf)
+        else:
+            info = self.source.probe()
+            sample_rate, channels, sample_bytes = stream_format(self.audio_conf, info)
+        byte_rate = sample_rate * channels * sample_bytes
+        wav = self.target is not None or info is not None
+        if self.span is not None:
+            f = open_segment(self.source, source_info(self.source, self.audio_conf), *self.span,
+                             *(self.target or ()), wav=wav)
+            header_size = 44 if wav else 0
+        elif self.target is not None:
+            f = open_audio(self.source, *self.target)[0]
+            header_size = 44
+        else:
+            f = self.source.open()
+            header_size = info.data_offset if info else 0
+        if self.vad is not None and sample_bytes == 2:
+            f = VadReader(f, header_size, sample_rate, channels, **self.vad)
+        elif self.vad is not None:
+            logger.warning(f"VAD needs 16 bit audio, {self.audio} is sent untrimmed.")
+        return f, byte_rate, channels * sample_bytes
+
+    async def _feed(self, websocket):
+        """Read and Send audio data streamly.
+
+        Chunks are scheduled against a monotonic clock at `speed` times real
+        time. The reader is opened in a thread, and a pipe is also read in
+        one, as it waits on its command. With vad, the offset map of the
+        kept segments is left in `offset_map`.
+
+        Args:
+            websocket ([type]): webSocket client connection.
+        """
+        opening = asyncio.ensure_future(asyncio.to_thread(self._open))
+        try:
+            f, byte_rate, block_align = await asyncio.shield(opening)
+        except asyncio.CancelledError:
+            # the thread still opens the reader, close it then so a pipe command does not linger
+            opening.add_done_callback(lambda done: done.cancelled() or done.exception() or done.result()[0].close())
+            raise
+        pacer = Pacer(byte_rate, self.speed, self.stride, block_align=block_align)
+        piped = not self.source.seekable
+        sent = 0
+        with f:
+            while True:
+                size = pacer.next_chunk_size()
+                data = await asyncio.to_thread(f.read, size) if piped else f.read(size)
+                if data:
+                    await websocket.send(data)
+                    self._mark('first_audio')
+                    sent += len(data)
+                    await pacer.wait(len(data))
+                else:
+                    if isinstance(f, VadReader):
+                        self.offset_map = f.offset_map()
+                    self.audio_seconds = sent / byte_rate
+                    self._mark('last_audio')
+                    await websocket.send(b'')
+                    return
+
+    def _hypothesis(self, text, final, response):
+        now = time.perf_counter()
+        if not final:
+            self._mark('first_partial')
+        return Hypothesis(text, final, time.time(), now - self.marks.get('first_audio', self.marks['begin']), response)
+
+    @staticmethod
+    async def _recv(websocket, feeder):
+        """Next message of the service, or the error of the feeder if it fails first."""
+        if not feeder.done():
+            receive = asyncio.ensure_future(websocket.recv())
+            await asyncio.wait((receive, feeder), return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done() and feeder.exception() is not None:
+                receive.cancel()
+            else:
+                return await receive
+        feeder.result()  # raises the error of a failed feeder
+        return await websocket.recv()
+
+    async def stream(self):
+        """Run a session and yield its hypotheses as they arrive.
+
+        Partial hypotheses are yielded as the service sends them, final ones
+        once a sentence or the session is settled, the generator ends after
+        the final result of the session. Closing the generator early ends
+        the session.
+        """
+        if not self.prepared:
+            await asyncio.to_thread(self._prepare)
+        self.marks = {'begin': time.perf_counter()}
+        # the connect slot is held for the whole session
+        async with self.limits('connect'), websockets.connect(self.url) as websocket:
+            await self._start(websocket)
+            feeder = asyncio.create_task(self._feed(websocket))
+            try:
+                async for hypothesis in self._get(websocket, feeder):
+                    yield hypothesis
+                await feeder
+            finally:
+                feeder.cancel()
+        self._report()
+
+    async def naive_task(self):
+        """Run a naive task, returning the final hypotheses joined.
+        """
+        return "".join([hypothesis.text async for hypothesis in self.stream() if hypothesis.final])
+
+    def run(self, task: str="naive"):
+        if task == "naive":
+            self.result = asyncio.run(self.naive_task())
+        else:
+            raise NotImplementedError(f'task type {task} is not supported yet.')
+        return self
+
+
+def retryable(exc):
+    """Retry dropped connections, handshake throttling/5xx and network errors, not service errors."""
+    if isinstance(exc, websockets.exceptions.ConnectionClosed):
+        return exc.rcvd is None or exc.rcvd.code in RETRYABLE_CLOSE_CODES
+    if isinstance(exc, websockets.exceptions.InvalidHandshake):
+        status_code = getattr(exc, 'status_code', None) or getattr(getattr(exc, 'response', None), 'status_code', None)
+        return status_code is not None and http_retryable(status_code)
+    return is_retryable(exc)
+
+
+def overloaded(exc):
+    """Service errors and failures worth a retry shrink the adaptive concurrency."""
+    return isinstance(exc, ServiceError) or retryable(exc)
+
+
+async def batch_task(task_cls, records, url, params, trans_file_fd, concurrency=10, journal=None, retry=None,
+                     offsets_fd=None, segments=None, cache=None, adaptive=None, **task_kwargs):
+    """Run naive tasks for all records on one event loop.
+
+    Args:
+        task_cls (type): StreamTask subclass of the service.
+        records (iterable): (key, audio) pairs, consumed lazily.
+        url (str): websocket url with query.
+        params (dict): request params sent on start.
+        trans_file_fd (file): output transcription file.
+        concurrency (int, optional): max open sessions and max files in flight. Defaults to 10.
+        journal (Journal, optional): finished keys are skipped and recorded.
+        retry (Retry, optional): retry policy of a whole session.
+        offsets_fd (file, optional): receives the VAD offset map of every task as `key\tjson`.
+        segments (dict, optional): arguments of plan_segments, long files are then split at
+            pauses and the segments streamed over concurrent sessions, each counted in concurrency.
+        cache (ResultCache, optional): results are looked up before connecting and stored after.
+        adaptive (AdaptiveLimiter, optional): every session attempt takes a slot of it, concurrency
+            then stays in between its bounds.
+        task_kwargs: passed to task_cls, e.g. speed and limits.
+    """
+    metrics = task_cls.metrics
+    if journal is not None:
+        records = (record for record in records if not journal.is_done(record[0]))
+    retry = retry or Retry(classify=retryable)
+    # files are split into segments after they are admitted, so the sessions are bounded rather than the files
+    slots = asyncio.Semaphore(concurrency)
+    audio_conf = params.get(task_cls.audio_key, {}).get('audio')
+    # everything that changes the result, the apikey does not
+    query = [(k, v) for k, v in urlparse.parse_qsl(urlparse.urlparse(url).query) if k != 'apikey']
+    config = dict(url=endpoint(url), query=query, params=params, resample=task_kwargs.get('resample'),
+                  vad=task_kwargs.get('vad'))
+    if segments is not None:
+        config['segments'] = segments
+
+    async def session(asr_task):
+        """One attempt of a session, in a session slot and a slot of the adaptive limiter if any."""
+        async with slots:
+            if adaptive is None:
+                return await asr_task.naive_task()
+            async with adaptive.async_slot() as slot:
+                result = await asr_task.naive_task()
+                # the time to the final result once the audio is sent, the rest scales with the audio
+                slot.latency = asr_task.marks['final'] - asr_task.marks['last_audio']
+                return result
+
+    async def worker(record):
+        key, audio = record
+        spans = [None]
+        digest = None
+        try:
+            if cache is not None:
+                digest = await asyncio.to_thread(content_key, audio, config)
+                hit = cache.get(digest)
+                if hit is not None:
+                    logger.info(f"Cached result of {key}, audio: {audio}")
+                    metrics.inc('cache_hits')
+                    return key, hit['result'], hit['offset_map']
+            if segments is not None and parse_source(audio).seekable:
+                info = source_info(audio, audio_conf)
+                spans = plan_segments(audio, info, **segments)
+            if len(spans) == 1:
+                spans = [None]
+            asr_tasks = [task_cls(key, url, params, audio, span=span, **task_kwargs) for span in spans]
+            sessions = [asyncio.create_task(retry.call_async(session, t)) for t in asr_tasks]
+            try:
+                results = await asyncio.gather(*sessions)
+            finally:
+                # a failed segment fails the whole file
+                for pending in sessions:
+                    pending.cancel()
+        except Exception:
+            logger.exception(f"Task {key} failed, audio: {audio}")
+            metrics.inc('failures')
+            return None
+        result, offset_map = stitch(results), asr_tasks[0].offset_map
+        if spans[0] is not None and offset_map is not None:
+            offset_map = join_offset_maps([t.offset_map for t in asr_tasks],
+                                          [span[0] / info.sample_rate for span in spans])
+        if digest is not None:
+            cache.put(digest, dict(result=result, offset_map=offset_map))
+        return key, result, offset_map
+
+    async for future in bounded_as_completed(worker, records, concurrency):
+        outcome = future.result()
+        if outcome is not None:
+            key, result, offset_map = outcome
+            metrics.inc('tasks')
+            trans_file_fd.write(f'{key}\t{result}\n')
+            trans_file_fd.flush()
+            if offsets_fd is not None and offset_map is not None:
+                offsets_fd.write(f'{key}\t{json.dumps(offset_map)}\n')
+                offsets_fd.flush()
+            if journal is not None:
+                journal.record_done(key)
+
+
+def run_shard(task_cls, in_scp, out_trans, url, params, concurrency, shard=0, num_shards=1, limits=None, retries=4,
+              cache=None, cache_size=1 << 30, adaptive=None, limit_shards=None, **task_kwargs):
+    """Run the records of one shard in a single event loop.
+
+    Records are assigned to shards by line number. Every shard appends
+    lines to the same output and journal, both are expected to be
+    truncated beforehand unless resuming. Quotas given by `limits` specs
+    are divided evenly between `limit_shards` processes, by default the
+    shards. `cache` is the path of a result
+    cache shared by all shards. With an `adaptive` max, sessions start at
+    `concurrency` and adapt between 1 and that max. Returns a snapshot of
+    the metrics of the shard and its number of failed files.
+    """
+    offsets = open(f'{out_trans}.offsets', 'a', encoding='utf8') if task_kwargs.get('vad') else nullcontext()
+    results = ResultCache(cache, cache_size) if cache else nullcontext()
+    with open(out_trans, 'a', encoding='utf8') as trans_file_fd, \
+            Journal(f'{out_trans}.journal', resume=True) as journal, offsets as offsets_fd, results as result_cache:
+        records = iter_scp(in_scp, shard, num_shards)
+        task_kwargs['limits'] = RateLimits(parse_limits(limits, limit_shards or num_shards))
+        retry = Retry(attempts=retries + 1, classify=retryable)
+        limiter = None
+        if adaptive:
+            limiter = AdaptiveLimiter(concurrency, adaptive, classify=overloaded)
+            concurrency = max(concurrency, adaptive)
+        asyncio.run(batch_task(task_cls, records, url, params, trans_file_fd, concurrency, journal, retry, offsets_fd,
+                               cache=result_cache, adaptive=limiter, **task_kwargs))
+    return task_cls.metrics.snapshot(), task_cls.metrics.count('failures')
+
+
+def run_units(task_cls, ledger, in_scp, out_trans, url, params, concurrency, unit_size=100, lease=300.0,
+              num_shards=1, **task_kwargs):
+    """Run units of a ledger shared by workers on many hosts, see common.ledger.
+
+    Every unit is run by run_shard into its own part, resuming from the
+    journal of the part. Quotas are divided between the `num_shards`
+    processes of this host running units. Returns a snapshot of the
+    metrics of this worker and the number of failed units; files failed
+    in a unit which later finished are not counted.
+    """
+    run_unit = partial(run_shard, task_cls, url=url, params=params, concurrency=concurrency, limit_shards=num_shards,
+                       **task_kwargs)
+    failed = run_ledger(ledger, in_scp, out_trans, run_unit, unit_size, lease)
+    return task_cls.metrics.snapshot(), failed
+
+
+def add_arguments(parser, url, concurrency=10, segments=False):
+    """Command line of a streaming script, with the segment options if the service takes long audio."""
+    parser.add_argument("in_scp", type=str, help="Input scp file which consisit of key and value.")
+    parser.add_argument("out_trans", type=str, help="Output asr transcription.")
+    parser.add_argument("-c", dest="conf", required=True, type=str, help="Yaml file of configuration.")
+    parser.add_argument("--url", type=str, default=url,
+                        help="Service url without query, e.g. of a local mock server.")
+    parser.add_argument("-j", "--concurrency", type=int, default=concurrency,
+                        help="Max concurrent sessions per process.")
+    parser.add_argument("-nproc", "--nproc", type=int, default=1,
+                        help="Number of processes, each running its own event loop.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Multiple of real time to stream audio at, 0 sends as fast as the server accepts.")
+    parser.add_argument("--limit", action="append", default=[], metavar="connect=QPS[:CONCURRENCY]",
+                        help="Quota of websocket connects per second and of open sessions, across all processes.")
+    parser.add_argument("--resample", action="store_true",
+                        help="Downmix and resample wav audio to the rate and channels of the config before sending.")
+    parser.add_argument("--vad", action="store_true",
+                        help="Cut long silences before sending, offsets of kept audio go to out_trans.offsets.")
+    parser.add_argument("--vad-threshold", type=float, default=-40.0,
+                        help="Frames below this level in dBFS are silence.")
+    parser.add_argument("--vad-keep", type=float, default=0.3,
+                        help="Seconds of each silence kept, 0 drops silences entirely.")
+    if segments:
+        parser.add_argument("--segments", type=int, default=1,
+                            help="Split long files at pauses into up to this many segments streamed concurrently.")
+        parser.add_argument("--segment-min", type=float, default=60.0,
+                            help="Min seconds of a segment, shorter files are split into fewer segments.")
+        parser.add_argument("--overlap", type=float, default=0.5,
+                            help="Seconds each segment runs past its cut, repeated text is removed when stitching.")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="SQLite file caching results by audio content and config, unchanged audio is not resent.")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Max MB of cached results, least recently used are evicted.")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Write stage timing histograms to out_trans.metrics.json and out_trans.metrics.prom.")
+    parser.add_argument("--adaptive", type=int, default=None, metavar="MAX",
+                        help="Adapt the sessions per process between 1 and MAX, starting at -j.")
+    parser.add_argument("--retries", type=int, default=4,
+                        help="Retries of a session on dropped connections, throttling and 5xx.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip keys finished by a previous run and append to out_trans.")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Ledger file on shared storage, all workers running this command share its units.")
+    parser.add_argument("--unit-size", type=int, default=100, help="Lines of the scp list in a unit of the ledger.")
+    parser.add_argument("--lease", type=float, default=300.0,
+                        help="Seconds after the last heartbeat of a worker its unit is given to another one.")
+
+
+def main(task_cls, args):
+    """Transcribe the scp list of parsed add_arguments options with task_cls sessions.
+
+    Returns the exit status of the script, 1 if any file, or with a ledger any unit, failed.
+    """
+    parse_limits(args.limit)  # fail early on invalid specs
+
+    query, params = parse_config(args.conf)
+    url = urlparse.urlparse(args.url)._replace(query=urlparse.urlencode(query)).geturl()
+    in_scp = args.in_scp
+    out_trans = args.out_trans
+    logger.info(f'URL:{url}')
+
+    if not args.resume and not args.ledger:
+        open(out_trans, 'w').close()
+        open(f'{out_trans}.journal', 'w').close()
+        if args.vad:
+            open(f'{out_trans}.offsets', 'w').close()
+
+    task_kwargs = dict(limits=args.limit, retries=args.retries, cache=args.cache, cache_size=args.cache_size << 20,
+                       adaptive=args.adaptive, speed=args.speed, resample=args.resample,
+                       vad=dict(threshold=args.vad_threshold, keep_silence=args.vad_keep) if args.vad else None)
+    if getattr(args, 'segments', 1) > 1:
+        task_kwargs['segments'] = dict(segments=args.segments, overlap=args.overlap, min_duration=args.segment_min)
+    if args.ledger:
+        # every process is a worker of the ledger, parts are merged into out_trans by the last one
+        task_kwargs.update(unit_size=args.unit_size, lease=args.lease, num_shards=args.nproc)
+        run, shard_args = partial(run_units, task_cls, args.ledger), [() for _ in range(args.nproc)]
+    else:
+        run, shard_args = partial(run_shard, task_cls), [(shard, args.nproc) for shard in range(args.nproc)]
+    metrics = task_cls.metrics
+    if args.nproc <= 1:
+        outcomes = [run(in_scp, out_trans, url, params, args.concurrency, **task_kwargs)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.nproc) as executor:
+            shards = [executor.submit(run, in_scp, out_trans, url, params, args.concurrency, *shard, **task_kwargs)
+                      for shard in shard_args]
+            outcomes = [shard.result() for shard in shards]
+        for snapshot, _ in outcomes:
+            metrics.merge(snapshot)
+    metrics.log(logger.info)
+    if args.metrics:
+        metrics.export(f'{out_trans}.metrics')
+    return 1 if any(failed for _, failed in outcomes) else 0
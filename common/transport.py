@@ -0,0 +1,40 @@
+"""Pooled keep-alive HTTP transport shared by worker threads."""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .ratelimit import RateLimits
+
+
+class Transport:
+    """A requests session whose connections are reused across calls and threads.
+
+    Args:
+        pool_size (int, optional): max kept-alive connections per host. Defaults to 10.
+        timeout (tuple, optional): (connect, read) timeout in seconds. Defaults to (10, 120).
+        limits (RateLimits, optional): quotas applied by the endpoint argument of each request.
+    """
+
+    def __init__(self, pool_size=10, timeout=(10, 120), limits=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.limits = limits or RateLimits()
+        self.session = requests.Session()
+        # block instead of opening throwaway connections when the pool is exhausted
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        with self.limits(endpoint):
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request('GET', url, endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request('POST', url, endpoint, **kwargs)
+
+    def close(self):
+        self.session.close()
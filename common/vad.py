@@ -0,0 +1,143 @@
+"""Energy based silence trimming of 16 bit PCM streams.
+
+Frames whose RMS level is below a threshold are silence. Silences longer
+than `keep_silence` are cut down to their first and last halves, so speech
+keeps its natural onset and hangover. Every cut starts a new segment of the
+offset map, which translates times of the trimmed stream back to the
+source audio.
+"""
+
+import io
+import struct
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # only needed when trimming
+    np = None
+
+
+class VadReader(io.RawIOBase):
+    """File-like reader returning the source stream with long silences removed.
+
+    Args:
+        f (file): binary stream positioned at the start of the audio, with or without wav header.
+        header_size (int): bytes of wav header in front of the PCM data, 0 for raw PCM.
+        sample_rate (int): sample rate of the PCM data.
+        channels (int): channels of the PCM data, 16 bit samples.
+        threshold (float, optional): frames below this level in dBFS are silence. Defaults to -40.
+        keep_silence (float, optional): seconds of each silence kept, 0 drops it. Defaults to 0.3.
+        frame (float, optional): frame length in seconds. Defaults to 0.02.
+        block_frames (int, optional): frames analysed at a time. Defaults to 500.
+    """
+
+    def __init__(self, f, header_size, sample_rate, channels, threshold=-40.0, keep_silence=0.3,
+                 frame=0.02, block_frames=500):
+        if np is None:
+            raise ImportError('numpy is required for VAD, pip install numpy')
+        self.f = f
+        self.sample_rate = sample_rate
+        self.frame_bytes = int(sample_rate * frame) * channels * 2
+        self.frame_samples = int(sample_rate * frame)
+        self.block_frames = block_frames
+        # RMS threshold on the int16 scale
+        self.threshold = 32768 * 10 ** (threshold / 20)
+        self.keep_head = int(keep_silence / frame / 2 + 0.5)
+        self.keep_tail = self.keep_head
+        self.pending = bytearray()
+        self.eof = False
+        self.header = bytes(f.read(header_size))
+        if self.header[:4] == b'RIFF' and len(self.header) >= 44:
+            # the trimmed length is unknown, mark sizes as streaming
+            self.header = (self.header[:4] + struct.pack('<I', 0xFFFFFFFF) + self.header[8:-4]
+                           + struct.pack('<I', 0xFFFFFFFF))
+        self.pending += self.header
+        # silence run: first frames, count, ring of last frames
+        self.head = []
+        self.tail = deque(maxlen=self.keep_tail)
+        self.silent = 0
+        self.in_frames = 0
+        self.out_frames = 0
+        self.segments = []  # [out_frame, in_frame, frames]
+
+    def readable(self):
+        return True
+
+    def _emit(self, frame, in_frame):
+        seg = self.segments[-1] if self.segments else None
+        if seg is None or seg[0] + seg[2] != self.out_frames or seg[1] + seg[2] != in_frame:
+            self.segments.append([self.out_frames, in_frame, 0])
+            seg = self.segments[-1]
+        seg[2] += 1
+        self.out_frames += 1
+        self.pending += frame
+
+    def _close_silence(self, speech):
+        """Emit a finished silence run, kept whole when short."""
+        start = self.in_frames - self.silent
+        for i, frame in enumerate(self.head):
+            self._emit(frame, start + i)
+        if speech:
+            skipped = self.silent - len(self.head) - len(self.tail)
+            for i, frame in enumerate(self.tail):
+                self._emit(frame, start + len(self.head) + skipped + i)
+        self.head, self.silent = [], 0
+        self.tail.clear()
+
+    def _analyse(self, data):
+        n = len(data) // self.frame_bytes
+        if n:
+            x = np.frombuffer(data[:n * self.frame_bytes], dtype='<i2').astype(np.float32)
+            rms = np.sqrt((x.reshape(n, -1) ** 2).mean(axis=1))
+            for i, level in enumerate(rms):
+                frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+                if level >= self.threshold:
+                    if self.silent:
+                        self._close_silence(speech=True)
+                    self._emit(frame, self.in_frames)
+                elif len(self.head) < self.keep_head:
+                    self.head.append(frame)
+                    self.silent += 1
+                else:
+                    if self.keep_tail:
+                        self.tail.append(frame)
+                    self.silent += 1
+                self.in_frames += 1
+        rest = data[n * self.frame_bytes:]
+        if rest:  # trailing partial frame
+            if self.silent:
+                self._close_silence(speech=False)
+            self._emit(rest, self.in_frames)
+            self.in_frames += 1
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.pending) < size):
+            data = self.f.read(self.block_frames * self.frame_bytes)
+            if data:
+                self._analyse(data)
+            if len(data) < self.block_frames * self.frame_bytes:
+                if self.silent:
+                    self._close_silence(speech=False)
+                self.eof = True
+        if size < 0:
+            size = len(self.pending)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+    def offset_map(self):
+        """Kept segments as (trimmed start, source start, duration) in seconds."""
+        frame = self.frame_samples / self.sample_rate
+        return [(out * frame, src * frame, n * frame) for out, src, n in self.segments]
+
+
+def to_source_time(offset_map, t):
+    """Map a time of the trimmed stream back to the source audio."""
+    for out, src, duration in reversed(offset_map):
+        if t >= out:
+            return src + min(t - out, duration)
+    return t
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Transcribe a scp list with the file APIs of AISpeech and iFlytek, hedging lagging jobs.
+
+Every file goes to the primary provider. When its result is not back after
+a percentile of the primary turnaround, or the primary fails, the file also
+goes to the secondary provider and the first result is kept. Both providers
+run on the asyncio engines of their scripts in one event loop, with the
+logins those scripts use: `secret` for AISpeech, `APP_ID` and `SECRET_KEY`
+for iFlytek, in the working directory.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from functools import partial
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, path.join(ROOT, 'aispeech'))
+sys.path.insert(0, path.join(ROOT, 'iflyteck'))
+import aispeech_lasr_offline as aispeech
+import iflyteck_lfasr as iflytek
+from common.aiotransport import AsyncTransport
+from common.cache import ResultCache
+from common.hedge import HedgeDelay, hedged
+from common.journal import Journal
+from common.metrics import Metrics
+from common.pipeline import bounded_as_completed
+from common.retry import Retry
+from common.source import parse_source
+from common.transport import Transport
+
+
+PROVIDERS = {'aispeech': aispeech, 'iflytek': iflytek}
+METRICS = Metrics('hedge_')  # 对冲次数和整体耗时，各服务商的阶段耗时在各自脚本的METRICS中
+
+
+def audio_size(audio):
+    """Bytes of an audio, None if unknown before it is read."""
+    try:
+        return parse_source(audio).size()
+    except (OSError, ValueError):
+        return None
+
+
+def transcriber(module, journal, nproc):
+    """Coroutine function of a provider, turning a scp line into a result line, falsy or raising on failure."""
+    uploads = asyncio.Semaphore(nproc)
+    if module is aispeech:
+        return partial(aispeech.run_async, journal=journal, uploads=uploads)
+    return partial(iflytek.tt_async, journal=journal, uploads=uploads)
+
+
+async def run(record, primary, secondary, delay):
+    """Transcribe one scp line on the primary, hedged by the secondary once its job lags after submission."""
+    key, audio = record.split(maxsplit=1)
+    size = audio_size(audio.strip())
+    begin = time.perf_counter()
+    started = asyncio.Event()
+    submitted = None
+
+    def on_submit():
+        nonlocal submitted
+        submitted = time.perf_counter()
+        started.set()
+
+    def on_hedge(failed):
+        logging.info("%s audio: %s to the secondary provider", 'Fail over' if failed else 'Hedge', key)
+        METRICS.inc('failovers' if failed else 'hedges')
+
+    data, winner = await hedged(partial(primary, record, on_submit=on_submit), partial(secondary, record),
+                                delay.delay(size), on_hedge, started)
+    end = time.perf_counter()
+    METRICS.observe('turnaround_seconds', end - begin)
+    if winner == 0 and submitted is not None:
+        # the provider turnaround, without the wait for an upload slot
+        delay.observe(end - submitted, size)
+    elif data:
+        METRICS.inc('secondary_wins')
+    return data
+
+
+async def main_async(in_scp, out_trans, primary='aispeech', nproc=4, resume=False, max_jobs=1000, delay=None):
+    """Transcribe a scp list into out_trans, uploading nproc files at a time to each provider."""
+    for module in PROVIDERS.values():
+        module.AHTTP = AsyncTransport(module.HTTP.pool_size, module.HTTP.timeout, module.HTTP.limits)
+    names = [primary] + [name for name in PROVIDERS if name != primary]
+    audio_list_fd = open(in_scp, 'r', encoding='utf8')
+    trans_file_fd = open(out_trans, 'a' if resume else 'w', encoding='utf8')
+    # one journal for both providers, they record their server jobs under different names
+    journal = Journal(out_trans + '.journal', resume=resume)
+    try:
+        primary_fn, secondary_fn = (transcriber(PROVIDERS[name], journal, nproc) for name in names)
+        records = (record for record in audio_list_fd
+                   if len(record.split(maxsplit=1)) == 2 and not journal.is_done(record.split(maxsplit=1)[0]))
+        fn = partial(run, primary=primary_fn, secondary=secondary_fn, delay=delay or HedgeDelay())
+        async for task in bounded_as_completed(fn, records, max_jobs):
+            try:
+                data = task.result()
+            except Exception as e:
+                logging.error("Failed task: %r", e)
+                data = None
+            if not data:
+                METRICS.inc('failures')
+                continue
+            trans_file_fd.write(data)
+            trans_file_fd.flush()
+            journal.record_done(data.split('\t', 1)[0])
+    finally:
+        audio_list_fd.close()
+        trans_file_fd.close()
+        journal.close()
+        for module in PROVIDERS.values():
+            await module.AHTTP.close()
+            module.AHTTP = None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s][%(levelname)-5s] %(message)s - %(filename)s[line:%(lineno)d]'
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--primary', choices=list(PROVIDERS), default='aispeech',
+                        help='provider every file is sent to first, the other one takes over lagging files')
+    parser.add_argument('--percentile', type=float, default=95.0,
+                        help='files not done after this percentile of the primary turnaround per MB are hedged')
+    parser.add_argument('--hedge-delay', dest='hedge_delay', type=float, default=300.0,
+                        help='seconds before hedging until 20 files finished on the primary')
+    parser.add_argument('--hedge-min', dest='hedge_min', type=float, default=10.0,
+                        help='min seconds before hedging a file')
+    parser.add_argument('-nproc', '--nproc', dest='nproc', type=int, default=4,
+                        help='files uploading at a time to each provider')
+    parser.add_argument('--max-jobs', dest='max_jobs', type=int, default=1000,
+                        help='max files submitted and not yet finished')
+    parser.add_argument('--url', default=aispeech.LASR_TASK_URL, help='base url of the AISpeech file api')
+    parser.add_argument('--api-host', dest='api_host', default=iflytek.API_HOST,
+                        help='base url of the iFlytek raasr api')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='read timeout of every HTTP request in seconds')
+    parser.add_argument('--retries', type=int, default=4,
+                        help='retries of a single request on network errors, throttling and 5xx')
+    parser.add_argument('--resample', action='store_true',
+                        help='downmix and resample wav audio to 16 bit mono SAMPLE_RATE before upload')
+    parser.add_argument('--cache', default=None,
+                        help='SQLite file caching results by audio content and options, unchanged audio is not uploaded')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1024,
+                        help='max MB of cached results, least recently used are evicted')
+    parser.add_argument('--metrics', action='store_true',
+                        help='write timing histograms to out_trans.metrics.* and out_trans.<provider>.metrics.*')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip keys finished by a previous run, re-attach to their server jobs and append to out_trans.')
+    parser.add_argument('in_scp', help='Input scp file which consisit of key and value.')
+    parser.add_argument('out_trans', help='Output asr transcription.')
+    args = parser.parse_args()
+
+    aispeech.PRODUCT_ID, aispeech.API_KEY = aispeech.get_login()
+    aispeech.LASR_TASK_URL = args.url
+    iflytek.API_HOST = args.api_host
+    cache = ResultCache(args.cache, args.cache_size << 20) if args.cache else None
+    for module in PROVIDERS.values():
+        # each provider has its own circuit, while it is open its files fail over at once instead of pausing
+        module.RETRY = Retry(attempts=args.retries + 1, fail_fast=True)
+        module.HTTP = Transport(pool_size=args.nproc * module.SLICE_PARALLEL + 4, timeout=(10, args.timeout))
+        module.RESAMPLE = module.RESAMPLE or args.resample
+        module.CACHE = cache
+    delay = HedgeDelay(args.percentile, args.hedge_delay, args.hedge_min)
+    try:
+        asyncio.run(main_async(args.in_scp, args.out_trans, args.primary, args.nproc, args.resume, args.max_jobs,
+                               delay))
+    finally:
+        METRICS.log(logging.info)
+        logging.info('Hedge counters: %s', METRICS.summary()['counters'])
+        for name, module in PROVIDERS.items():
+            module.METRICS.log(lambda line, name=name: logging.info(f'{name} {line}'))
+            module.HTTP.close()
+        if args.metrics:
+            METRICS.export(args.out_trans + '.metrics')
+            for name, module in PROVIDERS.items():
+                module.METRICS.export(f'{args.out_trans}.{name}.metrics')
+        if cache is not None:
+            cache.close()
+    sys.exit(1 if METRICS.count('failures') else 0)
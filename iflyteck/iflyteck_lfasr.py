@@ -4,6 +4,8 @@
 this test script is based on the official demo release:
 https://xfyun-doc.cn-bj.ufileos.com/1564736425808301/weblfasr_python3_demo.zip
 """
+import argparse
+import asyncio
 import base64
 import codecs
 import hashlib
@@ -11,9 +13,26 @@ import hmac
 import json
 import os
 import sys
+import threading
 import time
-
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from functools import cached_property, lru_cache, partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.adaptive import AdaptiveLimiter
+from common.aiotransport import AsyncTransport
+from common.cache import ResultCache, content_key, endpoint
+from common.journal import Journal
+from common.ledger import run_ledger
+from common.metrics import Metrics
+from common.pipeline import bounded_as_completed, bounded_map
+from common.poller import Poller, wait_done
+from common.ratelimit import RateLimits, parse_limits
+from common.resample import audio_view
+from common.retry import Retry, ServiceError, http_retryable
+from common.source import parse_source
+from common.transport import Transport
 
 # interface name
 API_HOST = 'https://raasr.xfyun.cn/api'
@@ -28,41 +47,97 @@ with open('SECRET_KEY', 'r') as f:
     SECRET_KEY = f.readline().strip()
 
 MAX_WORKER = 5
+# max files submitted and not yet finished on the server
+MAX_JOBS = 1000
 
 api_prepare = '/prepare'
 api_upload = '/upload'
 api_merge = '/merge'
 api_get_progress = '/getProgress'
 api_get_result = '/getResult'
+# quota endpoint of every interface
+API_ENDPOINTS = {
+    api_prepare: 'task',
+    api_upload: 'upload',
+    api_merge: 'task',
+    api_get_progress: 'progress',
+    api_get_result: 'result',
+}
 # slice_size
 slice_size = 10485760
+# slices of one file uploaded concurrently
+SLICE_PARALLEL = 4
+# downmix and resample wav in another format to 16 bit mono SAMPLE_RATE before upload
+RESAMPLE = False
+SAMPLE_RATE = 16000
 
 # more parameter can be found in address—> https://doc.xfyun.cn/rest_api/%E8%AF%AD%E9%9F%B3%E8%BD%AC%E5%86%99.html
 max_alternatives = 0
 
+# seconds a signature is reused before signing a new ts
+SIGNA_TTL = 60
+
+# retried error numbers: internal errors and throttling
+RETRYABLE_ERR_NOS = {26000, 26100, 26603}
+# the job is still being processed: a progress of getProgress, getResult is retried
+ERR_NO_PROCESSING = 26605
+
+# keep-alive session shared by all requests, one connection per worker and poller thread
+HTTP = Transport(pool_size=MAX_WORKER * SLICE_PARALLEL + 4)
+# aiohttp session of the asyncio engine, created in its event loop with the settings of HTTP
+AHTTP = None
+# retry of a single request, the circuit breaker is shared by all requests
+RETRY = Retry()
+# results cached by audio content and options, enabled by --cache
+CACHE = None
+# stage timings of all tasks
+METRICS = Metrics('lfasr_')
+# AIMD concurrency of slice uploads, enabled by --adaptive
+UPLOADS = None
+
+
+def gene_slice_ids(slice_num):
+    """Slice ids in upload order: aaaaaaaaaa, aaaaaaaaab, ..., aaaaaaaaaz, aaaaaaaaba, ..."""
+    slice_ids = []
+    for index in range(slice_num):
+        chars = []
+        for _ in range(10):
+            index, offset = divmod(index, 26)
+            chars.append(chr(ord('a') + offset))
+        slice_ids.append(''.join(reversed(chars)))
+    return slice_ids
 
-class SliceIdGenerator:
-    def __init__(self):
-        self.__ch = 'aaaaaaaaa`'
 
-    def get_next_slice_id(self):
-        ch = self.__ch
-        j = len(ch) - 1
-        while j >= 0:
-            cj = ch[j]
-            if cj != 'z':
-                ch = ch[:j] + chr(ord(cj) + 1) + ch[j + 1:]
-                break
-            else:
-                ch = ch[:j] + 'a' + ch[j + 1:]
-                j = j - 1
-        self.__ch = ch
-        return self.__ch
+def gene_request(api_name, data, files=None, headers=None):
+    """Post one request, retried on network errors, 5xx and RETRYABLE_ERR_NOS."""
+    return RETRY.call(_gene_request, api_name, data, files, headers)
 
 
-def gene_request(api_name, data, files=None, headers=None):
-    response = requests.post(API_HOST + api_name, data=data, files=files, headers=headers)
+def _gene_request(api_name, data, files=None, headers=None):
+    response = HTTP.post(API_HOST + api_name, endpoint=API_ENDPOINTS[api_name], data=data, files=files, headers=headers)
+    return check_response(api_name, response)
+
+
+async def gene_request_async(api_name, data, files=None, headers=None):
+    """gene_request in an event loop."""
+    return await RETRY.call_async(_gene_request_async, api_name, data, files, headers)
+
+
+async def _gene_request_async(api_name, data, files=None, headers=None):
+    response = await AHTTP.post(API_HOST + api_name, endpoint=API_ENDPOINTS[api_name], data=data, files=files,
+                                headers=headers)
+    return check_response(api_name, response)
+
+
+def check_response(api_name, response):
+    """Decoded result of a response, the text for getResult, raise ServiceError on errors."""
+    if response.status_code != 200:
+        print("{} error: status code {}".format(api_name, response.status_code))
+        raise ServiceError("{} status code {}".format(api_name, response.status_code),
+                           http_retryable(response.status_code))
     result = json.loads(response.text)
+    if api_name == api_get_progress and result.get('err_no') == ERR_NO_PROCESSING:
+        return result
     if result["ok"] == 0:
         print("{} success:".format(api_name) + str(result))
         if api_name == '/getResult':
@@ -76,57 +151,87 @@ def gene_request(api_name, data, files=None, headers=None):
         return result
     else:
         print("{} error:".format(api_name) + str(result))
-        return ''
+        retryable = result.get('err_no') in RETRYABLE_ERR_NOS or (
+            api_name == api_get_result and result.get('err_no') == ERR_NO_PROCESSING)
+        raise ServiceError("{} error: {}".format(api_name, result), retryable)
+
+
+class Signer:
+    """Reuse the MD5 + HMAC-SHA1 signature while its ts is fresh."""
+
+    def __init__(self, appid, secret_key, ttl=SIGNA_TTL):
+        self.appid = appid
+        self.secret_key = secret_key
+        self.ttl = ttl
+        self.ts = None
+        self.signa = None
+        self.lock = threading.Lock()
+
+    def sign(self):
+        with self.lock:
+            now = int(time.time())
+            if self.ts is None or now - int(self.ts) >= self.ttl:
+                ts = str(now)
+                md5 = hashlib.md5((self.appid + ts).encode('utf-8')).hexdigest()
+                signa = hmac.new(self.secret_key.encode('utf-8'), md5.encode('utf-8'), hashlib.sha1).digest()
+                self.ts, self.signa = ts, str(base64.b64encode(signa), 'utf-8')
+            return self.ts, self.signa
+
+
+@lru_cache(maxsize=None)
+def get_signer(appid, secret_key):
+    return Signer(appid, secret_key)
 
 
 class RequestApi(object):
-    def __init__(self, appid, secret_key, upload_file_path):
+    def __init__(self, appid, secret_key, upload_file_path, resample=False):
         self.appid = appid
         self.secret_key = secret_key
         self.upload_file_path = upload_file_path
+        self.source = parse_source(upload_file_path)
+        self.stack = ExitStack()
+        self.resample = resample
+        self.signer = get_signer(appid, secret_key)
+        self.begun = time.perf_counter()
+        # perf_counter when the job was merged and when the server started transcribing it
+        self.merged = None
+        self.started = None
+
+    # the uploaded audio mapped read-only, wav in another format is converted to 16 bit mono SAMPLE_RATE
+    @cached_property
+    def view(self):
+        return self.stack.enter_context(audio_view(self.source, SAMPLE_RATE if self.resample else None))
+
+    # file metadata is read once per task, and only by the requests that need it
+    @cached_property
+    def file_len(self):
+        return len(self.view)
+
+    @cached_property
+    def file_name(self):
+        return self.source.name
+
+    @cached_property
+    def slice_num(self):
+        return self.file_len // slice_size + (0 if (self.file_len % slice_size == 0) else 1)
 
     # more parameter can be found in address—> https://doc.xfyun.cn/rest_api/%E8%AF%AD%E9%9F%B3%E8%BD%AC%E5%86%99.html
     def gene_params(self, apiname, taskid=None, slice_id=None):
-        appid = self.appid
-        secret_key = self.secret_key
-        upload_file_path = self.upload_file_path
-        ts = str(int(time.time()))
-        m2 = hashlib.md5()
-        m2.update((appid + ts).encode('utf-8'))
-        md5 = m2.hexdigest()
-        md5 = bytes(md5, encoding='utf-8')
-        signa = hmac.new(secret_key.encode('utf-8'), md5, hashlib.sha1).digest()
-        signa = base64.b64encode(signa)
-        signa = str(signa, 'utf-8')
-        file_len = os.path.getsize(upload_file_path)
-        file_name = os.path.basename(upload_file_path)
-        param_dict = {}
+        ts, signa = self.signer.sign()
+        param_dict = {'app_id': self.appid, 'signa': signa, 'ts': ts}
 
         if apiname == api_prepare:
             # slice_num indicates the number of fragments
-            slice_num = int(file_len / slice_size) + (0 if (file_len % slice_size == 0) else 1)
-            param_dict['app_id'] = appid
-            param_dict['signa'] = signa
-            param_dict['ts'] = ts
-            param_dict['file_len'] = str(file_len)
-            param_dict['file_name'] = file_name
-            param_dict['slice_num'] = str(slice_num)
+            param_dict['file_len'] = str(self.file_len)
+            param_dict['file_name'] = self.file_name
+            param_dict['slice_num'] = str(self.slice_num)
         elif apiname == api_upload:
-            param_dict['app_id'] = appid
-            param_dict['signa'] = signa
-            param_dict['ts'] = ts
             param_dict['task_id'] = taskid
             param_dict['slice_id'] = slice_id
         elif apiname == api_merge:
-            param_dict['app_id'] = appid
-            param_dict['signa'] = signa
-            param_dict['ts'] = ts
             param_dict['task_id'] = taskid
-            param_dict['file_name'] = file_name
+            param_dict['file_name'] = self.file_name
         elif apiname == api_get_progress or apiname == api_get_result:
-            param_dict['app_id'] = appid
-            param_dict['signa'] = signa
-            param_dict['ts'] = ts
             param_dict['task_id'] = taskid
         return param_dict
 
@@ -138,33 +243,53 @@ class RequestApi(object):
                             data=self.gene_params(api_prepare))
 
     # upload
-    def upload_request(self, taskid, upload_file_path):
-        file_object = open(upload_file_path, 'rb')
-        try:
-            index = 1
-            sig = SliceIdGenerator()
-            while True:
-                content = file_object.read(slice_size)
-                if not content or len(content) == 0:
-                    break
-                files = {
-                    "filename": self.gene_params(api_upload).get("slice_id"),
-                    "content": content
-                }
-                response = gene_request(api_upload,
-                                        data=self.gene_params(api_upload, taskid=taskid,
-                                                              slice_id=sig.get_next_slice_id()),
-                                        files=files)
-                if response.get('ok') != 0:
-                    # upload slice fail
-                    print('upload slice fail, response: ' + str(response))
-                    return False
-                print('upload slice ' + str(index) + ' success')
-                index += 1
-        finally:
-            'file index:' + str(file_object.tell())
-            file_object.close()
-        return True
+    def upload_slice(self, taskid, view, index, slice_id):
+        # the slice is a window of the mapped file, only read when the request is sent
+        with view[index * slice_size:(index + 1) * slice_size] as content:
+            RETRY.call(self.send_slice, taskid, content, slice_id)
+        print('upload slice ' + str(index + 1) + ' success')
+
+    def send_slice(self, taskid, content, slice_id):
+        # every attempt holds a slot of UPLOADS, whose size follows errors and upload latency
+        with UPLOADS.slot() if UPLOADS is not None else nullcontext():
+            return _gene_request(api_upload, data=self.gene_params(api_upload, taskid=taskid, slice_id=slice_id),
+                                 files={"content": content})
+
+    def upload_request(self, taskid):
+        slice_ids = gene_slice_ids(self.slice_num)
+        if not slice_ids:
+            return
+        with ThreadPoolExecutor(max_workers=SLICE_PARALLEL) as executor:
+            futures = [executor.submit(self.upload_slice, taskid, self.view, index, slice_id)
+                       for index, slice_id in enumerate(slice_ids)]
+            for future in futures:
+                future.result()
+
+    async def upload_slice_async(self, taskid, view, index, slice_id):
+        with view[index * slice_size:(index + 1) * slice_size] as content:
+            await RETRY.call_async(self.send_slice_async, taskid, content, slice_id)
+        print('upload slice ' + str(index + 1) + ' success')
+
+    async def send_slice_async(self, taskid, content, slice_id):
+        async with UPLOADS.async_slot() if UPLOADS is not None else nullcontext():
+            return await _gene_request_async(api_upload,
+                                             data=self.gene_params(api_upload, taskid=taskid, slice_id=slice_id),
+                                             files={"content": content})
+
+    async def upload_request_async(self, taskid):
+        slice_ids = gene_slice_ids(self.slice_num)
+        parallel = asyncio.Semaphore(SLICE_PARALLEL)
+
+        async def upload(index, slice_id):
+            async with parallel:
+                await self.upload_slice_async(taskid, self.view, index, slice_id)
+
+        # every slice is finished before the view is closed, then the first failure is raised
+        results = await asyncio.gather(*(upload(index, slice_id) for index, slice_id in enumerate(slice_ids)),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
     # merge
     def merge_request(self, taskid):
@@ -176,53 +301,168 @@ class RequestApi(object):
 
     # get result
     def get_result_request(self, taskid):
-        return gene_request(api_get_result, data=self.gene_params(api_get_result, taskid=taskid))
+        with METRICS.timer('result_seconds'):
+            result = gene_request(api_get_result, data=self.gene_params(api_get_result, taskid=taskid))
+        METRICS.observe('task_seconds', time.perf_counter() - self.begun)
+        return result
+
+    async def get_result_request_async(self, taskid):
+        with METRICS.timer('result_seconds'):
+            result = await gene_request_async(api_get_result, data=self.gene_params(api_get_result, taskid=taskid))
+        METRICS.observe('task_seconds', time.perf_counter() - self.begun)
+        return result
 
-    def all_api_request(self):
-        # prepare
-        pre_result = self.prepare_request()
-        # print(type(pre_result))
+    def submit(self):
+        """Prepare, upload and merge, return the taskid of the server job."""
         try:
+            with METRICS.timer('prepare_seconds'):
+                pre_result = self.prepare_request()
             taskid = pre_result.get('data')
 
             # Shard to upload
-            self.upload_request(taskid=taskid, upload_file_path=self.upload_file_path)
+            start = time.perf_counter()
+            self.upload_request(taskid=taskid)
+            self.observe_upload(time.perf_counter() - start)
             # merge
-            self.merge_request(taskid=taskid)
-            # get progress
-            while True:
-                # the task progress is obtained every 2 seconds
-                progress = self.get_progress_request(taskid)
-                progress_dic = progress
-                if progress_dic.get('err_no') != 0 and progress_dic.get('err_no') != 26605:
-                    print('task error: ' + progress_dic.get('failed'))
-                    return
-                else:
-                    data = progress_dic.get('data')
-                    task_status = json.loads(data)
-                    if task_status['status'] == 9:
-                        print('task ' + taskid + ' finished')
-                        break
-                    print('The task ' + taskid + ' is in processing, task status: ' + str(data))
-
-                # the task progress is obtained every 2 seconds
-                time.sleep(2)
-        except Exception:
-            return ''
+            with METRICS.timer('merge_seconds'):
+                self.merge_request(taskid=taskid)
+            self.merged = time.perf_counter()
+        finally:
+            self.stack.close()
+        return taskid
+
+    async def submit_async(self):
+        """submit in an event loop, the audio is mapped or spooled in a thread."""
+        try:
+            await asyncio.to_thread(getattr, self, 'view')
+            with METRICS.timer('prepare_seconds'):
+                pre_result = await gene_request_async(api_prepare, data=self.gene_params(api_prepare))
+            taskid = pre_result.get('data')
+            start = time.perf_counter()
+            await self.upload_request_async(taskid)
+            self.observe_upload(time.perf_counter() - start)
+            with METRICS.timer('merge_seconds'):
+                await gene_request_async(api_merge, data=self.gene_params(api_merge, taskid=taskid))
+            self.merged = time.perf_counter()
+        finally:
+            await asyncio.to_thread(self.stack.close)
+        return taskid
+
+    def observe_upload(self, elapsed):
+        METRICS.observe('upload_seconds', elapsed)
+        if self.file_len and elapsed > 0:
+            METRICS.observe('upload_mbytes_per_second', self.file_len / elapsed / 1e6)
+
+    def progress(self, taskid):
+        """Progress of a server job in [0, 100], raise ServiceError if the job failed."""
+        with METRICS.timer('progress_request_seconds'):
+            progress_dic = self.get_progress_request(taskid)
+        return self.read_progress(taskid, progress_dic)
+
+    async def progress_async(self, taskid):
+        with METRICS.timer('progress_request_seconds'):
+            progress_dic = await gene_request_async(api_get_progress,
+                                                    data=self.gene_params(api_get_progress, taskid=taskid))
+        return self.read_progress(taskid, progress_dic)
+
+    def read_progress(self, taskid, progress_dic):
+        """Progress in [0, 100] of a getProgress result."""
+        if progress_dic.get('err_no') == ERR_NO_PROCESSING:
+            print('The task ' + taskid + ' is in processing')
+            return 0
+        if progress_dic.get('err_no') != 0:
+            print('task error: ' + str(progress_dic.get('failed')))
+            raise ServiceError('task {} failed: {}'.format(taskid, progress_dic.get('failed')))
+        data = progress_dic.get('data')
+        task_status = json.loads(data)
+        self.observe_status(task_status['status'])
+        if task_status['status'] == 9:
+            print('task ' + taskid + ' finished')
+            return 100
+        print('The task ' + taskid + ' is in processing, task status: ' + str(data))
+        # status goes from 0 (created) to 9 (finished)
+        return task_status['status'] * 100 / 9
+
+    def observe_status(self, status):
+        """Record queue and transcription times, as precise as the polling interval."""
+        now = time.perf_counter()
+        # status 3 and above: the server is transcribing
+        if status >= 3 and self.started is None:
+            self.started = now
+            if self.merged is not None:
+                METRICS.observe('queue_seconds', now - self.merged)
+        if status == 9:
+            METRICS.observe('processing_seconds', now - self.started)
+
+    def fetch(self, taskid):
+        """Wait for a server job and return its result, raise ServiceError if the job failed."""
+        # the task progress is obtained every 2 seconds
+        while self.progress(taskid) < 100:
+            time.sleep(2)
         # get result
         return self.get_result_request(taskid=taskid)
 
-
-def tt(temp):
+    def attach(self, journal=None, key=None):
+        """Return the taskid recorded for key in the journal, or submit a new job."""
+        taskid = journal.job(key).get('taskid') if journal is not None else None
+        if taskid:
+            print('resume task ' + taskid)
+            return taskid
+        taskid = self.submit()
+        if journal is not None:
+            journal.record(key, taskid=taskid)
+        return taskid
+
+    async def attach_async(self, journal=None, key=None):
+        taskid = journal.job(key).get('taskid') if journal is not None else None
+        if taskid:
+            print('resume task ' + taskid)
+            return taskid
+        taskid = await self.submit_async()
+        if journal is not None:
+            journal.record(key, taskid=taskid)
+        return taskid
+
+    def all_api_request(self, journal=None, key=None):
+        """Run the whole flow, re-attaching to the server job recorded for key in the journal."""
+        return self.fetch(self.attach(journal, key))
+
+
+def cached(audio):
+    """Cache key and cached text of an audio, (None, None) without a cache."""
+    if CACHE is None:
+        return None, None
+    digest = content_key(audio, dict(url=endpoint(API_HOST), app_id=APP_ID, sample_rate=SAMPLE_RATE, resample=RESAMPLE))
+    return digest, CACHE.get(digest)
+
+
+def remember(digest, text):
+    if digest is not None and text:
+        CACHE.put(digest, text)
+    return text
+
+
+def tt(temp, journal=None, poller=None):
     temp = temp.strip()
     # print(temp)
-    if len(temp.split()) == 2:  # source_info_list format: "key\taudio"
+    if len(temp.split(maxsplit=1)) == 2:  # source_info_list format: "key\taudio", audio may be a pipe
         key, audio = temp.split(maxsplit=1)
         sys.stderr.write('\tkey:' + key + '\taudio:' + audio + '\n')
         sys.stderr.flush()
 
-        api = RequestApi(appid=APP_ID, secret_key=SECRET_KEY, upload_file_path=audio)
-        text = api.all_api_request()
+        digest, text = cached(audio)
+        if text is not None:
+            print(f'{key} is cached')
+            METRICS.inc('cache_hits')
+            return '{0}'.format(key + '\t' + text + '\n')
+        api = RequestApi(appid=APP_ID, secret_key=SECRET_KEY, upload_file_path=audio, resample=RESAMPLE)
+        if poller is not None:
+            # hand the server job over to the poller and free this thread
+            taskid = api.attach(journal=journal, key=key)
+            return poller.watch(partial(api.progress, taskid),
+                                lambda: '{0}'.format(key + '\t' + remember(digest, api.get_result_request(taskid)) + '\n'),
+                                name=key)
+        text = remember(digest, api.all_api_request(journal=journal, key=key))
 
         # print('text--------->', text)
         print(f'{key} is success')
@@ -232,23 +472,133 @@ def tt(temp):
         return '{0}'.format("Invalid line: " + temp + "\n")
 
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+async def tt_async(temp, journal=None, uploads=None, on_submit=None):
+    """tt in an event loop, a file holds the uploads semaphore until its job is merged.
 
+    on_submit, if given, is called once the job is merged on the server.
+    """
+    temp = temp.strip()
+    if len(temp.split(maxsplit=1)) != 2:
+        return '{0}'.format("Invalid line: " + temp + "\n")
+    key, audio = temp.split(maxsplit=1)
+    sys.stderr.write('\tkey:' + key + '\taudio:' + audio + '\n')
+    sys.stderr.flush()
+
+    # hashing the audio for the cache reads the whole file
+    digest, text = await asyncio.to_thread(cached, audio)
+    if text is not None:
+        print(f'{key} is cached')
+        METRICS.inc('cache_hits')
+        return '{0}'.format(key + '\t' + text + '\n')
+    async with uploads or nullcontext():
+        api = RequestApi(appid=APP_ID, secret_key=SECRET_KEY, upload_file_path=audio, resample=RESAMPLE)
+        taskid = await api.attach_async(journal=journal, key=key)
+    if on_submit is not None:
+        on_submit()
+    await wait_done(partial(api.progress_async, taskid), min_interval=2, name=key)
+    return '{0}'.format(key + '\t' + remember(digest, await api.get_result_request_async(taskid)) + '\n')
+
+
+def submit_only(temp, journal):
+    """Upload one scp line and record its taskid, without waiting for the result."""
+    key, audio = temp.split(maxsplit=1)
+    if cached(audio)[1] is not None:
+        print(f'{key} is cached')
+        return ''
+    api = RequestApi(appid=APP_ID, secret_key=SECRET_KEY, upload_file_path=audio, resample=RESAMPLE)
+    taskid = api.attach(journal=journal, key=key)
+    print(f'{key} submitted, task {taskid}')
+    return ''
 
-def main():
-    source_info_list = codecs.open(sys.argv[1], 'r', 'utf8')
-    result_file_path = codecs.open(sys.argv[2], 'w+', 'utf8')
-    # audio_num = len(source_info_list.readlines())
+
+def collect_only(temp, journal):
+    """Fetch the result of a submitted scp line if its job is finished, else return ''."""
+    key, audio = temp.split(maxsplit=1)
+    digest, text = cached(audio)
+    if text is not None:
+        return '{0}'.format(key + '\t' + text + '\n')
+    taskid = journal.job(key).get('taskid')
+    if not taskid:
+        print(f'{key} has no submitted task')
+        return ''
+    api = RequestApi(appid=APP_ID, secret_key=SECRET_KEY, upload_file_path=audio)
+    try:
+        if api.progress(taskid) < 100:
+            return ''
+    except RuntimeError as e:
+        print(f'{key} failed: {e!r}')
+        METRICS.inc('failures')
+        return ''
+    return '{0}'.format(key + '\t' + remember(digest, api.get_result_request(taskid)) + '\n')
+
+
+async def main_async(in_scp, out_trans, resume=False):
+    """Run mode in one event loop: MAX_WORKER files uploading, MAX_JOBS in flight on one connection pool."""
+    global AHTTP
+    AHTTP = AsyncTransport(HTTP.pool_size, HTTP.timeout, HTTP.limits)
+    source_info_list = codecs.open(in_scp, 'r', 'utf8')
+    result_file_path = codecs.open(out_trans, 'a' if resume else 'w+', 'utf8')
+    journal = Journal(out_trans + '.journal', resume=resume)
+    records = (temp for temp in source_info_list if temp.strip() and not journal.is_done(temp.split()[0]))
+    fn = partial(tt_async, journal=journal, uploads=asyncio.Semaphore(MAX_WORKER))
+    try:
+        async for task in bounded_as_completed(fn, records, MAX_JOBS):
+            try:
+                data = task.result()
+            except Exception as e:
+                print('task failed: ' + repr(e))
+                METRICS.inc('failures')
+                continue  # failed jobs are left out of the journal and retried on resume
+            result_file_path.write(data)
+            result_file_path.flush()
+            if not data.startswith('Invalid line: '):
+                journal.record_done(data.split('\t', 1)[0])
+                METRICS.inc('tasks')
+    finally:
+        source_info_list.close()
+        result_file_path.close()
+        journal.close()
+        await AHTTP.close()
+        AHTTP = None
+
+
+def main(in_scp, out_trans, resume=False, mode='run', engine='threads'):
+    if engine == 'asyncio':
+        return asyncio.run(main_async(in_scp, out_trans, resume))
+    # the journal is the manifest of submitted tasks, never truncate it in submit and collect modes
+    resume = resume or mode != 'run'
+    source_info_list = codecs.open(in_scp, 'r', 'utf8')
+    result_file_path = codecs.open(out_trans, 'a' if resume else 'w+', 'utf8')
+    journal = Journal(out_trans + '.journal', resume=resume)
+    poller = Poller(min_interval=2)
     # Enable a thread pool of up to 10 threads
     executor = ThreadPoolExecutor(max_workers=MAX_WORKER)
-    # Create a task and add it to the list
-    all_task = [executor.submit(tt, (temp)) for temp in source_info_list]
-    for future in as_completed(all_task):
-        data = future.result()
+    # Keep a bounded window of tasks in flight, reading the next line as a slot frees
+    records = (temp for temp in source_info_list if temp.strip() and not journal.is_done(temp.split()[0]))
+    if mode == 'submit':
+        fn, window = partial(submit_only, journal=journal), 2 * MAX_WORKER
+    elif mode == 'collect':
+        fn, window = partial(collect_only, journal=journal), 2 * MAX_WORKER
+    else:
+        fn, window = partial(tt, journal=journal, poller=poller), MAX_JOBS
+    for future in bounded_map(executor, fn, records, window):
+        try:
+            data = future.result()
+        except Exception as e:
+            print('task failed: ' + repr(e))
+            METRICS.inc('failures')
+            continue  # failed jobs are left out of the journal and retried on resume
+        if not data:
+            continue
         result_file_path.write(data)
         result_file_path.flush()
+        if not data.startswith('Invalid line: '):
+            journal.record_done(data.split('\t', 1)[0])
+            METRICS.inc('tasks')
     source_info_list.close()
     result_file_path.close()
+    journal.close()
+    poller.close()
 
 
 '''
@@ -256,7 +606,66 @@ If the requests module reports an error: "NoneType" object has no attribute 'rea
 module to 2.20.0 or later
 '''
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("asr_api.py <in_scp> <out_trans>")
-        exit(-1)
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(usage='iflyteck_lfasr.py [--resume] [--mode {run,submit,collect}] '
+                                           '[--engine {threads,asyncio}] <in_scp> <out_trans>')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip keys finished by a previous run, re-attach to their server jobs and append to out_trans.')
+    parser.add_argument('--mode', choices=['run', 'submit', 'collect'], default='run',
+                        help='run: submit and wait for results; submit: upload and record task ids in out_trans.journal; '
+                             'collect: append results of finished tasks to out_trans, can be repeated')
+    parser.add_argument('--api-host', dest='api_host', default=API_HOST,
+                        help='base url of the raasr api, e.g. of a local mock server')
+    parser.add_argument('--limit', action='append', default=[], metavar='ENDPOINT=QPS[:CONCURRENCY]',
+                        help='quota of an endpoint (upload, task, progress, result), can be repeated')
+    parser.add_argument('--resample', action='store_true',
+                        help='downmix and resample wav audio to 16 bit mono SAMPLE_RATE before upload')
+    parser.add_argument('--cache', default=None,
+                        help='SQLite file caching results by audio content and options, unchanged audio is not uploaded')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1024,
+                        help='max MB of cached results, least recently used are evicted')
+    parser.add_argument('--metrics', action='store_true',
+                        help='write stage timing histograms to out_trans.metrics.json and out_trans.metrics.prom')
+    parser.add_argument('--adaptive', type=int, default=None, metavar='MAX',
+                        help='adapt concurrent slice uploads between 1 and MAX, starting at MAX_WORKER * SLICE_PARALLEL')
+    parser.add_argument('--retries', type=int, default=4,
+                        help='retries of a single request on network errors, throttling and 5xx')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='asyncio: run mode in one event loop, MAX_WORKER files uploading and MAX_JOBS in flight')
+    parser.add_argument('--ledger', default=None,
+                        help='ledger file on shared storage, all workers running this command share its units')
+    parser.add_argument('--unit-size', dest='unit_size', type=int, default=100,
+                        help='lines of the scp list in a unit of the ledger')
+    parser.add_argument('--lease', type=float, default=300.0,
+                        help='seconds after the last heartbeat of a worker its unit is given to another one')
+    parser.add_argument('in_scp')
+    parser.add_argument('out_trans')
+    args = parser.parse_args()
+    if args.ledger and args.mode != 'run':
+        parser.error('--ledger only works in run mode')
+    if args.engine == 'asyncio' and args.mode != 'run':
+        parser.error('--engine asyncio only works in run mode')
+    if args.adaptive:
+        UPLOADS = AdaptiveLimiter(MAX_WORKER * SLICE_PARALLEL, args.adaptive)
+        # enough files in upload for the limit to grow up to its max
+        MAX_WORKER = max(MAX_WORKER, -(-args.adaptive // SLICE_PARALLEL))
+    HTTP = Transport(pool_size=MAX_WORKER * SLICE_PARALLEL + 4, limits=RateLimits(parse_limits(args.limit)))
+    RETRY = Retry(attempts=args.retries + 1)
+    RESAMPLE = RESAMPLE or args.resample
+    API_HOST = args.api_host
+    if args.cache:
+        CACHE = ResultCache(args.cache, args.cache_size << 20)
+    try:
+        if args.ledger:
+            run_unit = partial(main, resume=True, engine=args.engine)
+            # files failed in a unit are retried with the unit, only failed units fail the run
+            failed = run_ledger(args.ledger, args.in_scp, args.out_trans, run_unit, args.unit_size, args.lease)
+        else:
+            main(args.in_scp, args.out_trans, args.resume, args.mode, args.engine)
+            failed = METRICS.count('failures')
+    finally:
+        METRICS.log(print)
+        if args.metrics:
+            METRICS.export(args.out_trans + '.metrics')
+        if CACHE is not None:
+            CACHE.close()
+    sys.exit(1 if failed else 0)
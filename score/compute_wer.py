@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Score transcripts against references, per utterance and in total.
+
+Both files hold `key text` lines, like out_trans of every script and Kaldi
+text files. The transcripts are loaded by key, the references are read in
+chunks which a pool of processes aligns, with a bounded window of chunks in
+flight, so the references are never held in memory at once.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import time
+from functools import partial
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from common.pipeline import bounded_map
+from common.score import UNITS, Score, align, normalize, tokenize
+
+
+CHUNK = 2000  # utterances aligned by one task
+NAMES = {'char': 'CER', 'word': 'WER', 'mixed': 'MER'}
+
+
+def split_line(line):
+    """Key and text of a `key text` or `key\ttext` line, the text may be empty."""
+    parts = line.rstrip('\r\n').split(maxsplit=1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+def load_texts(path):
+    texts = {}
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            if line.strip():
+                key, text = split_line(line)
+                texts.setdefault(key, text)  # the first line of a key wins, as in merged ledger parts
+    return texts
+
+
+def chunks(ref_path, hyps, size=CHUNK):
+    """Lists of (key, reference, transcript) in reference order, the transcript None if missing."""
+    chunk = []
+    with open(ref_path, 'r', encoding='utf8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            key, ref = split_line(line)
+            chunk.append((key, ref, hyps.get(key)))
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_chunk(item, units=('char',), punct=False, case=False):
+    """Index of a chunk and, per utterance, its key and (reference tokens, sub, ins, del) of every unit."""
+    index, chunk = item
+    rows = []
+    for key, ref, hyp in chunk:
+        ref, hyp = normalize(ref, punct, case), normalize(hyp or '', punct, case)
+        counts = []
+        for unit in units:
+            ref_tokens = tokenize(ref, unit)
+            counts.append((len(ref_tokens),) + align(ref_tokens, tokenize(hyp, unit)))
+        rows.append((key, counts))
+    return index, rows
+
+
+def in_order(results):
+    """Chunk results in input order, from (index, rows) in any order."""
+    waiting, following = {}, 0
+    for index, rows in results:
+        waiting[index] = rows
+        while following in waiting:
+            yield waiting.pop(following)
+            following += 1
+
+
+def main(ref_path, hyp_path, units=('char',), nproc=1, details=None, punct=False, case=False):
+    """Score hyp_path against ref_path, return the Score of every unit and the missing and extra keys."""
+    hyps = load_texts(hyp_path)
+    scores = {unit: Score() for unit in units}
+    scored = set()
+    missing = 0
+    fn = partial(score_chunk, units=units, punct=punct, case=case)
+
+    def count(chunk):
+        nonlocal missing
+        for key, _, hyp in chunk:
+            scored.add(key)
+            missing += hyp is None
+        return chunk
+
+    items = enumerate(count(chunk) for chunk in chunks(ref_path, hyps))
+    details_fd = open(details, 'w', encoding='utf8') if details else None
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=nproc) if nproc > 1 else None
+    try:
+        if executor is None:
+            results = map(fn, items)
+        else:
+            results = (future.result() for future in bounded_map(executor, fn, items, 4 * nproc))
+        if details_fd is not None:
+            details_fd.write('key\tunit\tref\tsub\tins\tdel\trate\n')
+        for rows in in_order(results):
+            for key, counts in rows:
+                for unit, (ref, sub, ins, dels) in zip(units, counts):
+                    scores[unit].add(ref, sub, ins, dels)
+                    if details_fd is not None:
+                        rate = 100.0 * (sub + ins + dels) / ref if ref else 0.0
+                        details_fd.write(f'{key}\t{unit}\t{ref}\t{sub}\t{ins}\t{dels}\t{rate:.2f}\n')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if details_fd is not None:
+            details_fd.close()
+    extra = sum(1 for key in hyps if key not in scored)
+    return scores, missing, extra
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s][%(levelname)-5s] %(message)s - %(filename)s[line:%(lineno)d]'
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--unit', action='append', choices=UNITS, default=None,
+                        help='char: CER over non-space characters; word: WER over whitespace separated words; '
+                             'mixed: CJK characters and other words; can be repeated, defaults to char')
+    parser.add_argument('-nproc', '--nproc', dest='nproc', type=int, default=os.cpu_count() or 1,
+                        help='processes aligning utterances')
+    parser.add_argument('--details', default=None,
+                        help='write the counts of every utterance to this tsv file, in reference order')
+    parser.add_argument('--json', default=None, help='also write the totals to this file')
+    parser.add_argument('--keep-punct', dest='punct', action='store_true',
+                        help='score punctuation and symbols, removed by default')
+    parser.add_argument('--case-sensitive', dest='case', action='store_true',
+                        help='score letters case sensitively, lowercased by default')
+    parser.add_argument('ref', help='reference text, lines of key and text')
+    parser.add_argument('hyp', help='transcripts, e.g. out_trans of a script')
+    args = parser.parse_args()
+
+    units = tuple(dict.fromkeys(args.unit or ['char']))
+    start = time.perf_counter()
+    scores, missing, extra = main(args.ref, args.hyp, units, args.nproc, args.details, args.punct, args.case)
+    logging.info(f'Scored {scores[units[0]].utterances} utterances in {time.perf_counter() - start:.1f}s')
+    for unit in units:
+        print(scores[unit].report(NAMES[unit]))
+    print(f'Scored {scores[units[0]].utterances} utterances, {missing} without transcript, '
+          f'{extra} transcripts without reference')
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump(dict({NAMES[unit]: scores[unit].to_dict() for unit in units}, missing=missing, extra=extra),
+                      f, indent=2)